@@ -0,0 +1,132 @@
+"""
+Micro-benchmark агрегації /rates/history на синтетичних записах.
+
+Порівнює попередній алгоритм (лінійний пошук bucket у data_points для кожного
+запису - O(n * buckets)) з HistoryAggregator (bucket у dict - O(n)) та
+векторизованою NumPy агрегацією (history_numpy): з сирих записів (включно з
+перетворенням на колонки) і з готових колонок (як у history_store).
+База даних не потрібна: history.py імпортує storage, а той звертається до
+supabase_client лише при першому запиті.
+
+Запуск:
+    python benchmark_history.py --rows 20000 50000 --days 90 --interval hour
+    python benchmark_history.py --rows 10000 100000 1000000 --no-legacy
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from history import INTERVAL_US, HistoryAggregator, from_epoch_us, make_data_point, to_epoch_us
+from history_numpy import HISTORY_NUMPY, aggregate_columns, aggregate_records, records_to_columns
+
+CHANNEL_MAP = {i: f"EXCHANGER_{i}" for i in range(1, 8)}
+
+
+def make_rows(count, days):
+    """Синтетичні записи однієї пари за останні days днів, відсортовані за edited DESC."""
+    random.seed(42)
+    now = datetime.utcnow()
+    span = days * 24 * 3600
+    rows = []
+    for _ in range(count):
+        edited = now - timedelta(seconds=random.randint(0, span - 1))
+        buy = round(41.0 + random.uniform(-0.5, 0.5), 2)
+        rows.append({
+            "channel_id": random.randint(1, len(CHANNEL_MAP)),
+            "buy": buy,
+            "sell": round(buy + random.uniform(0.05, 0.4), 2),
+            "edited": edited.isoformat() + "+00:00"
+        })
+    rows.sort(key=lambda row: row["edited"], reverse=True)
+    return rows
+
+
+def legacy_aggregate(rows, cutoff_date, interval, channel_map):
+    """Попередня реалізація з get_rates_history (лінійний пошук існуючого bucket)."""
+    data_points = []
+    seen_times = set()
+    for rate in rows:
+        edited_str = rate.get("edited")
+        if "T" in edited_str:
+            rate_time = datetime.fromisoformat(edited_str.replace("Z", "+00:00"))
+        else:
+            rate_time = datetime.strptime(edited_str, "%Y-%m-%d %H:%M:%S")
+        if rate_time.tzinfo:
+            rate_time = rate_time.replace(tzinfo=None)
+        if rate_time < cutoff_date:
+            continue
+        if interval == "hour":
+            time_key = rate_time.replace(minute=0, second=0, microsecond=0)
+        else:
+            time_key = rate_time.replace(hour=0, minute=0, second=0, microsecond=0)
+        time_iso = time_key.isoformat() + "Z"
+        if time_iso not in seen_times:
+            data_points.append({
+                "timestamp": time_iso,
+                "buy": rate.get("buy"),
+                "sell": rate.get("sell"),
+                "exchanger": channel_map.get(rate.get("channel_id"), "Unknown")
+            })
+            seen_times.add(time_iso)
+        else:
+            for dp in data_points:
+                if dp["timestamp"] == time_iso:
+                    if rate.get("buy") and (dp["buy"] is None or rate.get("buy") > dp["buy"]):
+                        dp["buy"] = rate.get("buy")
+                        dp["exchanger"] = channel_map.get(rate.get("channel_id"), "Unknown")
+                    if rate.get("sell") and (dp["sell"] is None or rate.get("sell") < dp["sell"]):
+                        dp["sell"] = rate.get("sell")
+                    break
+    data_points.sort(key=lambda x: x["timestamp"])
+    return data_points
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[20000, 50000], help="Кількість синтетичних записів")
+    parser.add_argument("--days", type=int, default=90, help="Період історії (днів)")
+    parser.add_argument("--interval", choices=["hour", "day"], default="hour")
+    parser.add_argument("--no-legacy", action="store_true", help="Не запускати попередній O(n * buckets) алгоритм (для 100k+ записів)")
+    args = parser.parse_args()
+
+    cutoff_date = datetime.utcnow() - timedelta(days=args.days)
+
+    print(f"🧪 History aggregation benchmark: {args.days} days, interval={args.interval}")
+    print("=" * 70)
+    for count in args.rows:
+        rows = make_rows(count, args.days)
+        points, new_time = timed(
+            lambda: HistoryAggregator(args.interval, cutoff_date, CHANNEL_MAP).add_all(rows).data_points()
+        )
+        line = f"{count:>8} rows, {len(points):>5} buckets | aggregator {new_time:7.3f}s"
+
+        if not args.no_legacy:
+            legacy, legacy_time = timed(lambda: legacy_aggregate(rows, cutoff_date, args.interval, CHANNEL_MAP))
+            # Нове поле sell_exchanger не входить у попередній формат
+            same = legacy == [{k: v for k, v in p.items() if k != "sell_exchanger"} for p in points]
+            line += f" | legacy {legacy_time:7.3f}s (x{legacy_time / new_time:.1f} slower) {'✅' if same else '❌ differs'}"
+
+        if HISTORY_NUMPY:
+            numpy_points, numpy_time = timed(lambda: aggregate_records(rows, args.interval, cutoff_date, CHANNEL_MAP))
+            columns = records_to_columns(rows)
+            buckets, columns_time = timed(
+                lambda: aggregate_columns(*columns, to_epoch_us(cutoff_date), INTERVAL_US[args.interval])
+            )
+            same = numpy_points == points == [make_data_point(from_epoch_us(b), p, CHANNEL_MAP) for b, p in buckets]
+            line += (f" | numpy {numpy_time:7.3f}s (x{new_time / numpy_time:.1f}) | "
+                     f"numpy columns {columns_time:7.3f}s (x{new_time / columns_time:.1f}) {'✅ same output' if same else '❌ output differs'}")
+        print(line)
+
+    if not HISTORY_NUMPY:
+        print("ℹ️  NumPy is not installed (or HISTORY_NUMPY=0) - vectorized engine skipped")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,195 @@
+"""
+Навантажувальний benchmark: пропускна здатність endpoints при одночасних клієнтах
+до і після винесення блокуючих запитів Supabase з event loop.
+
+Замість справжнього Supabase використовується локальний stub-клієнт, який імітує
+мережеву затримку PostgREST (time.sleep), тому benchmark не потребує .env і мережі.
+З --backend sqlite ті самі дані завантажуються у вбудовану SQLite базу
+(storage.SQLiteRepository) - навантаження на справжні SQL запити без мережі.
+
+Режими:
+  before - запити виконуються прямо в event loop (як раніше: supabase...execute() в async def)
+  after  - запити виконуються через db.run_query (обмежений пул потоків)
+
+Запуск:
+    python benchmark_load.py --clients 20 --requests 10 --latency 0.05
+    python benchmark_load.py --backend sqlite
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+import types
+
+CHANNELS = [{"id": i, "name": f"EXCHANGER_{i}"} for i in range(1, 8)]
+PAIRS = [("USD", "UAH"), ("EUR", "UAH"), ("PLN", "UAH"), ("GBP", "UAH"), ("CHF", "UAH")]
+
+
+class StubResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class StubQuery:
+    """Мінімальний PostgREST query builder: ігнорує фільтри, імітує затримку мережі."""
+
+    def __init__(self, table, latency):
+        self.table_name = table
+        self.latency = latency
+
+    def __getattr__(self, name):
+        # select/eq/gte/in_/or_/order/limit/... - повертають той самий builder
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        time.sleep(self.latency)
+        if self.table_name == "channels":
+            return StubResponse(list(CHANNELS))
+        rows = []
+        for minute in range(3):
+            for channel in CHANNELS:
+                for currency_a, currency_b in PAIRS:
+                    rows.append({
+                        "channel_id": channel["id"],
+                        "currency_a": currency_a,
+                        "currency_b": currency_b,
+                        "buy": 40.0 + channel["id"] * 0.01 + minute * 0.05,
+                        "sell": 41.0 - channel["id"] * 0.01 + minute * 0.05,
+                        "edited": f"2025-11-03T15:0{minute}:00+00:00"
+                    })
+        rows.sort(key=lambda row: row["edited"], reverse=True)
+        # id - для keyset сторінок (storage._iter_keyset)
+        for row_id, row in enumerate(rows, 1):
+            row["id"] = row_id
+        return StubResponse(rows)
+
+
+class StubClient:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def table(self, name):
+        return StubQuery(name, self.latency)
+
+
+def load_app(latency, backend="stub"):
+    """Імпортує main з stub-клієнтом замість supabase_client (і без keep-alive потоку)."""
+    stub_client_module = types.ModuleType("supabase_client")
+    stub_client_module.supabase = StubClient(latency)
+    sys.modules["supabase_client"] = stub_client_module
+
+    stub_keep_alive = types.ModuleType("keep_alive")
+    stub_keep_alive.keep_alive = lambda: None
+    sys.modules["keep_alive"] = stub_keep_alive
+
+    import main
+    import snapshot
+    if backend == "sqlite":
+        import storage
+        repository = storage.SQLiteRepository(":memory:")
+        repository.upsert_channels(CHANNELS)
+        repository.insert_rates([
+            {key: value for key, value in row.items() if key != "id"}
+            for row in StubQuery("rates", 0).execute().data
+        ])
+        storage.set_repository(repository)
+    # Кожен запит оновлює snapshot, щоб навантаження на базу було однаковим у обох режимах
+    snapshot.rates_snapshot.refresh_interval = 0
+    return main
+
+
+# Модулі, що імпортують db.run_query (snapshot.load, тренди best_rates, довідник обмінників)
+RUN_QUERY_MODULES = ("main", "best_rates", "channels", "snapshot")
+
+
+def set_run_query(run_query):
+    for name in RUN_QUERY_MODULES:
+        sys.modules[name].run_query = run_query
+
+
+def use_blocking_calls():
+    """Режим "before": блокуючі виклики прямо в event loop."""
+    async def run_query(fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+    set_run_query(run_query)
+
+
+async def run_load(main, clients, requests_per_client):
+    loop_lags = []
+    errors = []
+    done = asyncio.Event()
+
+    async def ticker():
+        # Наскільки пізніше запланованого прокидається корутина - це і є затримка
+        # для будь-якого іншого запиту (напр. /health), поки event loop заблокований
+        while not done.is_set():
+            scheduled = time.perf_counter()
+            await asyncio.sleep(0.005)
+            loop_lags.append(time.perf_counter() - scheduled - 0.005)
+
+    async def client():
+        for _ in range(requests_per_client):
+            # Усі параметри явно: значення за замовчуванням - Query(...), а не None
+            response = await main.get_best_rates(currencies=None, exchangers=None, city=None, limit=None, offset=0,
+                                                 cursor=None, top_k=None, if_none_match=None)
+            # Помилку endpoint повертає як JSONResponse 500, а не виняток
+            if getattr(response, "status_code", 200) >= 400:
+                errors.append(response.status_code)
+            await main.health_check()
+
+    ticker_task = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await ticker_task
+
+    total_requests = clients * requests_per_client * 2
+    return {
+        "elapsed": elapsed,
+        "throughput": total_requests / elapsed,
+        "lag_p50": statistics.median(loop_lags) * 1000,
+        "lag_max": max(loop_lags) * 1000,
+        "errors": len(errors)
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=20, help="Кількість одночасних клієнтів")
+    parser.add_argument("--requests", type=int, default=10, help="Кількість ітерацій на клієнта")
+    parser.add_argument("--latency", type=float, default=0.05, help="Імітована затримка одного запиту до бази (сек)")
+    parser.add_argument("--backend", choices=("stub", "sqlite"), default="stub", help="stub (імітація PostgREST) або sqlite (вбудована база)")
+    args = parser.parse_args()
+
+    app_module = load_app(args.latency, args.backend)
+    from db import run_query as real_run_query
+
+    latency = "embedded SQLite" if args.backend == "sqlite" else f"DB latency {args.latency * 1000:.0f} ms"
+    print(f"🧪 Load benchmark: {args.clients} clients x {args.requests} iterations, {latency}")
+    print("=" * 70)
+
+    results = {}
+    for mode in ("before", "after"):
+        if mode == "before":
+            use_blocking_calls()
+        else:
+            set_run_query(real_run_query)
+        results[mode] = asyncio.run(run_load(app_module, args.clients, args.requests))
+        r = results[mode]
+        print(f"{mode:>6}: {r['throughput']:8.1f} req/s | elapsed {r['elapsed']:6.2f}s | "
+              f"event loop lag p50 {r['lag_p50']:6.1f} ms, max {r['lag_max']:6.1f} ms | errors {r['errors']}")
+
+    print("=" * 70)
+    print(f"Speedup: x{results['after']['throughput'] / results['before']['throughput']:.1f}")
+    failed = sum(r["errors"] for r in results.values())
+    if failed:
+        # Пропускна здатність помилкових відповідей нічого не важить
+        print(f"❌ {failed} requests failed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
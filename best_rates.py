@@ -0,0 +1,277 @@
+"""
+Best buy/sell rates per currency pair (/rates/bestrate and its stream).
+
+Groups the latest quote of every exchanger by currency pair, picks
+buy_best = max(buy) and sell_best = min(sell), and adds trend analytics
+for the best exchangers. With top_k, the K best buy and K best sell quotes
+of every pair are selected with bounded heaps (heapq.nlargest/nsmallest)
+and get their own trends. With a city filter the candidates come straight
+from the snapshot's per-city index (precomputed best buy/sell per pair), so
+other cities are never looked at. Trend baselines come from the snapshot (maintained
+as new rates arrive); only baselines it does not know yet are resolved with
+one batched history lookup (for all pairs and all K entries at once) and then
+remembered.
+"""
+import heapq
+import logging
+from bisect import bisect_right
+from typing import List, Optional
+
+from channels import channel_directory, normalize_city
+from db import run_query
+from snapshot import rates_snapshot, seen_at
+from trends import calculate_trend_and_changes, find_previous_rates_batch
+
+logger = logging.getLogger(__name__)
+
+
+def _apply_trend(result: dict, prefix: str, current_value: float, previous_value) -> None:
+    # All previous rates identical or no previous record -> defaults stay "stable"
+    if previous_value is not None:
+        analytics = calculate_trend_and_changes(current_value, previous_value)
+        result[f"{prefix}trend"] = analytics["trend"]
+        result[f"{prefix}change_abs"] = analytics["change_abs"]
+        result[f"{prefix}change_pct"] = analytics["change_pct"]
+
+
+def _trend_target(result: dict, prefix: str, side: str, record: dict, pair_key: str, rate_records_map: dict) -> Optional[tuple]:
+    """
+    Trend lookup for one quote: (result, prefix, side, current value, lookup, edited),
+    or None when the exchanger is not in the directory.
+    
+    Для BUY порівнюємо тільки buy значення при skip-duplicate, для SELL - тільки sell.
+    """
+    # Find channel_id for the exchanger
+    channel_id = channel_directory.id_of(record["exchanger"])
+    if not channel_id:
+        return None
+    
+    # Get full rate record (to get both buy and sell for duplicate skipping)
+    current_rate = rate_records_map.get((pair_key, record["exchanger"]))
+    currency_a, currency_b = pair_key.split("/")
+    return (result, prefix, side, record["value"], {
+        "channel_id": channel_id,
+        "currency_a": currency_a,
+        "currency_b": currency_b,
+        "current_buy": record["value"] if side == "buy" else (current_rate.get("buy") if current_rate else None),
+        "current_sell": record["value"] if side == "sell" else (current_rate.get("sell") if current_rate else None),
+        "compare_value_type": side
+    }, record["edited"])
+
+
+def _top_entry(record: dict) -> dict:
+    # Defaults (stable) - overwritten after the batch trend lookup
+    return {
+        "value": record["value"],
+        "exchanger": record["exchanger"],
+        "timestamp": record["timestamp"],
+        "trend": "stable",
+        "change_abs": 0.0,
+        "change_pct": 0.0
+    }
+
+
+async def compute_best_rates(currency_pairs: List[str], exchanger_names: List[str], limit: Optional[int] = None, offset: Optional[int] = 0, cursor: Optional[str] = None, city: Optional[str] = None, top_k: Optional[int] = None) -> Optional[dict]:
+    """
+    Builds the /rates/bestrate response body from the latest-rates snapshot.
+    
+    Pairs are ordered by currency pair and the page is chosen before any trend
+    lookups, so trends are only computed for the pairs that are returned.
+    With top_k, every pair also gets buy_top/sell_top: the K best quotes
+    (best first), each with its own trend fields.
+    Expects the channel directory and the snapshot to be loaded already.
+    
+    Returns:
+        dict with success/data/meta, or None when no exchanger matches the filter
+        or there are no rates at all (the endpoint answers with an empty list).
+        meta.degraded is True when the history trend lookup failed and some
+        trends fell back to "stable" - such a body must not be cached
+    """
+    channel_map = channel_directory.names
+    
+    # Apply exchanger filter if provided
+    filtered_channel_ids = None
+    if exchanger_names:
+        # Get channel IDs for these exchangers
+        filtered_channel_ids = channel_directory.ids_for(exchanger_names)
+        if not filtered_channel_ids:
+            # No matching exchangers found
+            return None
+    
+    if city:
+        # Per-city index lookup: only exchangers of the city (channels.city) are candidates;
+        # without an exchanger filter (and top_k) just the precomputed best buy/sell record of each pair
+        rates_snapshot.set_channel_cities(channel_directory.cities, channel_directory.version)
+        latest = rates_snapshot.city_latest(normalize_city(city), channel_ids=filtered_channel_ids, pairs=currency_pairs or None, best_only=not top_k)
+    else:
+        # Latest record per (channel_id, currency_a, currency_b), newest first
+        latest = rates_snapshot.latest(channel_ids=filtered_channel_ids)
+    
+    if not latest:
+        return None
+    
+    latest_rates = {}
+    
+    for rate in latest:
+        channel_id = rate.get("channel_id")
+        
+        # Apply currency filter if provided
+        if currency_pairs:
+            pair_formatted = f"{rate['currency_a']}/{rate['currency_b']}"
+            if pair_formatted not in currency_pairs:
+                continue
+        
+        latest_rates[(channel_id, rate["currency_a"], rate["currency_b"])] = {
+            **rate,
+            "channel_name": channel_map.get(channel_id, "Unknown")
+        }
+    
+    # Group by currency pair and calculate best rates
+    results = {}
+    # Store full rate records for trend calculation
+    rate_records_map = {}  # Maps (pair_key, exchanger) -> full rate record
+    
+    # timestamp - when the quote was last seen (repeats of an unchanged rate only extend
+    # last_seen); edited - when the value was first quoted, it keys the trend baseline
+    for rate in latest_rates.values():
+        pair_key = f"{rate['currency_a']}/{rate['currency_b']}"
+        channel_name = rate.get("channel_name", "Unknown")
+        
+        # Store full rate record for later trend calculation
+        rate_records_map[(pair_key, channel_name)] = rate
+        
+        if pair_key not in results:
+            results[pair_key] = {
+                "currency": pair_key,
+                "buy_records": [],
+                "sell_records": []
+            }
+        
+        if rate.get("buy") is not None:
+            results[pair_key]["buy_records"].append({
+                "value": rate["buy"],
+                "exchanger": channel_name,
+                "timestamp": seen_at(rate),
+                "edited": rate.get("edited")
+            })
+        
+        if rate.get("sell") is not None:
+            results[pair_key]["sell_records"].append({
+                "value": rate["sell"],
+                "exchanger": channel_name,
+                "timestamp": seen_at(rate),
+                "edited": rate.get("edited")
+            })
+    
+    # Decide the page first: pairs are ordered by currency pair (stable across calls)
+    ordered_pairs = sorted(
+        pair_key for pair_key, data in results.items()
+        if data["buy_records"] or data["sell_records"]
+    )
+    total_count = len(ordered_pairs)
+    
+    if cursor:
+        # Keyset pagination: continue right after the last pair of the previous page
+        start = bisect_right(ordered_pairs, cursor)
+    elif limit:
+        start = offset or 0
+    else:
+        start = 0
+    end = start + limit if limit else total_count
+    page_pairs = ordered_pairs[start:end]
+    next_cursor = page_pairs[-1] if page_pairs and end < total_count else None
+    
+    # Calculate best rates for the page; trend baselines are resolved after the loop
+    final_results = []
+    # (result/top entry, field prefix, "buy"/"sell", поточне значення, lookup, edited) для кожного обмінника з трендом
+    trend_targets = []
+    
+    for pair_key in page_pairs:
+        data = results[pair_key]
+        buy_records = data["buy_records"]
+        sell_records = data["sell_records"]
+        
+        result = {
+            "currency": pair_key
+        }
+        
+        # Process buy rates
+        if buy_records:
+            best_buy = max(buy_records, key=lambda x: x["value"])
+            result["buy_best"] = best_buy["value"]
+            result["buy_exchanger"] = best_buy["exchanger"]
+            result["buy_timestamp"] = best_buy["timestamp"]
+            # Defaults (stable) - overwritten after the batch trend lookup
+            result["buy_trend"] = "stable"
+            result["buy_change_abs"] = 0.0
+            result["buy_change_pct"] = 0.0
+            trend_targets.append(_trend_target(result, "buy_", "buy", best_buy, pair_key, rate_records_map))
+        
+        # Process sell rates
+        if sell_records:
+            best_sell = min(sell_records, key=lambda x: x["value"])
+            result["sell_best"] = best_sell["value"]
+            result["sell_exchanger"] = best_sell["exchanger"]
+            result["sell_timestamp"] = best_sell["timestamp"]
+            # Defaults (stable) - overwritten after the batch trend lookup
+            result["sell_trend"] = "stable"
+            result["sell_change_abs"] = 0.0
+            result["sell_change_pct"] = 0.0
+            trend_targets.append(_trend_target(result, "sell_", "sell", best_sell, pair_key, rate_records_map))
+        
+        if top_k:
+            # Bounded heaps of size K; like max()/min(), ties keep the newer quote first
+            top_records = {
+                "buy": heapq.nlargest(top_k, buy_records, key=lambda x: x["value"]),
+                "sell": heapq.nsmallest(top_k, sell_records, key=lambda x: x["value"])
+            }
+            for side, records in top_records.items():
+                entries = result[f"{side}_top"] = [_top_entry(record) for record in records]
+                trend_targets.extend(
+                    _trend_target(entry, "", side, record, pair_key, rate_records_map)
+                    for entry, record in zip(entries, records)
+                )
+        
+        final_results.append(result)
+    
+    # Precomputed baselines are an O(1) read; the rest (all pairs, all K entries) is looked up in history at once
+    unresolved = []
+    for target in trend_targets:
+        if target is None:
+            continue
+        result, prefix, side, current_value, lookup, edited = target
+        baselines = rates_snapshot.baselines((lookup["channel_id"], lookup["currency_a"], lookup["currency_b"]))
+        if side in baselines:
+            _apply_trend(result, prefix, current_value, baselines[side])
+        else:
+            unresolved.append(target)
+    
+    degraded = False
+    if unresolved:
+        try:
+            previous_rates = await run_query(find_previous_rates_batch, [target[4] for target in unresolved], strict=True)
+        except Exception as e:
+            logger.warning(f"Error in batch trend lookup for {len(unresolved)} exchangers: {e}")
+            previous_rates = [None] * len(unresolved)
+            degraded = True
+        else:
+            for (result, prefix, side, current_value, lookup, edited), prev_rate in zip(unresolved, previous_rates):
+                key = (lookup["channel_id"], lookup["currency_a"], lookup["currency_b"])
+                rates_snapshot.remember_baseline(key, side, prev_rate.get(side) if prev_rate else None, edited)
+        
+        for (result, prefix, side, current_value, lookup, edited), prev_rate in zip(unresolved, previous_rates):
+            _apply_trend(result, prefix, current_value, prev_rate.get(side) if prev_rate else None)
+    
+    # Return with metadata for Flutter
+    return {
+        "success": True,
+        "data": final_results,
+        "meta": {
+            "total": total_count,
+            "limit": limit,
+            "offset": start,
+            "returned": len(final_results),
+            "next_cursor": next_cursor,
+            "degraded": degraded
+        }
+    }
@@ -0,0 +1,117 @@
+"""
+Кешований довідник обмінників (таблиця channels).
+
+Тримає прямий (id -> name) та зворотній (name -> id) індекси і місто кожного
+обмінника (channels.city, sql/channel_city.sql), оновлюється раз
+на CHANNELS_CACHE_TTL секунд або після явного invalidate(). Завантаження
+single-flight: при холодному старті N одночасних запитів чекають один запит до бази.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from db import run_query
+from storage import get_repository
+
+logger = logging.getLogger(__name__)
+
+# Як довго (секунд) довідник вважається актуальним
+CHANNELS_CACHE_TTL = float(os.getenv("CHANNELS_CACHE_TTL", "300"))
+
+
+def normalize_city(city: Optional[str]) -> Optional[str]:
+    """Ключ міста: без пробілів по краях і без урахування регістру ("Kyiv " == "kyiv")."""
+    if not city or not city.strip():
+        return None
+    return city.strip().casefold()
+
+
+class ChannelDirectory:
+    """Довідник обмінників з індексами id <-> name."""
+
+    def __init__(self, ttl: float = CHANNELS_CACHE_TTL):
+        self.ttl = ttl
+        self._names: Dict[int, str] = {}
+        self._ids_by_name: Dict[str, List[int]] = {}
+        self._cities: Dict[int, str] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+        # Лічильник змін довідника - частина версії даних для кешів відповідей і ETag
+        self.version = 0
+
+    def is_fresh(self) -> bool:
+        """Чи завантажений довідник і чи не минув TTL."""
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def refresh(self, force: bool = False) -> None:
+        """
+        Завантажує довідник з бази (блокуючий виклик).
+
+        Потоки, що прийшли під час завантаження, чекають на lock і після нього
+        бачать вже свіжі дані - повторного запиту не буде.
+        """
+        with self._lock:
+            if not force and self.is_fresh():
+                return
+
+            channels = get_repository().list_channels()
+
+            names = {}
+            ids_by_name = {}
+            cities = {}
+            for ch in channels:
+                names[ch["id"]] = ch["name"]
+                ids_by_name.setdefault(ch["name"], []).append(ch["id"])
+                city = normalize_city(ch.get("city"))
+                if city:
+                    cities[ch["id"]] = city
+
+            self._loaded_at = time.monotonic()
+            # Перезавантаження за TTL без змін у channels не скидає кеші й ETag
+            if (names, ids_by_name, cities) == (self._names, self._ids_by_name, self._cities) and self.version:
+                return
+
+            # Підміняємо індекси цілком, щоб читачі не бачили напівоновлений стан
+            self._names = names
+            self._ids_by_name = ids_by_name
+            self._cities = cities
+            self.version += 1
+            logger.info(f"Channel directory loaded: {len(names)} channels")
+
+    async def load(self) -> None:
+        """Гарантує актуальний довідник; якщо він свіжий - без звернення до пулу потоків."""
+        if not self.is_fresh():
+            await run_query(self.refresh)
+
+    def invalidate(self) -> None:
+        """Позначає довідник застарілим: наступний load() перечитає channels."""
+        self._loaded_at = None
+
+    @property
+    def names(self) -> Dict[int, str]:
+        """Прямий індекс id -> name."""
+        return self._names
+
+    @property
+    def cities(self) -> Dict[int, str]:
+        """id -> нормалізоване місто (normalize_city); обмінники без міста відсутні."""
+        return self._cities
+
+    def name_of(self, channel_id: Optional[int], default: Optional[str] = None) -> Optional[str]:
+        """Назва обмінника за id."""
+        return self._names.get(channel_id, default)
+
+    def id_of(self, name: str) -> Optional[int]:
+        """id обмінника за назвою (перший, якщо назва повторюється)."""
+        ids = self._ids_by_name.get(name)
+        return ids[0] if ids else None
+
+    def ids_for(self, names: Iterable[str]) -> List[int]:
+        """Усі id обмінників з переданими назвами."""
+        return [ch_id for name in names for ch_id in self._ids_by_name.get(name, [])]
+
+
+# Спільний довідник для всіх endpoints
+channel_directory = ChannelDirectory()
@@ -0,0 +1,36 @@
+"""
+Run-length стиснення таблиці rates (job для cron).
+
+Серії однакових послідовних котирувань (buy, sell) на кожен
+(channel_id, currency_a, currency_b) згортаються в один запис: edited - перша
+поява значення, last_seen - остання. Працює з поточним STORAGE_BACKEND
+(Supabase через RPC compact_rates з sql/rates_compaction.sql або локальна SQLite replica).
+
+Запуск:
+    python compact_rates.py --older-than-hours 1
+"""
+import argparse
+from datetime import datetime, timedelta
+
+from storage import get_repository
+
+
+def compact(older_than_hours: float) -> int:
+    """
+    Стискає записи, старші за older_than_hours (свіжі записи ще можуть дописуватись).
+
+    Returns:
+        Кількість видалених записів
+    """
+    before = datetime.utcnow() - timedelta(hours=older_than_hours)
+    return get_repository().compact_rates(before)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--older-than-hours", type=float, default=1.0, help="Не чіпати записи, новіші за цю кількість годин")
+    args = parser.parse_args()
+
+    print(f"🗜️  Compacting rates older than {args.older_than_hours}h")
+    removed = compact(args.older_than_hours)
+    print(f"✅ Done: {removed} duplicate records removed")
@@ -0,0 +1,42 @@
+"""
+Conditional GET (ETag / If-None-Match) для read endpoints.
+
+ETag рахується з версії даних (watermark edited, версія довідника обмінників)
+та параметрів запиту, а не з тіла відповіді - тому перевірку можна зробити
+до будь-яких важких обчислень і відповісти 304 Not Modified майже безкоштовно.
+"""
+import hashlib
+from typing import Optional
+
+from fastapi.responses import Response
+
+
+def make_etag(*parts) -> str:
+    """Сильний ETag з версії даних та параметрів запиту."""
+    digest = hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+    return f'"{digest}"'
+
+
+def is_not_modified(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Чи збігається If-None-Match клієнта з поточним ETag.
+
+    Підтримує список ETag через кому, "*" та слабкі ETag (W/"...") -
+    для If-None-Match використовується слабке порівняння (RFC 9110).
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def not_modified(etag: str) -> Response:
+    """Порожня відповідь 304 з поточним ETag."""
+    return Response(status_code=304, headers={"ETag": etag})
@@ -0,0 +1,124 @@
+"""
+Крос-курси для /rates/cross: пари, які обмінники не котирують напряму
+(EUR/USD, PLN/EUR), через одну проміжну валюту (зазвичай UAH).
+
+Котирування X/M з buy b та sell s - два ребра графа валют: 1 X -> b M (обмінник
+купує X) та 1 M -> 1/s X (обмінник продає X). Найкращий обмін source -> target
+однією угодою - найкраще з цих ребер серед усіх обмінників. Для пари X/Y:
+- buy - скільки Y отримає клієнт за 1 X: max по M (X -> M) * (M -> Y);
+- sell - скільки Y клієнт заплатить за 1 X: 1 / max по M (Y -> M) * (M -> X).
+Ноги можуть бути в різних обмінників - це найкращий досяжний курс.
+
+Граф і найкращі buy/sell кожної пари підтримує snapshot (оновлюються в
+apply(), без перебудови), тому крос-курс - це O(спільних сусідів X та Y)
+читань готових значень, як і пряма пара.
+"""
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from snapshot import LatestRatesSnapshot, rates_snapshot, seen_at
+
+logger = logging.getLogger(__name__)
+
+# Точність синтетичних курсів
+CROSS_RATE_DECIMALS = 6
+
+# (курс обміну 1 source -> target, сторона котирування, запис, пара котирування)
+Conversion = Tuple[float, str, dict, str]
+
+
+class CrossRateEngine:
+    """Найкращі синтетичні buy/sell пари через одну проміжну валюту."""
+
+    def __init__(self, snapshot: LatestRatesSnapshot):
+        self.snapshot = snapshot
+
+    def neighbors(self, currency: str) -> set:
+        """Валюти, з якими currency котирується хоча б в одній парі."""
+        return {
+            currency_b if currency_a == currency else currency_a
+            for currency_a, currency_b in self.snapshot.currency_pairs(currency)
+        }
+
+    def conversion(self, source: str, target: str) -> Optional[Conversion]:
+        """Найкращий обмін 1 source -> target однією угодою (None, якщо пару не котирують)."""
+        candidates = []
+        best_buy, _ = self.snapshot.pair_best(source, target)
+        if best_buy is not None and best_buy["buy"] > 0:
+            candidates.append((best_buy["buy"], "buy", best_buy, f"{source}/{target}"))
+        _, best_sell = self.snapshot.pair_best(target, source)
+        if best_sell is not None and best_sell["sell"] > 0:
+            candidates.append((1 / best_sell["sell"], "sell", best_sell, f"{target}/{source}"))
+        return max(candidates, key=lambda candidate: candidate[0]) if candidates else None
+
+    def _best_path(self, source: str, target: str, intermediates: Iterable[str]) -> Optional[Tuple[float, str, List[Conversion]]]:
+        # Серед рівних шляхів перемагає перша (за алфавітом) проміжна валюта
+        best = None
+        for currency in intermediates:
+            first, second = self.conversion(source, currency), self.conversion(currency, target)
+            if first is None or second is None:
+                continue
+            rate = first[0] * second[0]
+            if best is None or rate > best[0]:
+                best = (rate, currency, [first, second])
+        return best
+
+    @staticmethod
+    def _legs(conversions: List[Conversion], channel_map: Dict[int, str]) -> List[dict]:
+        return [
+            {
+                "pair": pair,
+                "side": side,
+                "rate": rate[side],
+                "exchanger": channel_map.get(rate.get("channel_id"), "Unknown"),
+                "timestamp": seen_at(rate)
+            }
+            for _, side, rate, pair in conversions
+        ]
+
+    def quote(self, base: str, quote: str, channel_map: Dict[int, str], via: Optional[Iterable[str]] = None) -> Optional[dict]:
+        """
+        Синтетичний курс base/quote через одну проміжну валюту.
+
+        Args:
+            base, quote: Коди валют пари
+            channel_map: {channel_id: назва обмінника}
+            via: Розглядати лише ці проміжні валюти (None - всі)
+
+        Returns:
+            {"currency", "direct_buy", "direct_sell", "buy_best", "buy_via", "buy_legs",
+             "sell_best", "sell_via", "sell_legs"} (ноги - у порядку угод) або None,
+            якщо base і quote не мають спільної проміжної валюти
+        """
+        intermediates = (self.neighbors(base) & self.neighbors(quote)) - {base, quote}
+        if via is not None:
+            intermediates &= set(via)
+        intermediates = sorted(intermediates)
+
+        buy = self._best_path(base, quote, intermediates)
+        sell = self._best_path(quote, base, intermediates)
+        if buy is None and sell is None:
+            return None
+
+        direct_buy, direct_sell = self.snapshot.pair_best(base, quote)
+        result = {
+            "currency": f"{base}/{quote}",
+            "direct_buy": direct_buy["buy"] if direct_buy is not None else None,
+            "direct_sell": direct_sell["sell"] if direct_sell is not None else None
+        }
+        if buy is not None:
+            rate, currency, conversions = buy
+            result["buy_best"] = round(rate, CROSS_RATE_DECIMALS)
+            result["buy_via"] = currency
+            result["buy_legs"] = self._legs(conversions, channel_map)
+        if sell is not None:
+            # Клієнт платить quote: quote -> проміжна -> base, курс - обернений
+            rate, currency, conversions = sell
+            result["sell_best"] = round(1 / rate, CROSS_RATE_DECIMALS)
+            result["sell_via"] = currency
+            result["sell_legs"] = self._legs(conversions, channel_map)
+        return result
+
+
+# Спільний рушій для /rates/cross
+cross_rate_engine = CrossRateEngine(rates_snapshot)
@@ -0,0 +1,32 @@
+"""
+Async шар доступу до даних.
+
+Репозиторії (storage.py) синхронні: кожен запит до Supabase чи SQLite блокує потік до відповіді.
+Щоб повільний запит не зупиняв event loop uvicorn (і разом з ним /health та всі
+інші запити), блокуючі виклики виконуються в обмеженому пулі потоків.
+Розмір пулу (DB_MAX_CONCURRENCY) - це максимальна кількість одночасних запитів до бази.
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+DB_MAX_CONCURRENCY = int(os.getenv("DB_MAX_CONCURRENCY", "8"))
+
+_executor = ThreadPoolExecutor(max_workers=DB_MAX_CONCURRENCY, thread_name_prefix="db")
+
+
+async def run_query(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Виконує блокуючу функцію доступу до даних у пулі потоків.
+
+    Args:
+        fn: Синхронна функція (напр. rates_snapshot.refresh або find_previous_rates_batch)
+        *args, **kwargs: Аргументи для fn
+
+    Returns:
+        Результат fn
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
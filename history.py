@@ -0,0 +1,250 @@
+"""
+Агрегація історії курсів для /rates/history.
+
+HistoryAggregator групує сирі записи по годинах/днях за один прохід
+(bucket шукається в dict, а не лінійним пошуком по data_points).
+
+Функція rates_history_buckets (див. sql/rates_history_buckets.sql) робить те саме
+в базі і повертає один рядок на bucket з найкращими buy/sell.
+Увімкнення: HISTORY_SERVER_AGGREGATION=1 (після того, як функцію створено в Supabase).
+"""
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from storage import get_repository
+
+logger = logging.getLogger(__name__)
+
+HISTORY_SERVER_AGGREGATION = os.getenv("HISTORY_SERVER_AGGREGATION", "0") == "1"
+
+
+def parse_edited(edited) -> datetime:
+    """
+    Перетворює значення edited з PostgREST у naive datetime (UTC).
+
+    Підтримує ISO формат ("2025-11-03T15:10:00+00:00", "...Z") та "%Y-%m-%d %H:%M:%S".
+    """
+    if isinstance(edited, str):
+        if "T" in edited:
+            rate_time = datetime.fromisoformat(edited.replace("Z", "+00:00"))
+        else:
+            rate_time = datetime.strptime(edited, "%Y-%m-%d %H:%M:%S")
+    else:
+        rate_time = edited
+
+    # Convert to UTC if timezone-aware
+    if rate_time.tzinfo:
+        rate_time = rate_time.replace(tzinfo=None)
+    return rate_time
+
+
+def truncate_to_interval(rate_time: datetime, interval: str) -> datetime:
+    """Початок bucket ("hour" або "day"), до якого належить rate_time."""
+    if interval == "hour":
+        return rate_time.replace(minute=0, second=0, microsecond=0)
+    return rate_time.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def interval_step(interval: str) -> timedelta:
+    """Тривалість одного bucket."""
+    return timedelta(hours=1) if interval == "hour" else timedelta(days=1)
+
+
+EPOCH = datetime(1970, 1, 1)
+# Тривалість bucket в мікросекундах (колонкова та NumPy агрегація)
+INTERVAL_US = {"hour": 3600 * 1_000_000, "day": 86400 * 1_000_000}
+
+
+def to_epoch_us(value) -> int:
+    """edited (рядок PostgREST або datetime) -> epoch мікросекунди UTC."""
+    return (parse_edited(value) - EPOCH) // timedelta(microseconds=1)
+
+
+def from_epoch_us(value: int) -> datetime:
+    """Epoch мікросекунди -> naive datetime (UTC)."""
+    return EPOCH + timedelta(microseconds=value)
+
+
+class HistoryAggregator:
+    """
+    Однопрохідний агрегатор записів rates у data points для графіків.
+
+    Записи подаються в порядку edited DESC (як їх повертає запит). Для кожного
+    bucket зберігаються найкращий buy (max) та найкращий sell (min) разом з
+    обмінниками, що їх дали. З stats=True додатково рахуються open/close/min/max
+    для buy і sell та кількість записів.
+
+    Стиснутий запис (серія однакових котирувань з last_seen) враховується в
+    кожному bucket від edited до last_seen - так само, як раніше враховувались
+    окремі записи-дублікати.
+
+    until обмежує bucket справа (bucket з початком >= until не заповнюються) -
+    так rollups.py агрегує лише закриті bucket, а решту бере з rollup.
+    """
+
+    def __init__(self, interval: str, cutoff_date: datetime, channel_map: Dict[int, str], stats: bool = False, until: Optional[datetime] = None):
+        self.interval = interval
+        self.cutoff_date = cutoff_date
+        self.channel_map = channel_map
+        self.stats = stats
+        self.until = until
+        self._buckets: Dict[datetime, dict] = {}
+
+    def add(self, rate: dict) -> None:
+        """Додає один запис (записи поза періодом або без edited ігноруються)."""
+        edited = rate.get("edited")
+        if not edited:
+            return
+
+        try:
+            rate_time = parse_edited(edited)
+        except Exception as e:
+            logger.warning(f"Error parsing timestamp {edited}: {e}")
+            return
+
+        last_seen = rate.get("last_seen")
+        try:
+            last_time = parse_edited(last_seen) if last_seen else rate_time
+        except Exception as e:
+            logger.warning(f"Error parsing timestamp {last_seen}: {e}")
+            last_time = rate_time
+
+        # Filter by date range
+        if max(rate_time, last_time) < self.cutoff_date:
+            return
+
+        time_key = truncate_to_interval(max(rate_time, self.cutoff_date), self.interval)
+        last_key = truncate_to_interval(last_time, self.interval)
+        step = interval_step(self.interval)
+        while self.until is None or time_key < self.until:
+            self.add_values(time_key, rate.get("channel_id"), rate.get("buy"), rate.get("sell"))
+            time_key += step
+            if time_key > last_key:
+                break
+
+    def add_values(self, time_key, channel_id: Optional[int], buy: Optional[float], sell: Optional[float]) -> None:
+        """
+        Враховує одне котирування в bucket time_key (без розбору запису).
+
+        Котирування подаються в тому ж порядку, що й у add() - від нових до старих.
+        time_key - будь-який ключ, що впорядковується як час (history_store.py
+        передає epoch мікросекунди).
+        """
+        point = self._buckets.get(time_key)
+
+        if point is None:
+            # Перший (найновіший) запис bucket
+            point = {
+                "buy": buy,
+                "sell": sell,
+                "exchanger_id": channel_id,
+                "sell_exchanger_id": channel_id
+            }
+            if self.stats:
+                point["stats"] = {
+                    "buy_open": buy, "buy_close": buy, "buy_min": buy, "buy_max": buy,
+                    "sell_open": sell, "sell_close": sell, "sell_min": sell, "sell_max": sell,
+                    "count": 1
+                }
+            self._buckets[time_key] = point
+            return
+
+        # If multiple records for same interval, keep best rates
+        if buy and (point["buy"] is None or buy > point["buy"]):
+            point["buy"] = buy
+            point["exchanger_id"] = channel_id
+        if sell and (point["sell"] is None or sell < point["sell"]):
+            point["sell"] = sell
+            point["sell_exchanger_id"] = channel_id
+
+        if self.stats:
+            stats = point["stats"]
+            stats["count"] += 1
+            # Записи йдуть від нових до старих: open - найстаріше значення в bucket
+            if buy is not None:
+                stats["buy_open"] = buy
+                stats["buy_min"] = buy if stats["buy_min"] is None else min(stats["buy_min"], buy)
+                stats["buy_max"] = buy if stats["buy_max"] is None else max(stats["buy_max"], buy)
+                if stats["buy_close"] is None:
+                    stats["buy_close"] = buy
+            if sell is not None:
+                stats["sell_open"] = sell
+                stats["sell_min"] = sell if stats["sell_min"] is None else min(stats["sell_min"], sell)
+                stats["sell_max"] = sell if stats["sell_max"] is None else max(stats["sell_max"], sell)
+                if stats["sell_close"] is None:
+                    stats["sell_close"] = sell
+
+    def add_all(self, rates: Iterable[dict]) -> "HistoryAggregator":
+        for rate in rates:
+            self.add(rate)
+        return self
+
+    def buckets(self) -> List[tuple]:
+        """
+        (початок bucket, point) у порядку часу; обмінники - як channel_id
+        (exchanger_id, sell_exchanger_id), stats - якщо stats=True.
+        """
+        return sorted(self._buckets.items())
+
+    def data_points(self) -> List[dict]:
+        """Data points, відсортовані за timestamp."""
+        return [make_data_point(time_key, point, self.channel_map) for time_key, point in self.buckets()]
+
+
+def make_data_point(time_key: datetime, point: dict, channel_map: Dict[int, str]) -> dict:
+    """Data point у форматі /rates/history з bucket агрегатора або rollup."""
+    data_point = {
+        "timestamp": time_key.isoformat() + "Z",
+        "buy": point["buy"],
+        "sell": point["sell"],
+        "exchanger": channel_map.get(point["exchanger_id"], "Unknown"),
+        "sell_exchanger": channel_map.get(point["sell_exchanger_id"], "Unknown")
+    }
+    if point.get("stats") is not None:
+        data_point["stats"] = point["stats"]
+    return data_point
+
+
+def fetch_history_buckets(currency_a: str, currency_b: str, cutoff_date: datetime, interval: str, channel_ids: Optional[List[int]], channel_map: Dict[int, str]) -> Optional[List[dict]]:
+    """
+    Отримує вже агреговані data points через RPC rates_history_buckets.
+
+    Args:
+        currency_a: Перша валюта пари (напр. "USD")
+        currency_b: Друга валюта пари (напр. "UAH")
+        cutoff_date: Початок періоду (UTC, naive)
+        interval: "hour" або "day"
+        channel_ids: Обмежити вибірку цими обмінниками (None - всі)
+        channel_map: Довідник id -> name для поля exchanger
+
+    Returns:
+        Список data points у форматі /rates/history (відсортований за timestamp)
+        або None, якщо RPC недоступний (чи backend його не підтримує) - тоді endpoint агрегує сирі записи сам
+    """
+    try:
+        rows = get_repository().history_buckets(currency_a, currency_b, cutoff_date, interval, channel_ids)
+    except NotImplementedError:
+        return None
+    except Exception as e:
+        logger.warning(f"rates_history_buckets RPC failed for {currency_a}/{currency_b}, falling back to raw rows: {e}")
+        return None
+
+    data_points = []
+    for row in rows:
+        bucket = parse_edited(str(row["bucket"]))
+        # Як і в HistoryAggregator: exchanger - той, хто дав найкращий buy (sell),
+        # або автор останнього запису bucket, якщо buy (sell) немає
+        buy_exchanger_id = row.get("buy_channel_id") or row.get("latest_channel_id")
+        sell_exchanger_id = row.get("sell_channel_id") or row.get("latest_channel_id")
+        data_points.append({
+            "timestamp": bucket.isoformat() + "Z",
+            "buy": row.get("buy"),
+            "sell": row.get("sell"),
+            "exchanger": channel_map.get(buy_exchanger_id, "Unknown"),
+            "sell_exchanger": channel_map.get(sell_exchanger_id, "Unknown")
+        })
+
+    data_points.sort(key=lambda x: x["timestamp"])
+    return data_points
@@ -0,0 +1,251 @@
+"""
+Векторизована (NumPy) агрегація історії курсів для /rates/history.
+
+Пакет записів один раз перетворюється на колонки (edited і last_seen - epoch
+мікросекунди int64, channel_id - int64, buy/sell - float64 з NaN), далі все
+рахується операціями над масивами: bucket - цілочисельне ділення часу,
+стиснуті записи розгортаються в усі свої bucket через np.repeat, а найкращі
+buy/sell, обмінники, open/close/min/max та кількість записів - grouped
+reductions (reduceat) по відсортованих bucket.
+
+Результат збігається з HistoryAggregator, включно з порядком обробки: записи
+подаються від нових до старих, серед однакових найкращих значень перемагає
+новіший запис, а bucket без buy (sell) бере обмінника найновішого запису.
+
+NumPy - необов'язкова залежність: без неї (або з HISTORY_NUMPY=0) працює
+HistoryAggregator.
+"""
+import logging
+import os
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from history import INTERVAL_US, HistoryAggregator, from_epoch_us, make_data_point, to_epoch_us
+
+try:
+    import numpy as np
+except ImportError:  # NumPy не встановлено - агрегує HistoryAggregator
+    np = None
+
+logger = logging.getLogger(__name__)
+
+HISTORY_NUMPY = np is not None and os.getenv("HISTORY_NUMPY", "1") == "1"
+
+# Скільки записів перетворювати на колонки за раз (records_to_columns)
+COLUMN_CHUNK_SIZE = 10000
+
+# Позначка edited, який не вдалося розібрати (запис пропускається, як у HistoryAggregator)
+INVALID_TIME = -(2 ** 63)
+
+
+def _utc_text(value) -> str:
+    """ISO рядок без зони UTC для розбору NumPy; інші зони та формати - ValueError."""
+    if not isinstance(value, str):
+        raise ValueError(value)
+    if value.endswith("+00:00"):
+        value = value[:-6]
+    elif value.endswith("Z"):
+        value = value[:-1]
+    if len(value) > 19 and value[-6] in "+-" and value[-3] == ":":
+        raise ValueError(value)
+    return value
+
+
+def _safe_epoch_us(value) -> int:
+    try:
+        return to_epoch_us(value)
+    except Exception as e:
+        logger.warning(f"Error parsing timestamp {value}: {e}")
+        return INVALID_TIME
+
+
+def epoch_us_column(values: Sequence) -> "np.ndarray":
+    """
+    Часові мітки PostgREST -> int64 epoch мікросекунди.
+
+    UTC рядки розбираються NumPy одним викликом; якщо трапилось щось інше
+    (інша зона, datetime) - кожне значення розбирається як у parse_edited.
+    """
+    try:
+        return np.array([_utc_text(value) for value in values], dtype="datetime64[us]").astype(np.int64)
+    except (ValueError, TypeError):
+        return np.array([_safe_epoch_us(value) for value in values], dtype=np.int64)
+
+
+def _chunk_columns(records: List[dict]) -> Tuple["np.ndarray", ...]:
+    records = [rate for rate in records if rate.get("edited")]
+    edited = epoch_us_column([rate["edited"] for rate in records])
+    last_seen = epoch_us_column([rate.get("last_seen") or rate["edited"] for rate in records])
+    channel_ids = np.array([rate.get("channel_id") if rate.get("channel_id") is not None else -1 for rate in records], dtype=np.int64)
+    buy = np.array([rate.get("buy") for rate in records], dtype=np.float64)
+    sell = np.array([rate.get("sell") for rate in records], dtype=np.float64)
+    return edited, last_seen, channel_ids, buy, sell
+
+
+def records_to_columns(records: Iterable[dict], chunk_size: int = COLUMN_CHUNK_SIZE) -> Tuple["np.ndarray", ...]:
+    """
+    Записи PostgREST (у порядку обробки, edited DESC) -> колонки
+    (edited, last_seen, channel_id, buy, sell). Записи без edited або з
+    нерозбірливим edited відкидаються; last_seen без значення = edited.
+
+    records може бути генератором (iter_pair_history): записи перетворюються
+    частинами по chunk_size, тож у пам'яті лише колонки та одна частина dict.
+    """
+    records = iter(records)
+    chunks = []
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if chunk:
+            chunks.append(_chunk_columns(chunk))
+        if len(chunk) < chunk_size:
+            break
+    if not chunks:
+        chunks.append(_chunk_columns([]))
+    edited, last_seen, channel_ids, buy, sell = (
+        chunks[0][index] if len(chunks) == 1 else np.concatenate([chunk[index] for chunk in chunks])
+        for index in range(5)
+    )
+
+    valid = edited != INVALID_TIME
+    if not valid.all():
+        edited, last_seen, channel_ids, buy, sell = edited[valid], last_seen[valid], channel_ids[valid], buy[valid], sell[valid]
+    # Нерозбірливий last_seen - як у HistoryAggregator: запис діє лише в момент edited
+    last_seen = np.where(last_seen == INVALID_TIME, edited, last_seen)
+    return edited, last_seen, channel_ids, buy, sell
+
+
+def merge_columns(parts: Sequence[tuple]) -> Tuple["np.ndarray", ...]:
+    """
+    Колонки кількох обмінників (array.array, edited ASC) -> одні колонки в
+    порядку обробки: edited DESC, як у запиті до бази (heapq.merge у history_store).
+
+    Args:
+        parts: [(channel_id, edited, last_seen, buy, sell)]
+    """
+    columns = [[], [], [], [], []]
+    for channel_id, edited, last_seen, buy, sell in parts:
+        columns[0].append(np.frombuffer(edited, dtype=np.int64)[::-1])
+        columns[1].append(np.frombuffer(last_seen, dtype=np.int64)[::-1])
+        columns[2].append(np.full(len(edited), channel_id, dtype=np.int64))
+        columns[3].append(np.frombuffer(buy, dtype=np.float64)[::-1])
+        columns[4].append(np.frombuffer(sell, dtype=np.float64)[::-1])
+    if not parts:
+        return tuple(np.empty(0, dtype=dtype) for dtype in (np.int64, np.int64, np.int64, np.float64, np.float64))
+
+    edited, last_seen, channel_ids, buy, sell = (np.concatenate(column) for column in columns)
+    order = np.argsort(-edited, kind="stable")
+    return edited[order], last_seen[order], channel_ids[order], buy[order], sell[order]
+
+
+def _nullable(values: "np.ndarray") -> list:
+    return [None if value != value else value for value in values.tolist()]
+
+
+def aggregate_columns(edited, last_seen, channel_ids, buy, sell, cutoff: int, step: int, stats: bool = False, until: Optional[int] = None) -> List[Tuple[int, dict]]:
+    """
+    Агрегує колонки (рядки в порядку обробки - від нових до старих).
+
+    Args:
+        cutoff: Початок періоду (epoch мкс)
+        step: Тривалість bucket (мкс, INTERVAL_US)
+        stats: Рахувати open/close/min/max та count
+        until: Не заповнювати bucket з початком >= until (epoch мкс)
+
+    Returns:
+        [(початок bucket у epoch мкс, point)] у форматі HistoryAggregator.buckets()
+    """
+    keep = np.maximum(edited, last_seen) >= cutoff
+    if not keep.all():
+        edited, last_seen, channel_ids, buy, sell = edited[keep], last_seen[keep], channel_ids[keep], buy[keep], sell[keep]
+    if not len(edited):
+        return []
+
+    # Кожен запис потрапляє в bucket від max(edited, cutoff) до last_seen (принаймні в один)
+    first = np.maximum(edited, cutoff) // step * step
+    spans = np.maximum((last_seen // step * step - first) // step + 1, 1)
+    rows = np.repeat(np.arange(len(first)), spans)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(spans) - spans, spans)
+    buckets = first[rows] + offsets * step
+    if until is not None:
+        inside = buckets < until
+        rows, buckets = rows[inside], buckets[inside]
+        if not len(rows):
+            return []
+
+    # Стабільне сортування: у межах bucket зберігається порядок обробки
+    order = np.argsort(buckets, kind="stable")
+    buckets, rows = buckets[order], rows[order]
+    channels, buys, sells = channel_ids[rows], buy[rows], sell[rows]
+
+    boundary = np.empty(len(buckets), dtype=bool)
+    boundary[0] = True
+    np.not_equal(buckets[1:], buckets[:-1], out=boundary[1:])
+    starts = np.flatnonzero(boundary)
+    group = np.cumsum(boundary) - 1
+    positions = np.arange(len(buckets))
+    past_end = len(buckets)
+
+    # Найкращий buy (max) - лише серед truthy значень, як `if buy` у HistoryAggregator;
+    # серед рівних перемагає перший у порядку обробки
+    valid_buy = ~np.isnan(buys) & (buys != 0)
+    best_buy = np.maximum.reduceat(np.where(valid_buy, buys, -np.inf), starts)
+    has_buy = np.logical_or.reduceat(valid_buy, starts)
+    best_buy_at = np.minimum.reduceat(np.where(valid_buy & (buys == best_buy[group]), positions, past_end), starts)
+    buy_at = np.where(has_buy, best_buy_at, starts)
+
+    # Найкращий sell (min); sell = 0 першого запису не замінюється (sell < 0 не буває)
+    valid_sell = ~np.isnan(sells) & (sells != 0)
+    best_sell = np.minimum.reduceat(np.where(valid_sell, sells, np.inf), starts)
+    has_sell = np.logical_or.reduceat(valid_sell, starts) & (sells[starts] != 0)
+    best_sell_at = np.minimum.reduceat(np.where(valid_sell & (sells == best_sell[group]), positions, past_end), starts)
+    sell_at = np.where(has_sell, best_sell_at, starts)
+
+    columns = {
+        "buy": _nullable(buys[buy_at]),
+        "sell": _nullable(sells[sell_at]),
+        "exchanger_id": channels[buy_at].tolist(),
+        "sell_exchanger_id": channels[sell_at].tolist()
+    }
+    if stats:
+        columns["count"] = np.diff(np.append(starts, past_end)).tolist()
+        for side, values in (("buy", buys), ("sell", sells)):
+            present = ~np.isnan(values)
+            # Перший у порядку обробки (найновіший) - close, останній (найстаріший) - open
+            close_at = np.minimum.reduceat(np.where(present, positions, past_end), starts)
+            open_at = np.maximum.reduceat(np.where(present, positions, -1), starts)
+            has_value = open_at >= 0
+            columns[f"{side}_open"] = _nullable(np.where(has_value, values[np.where(has_value, open_at, 0)], np.nan))
+            columns[f"{side}_close"] = _nullable(np.where(has_value, values[np.where(has_value, close_at, 0)], np.nan))
+            columns[f"{side}_min"] = _nullable(np.fmin.reduceat(values, starts))
+            columns[f"{side}_max"] = _nullable(np.fmax.reduceat(values, starts))
+
+    result = []
+    for index, bucket in enumerate(buckets[starts].tolist()):
+        point = {
+            "buy": columns["buy"][index],
+            "sell": columns["sell"][index],
+            "exchanger_id": columns["exchanger_id"][index],
+            "sell_exchanger_id": columns["sell_exchanger_id"][index]
+        }
+        if stats:
+            point["stats"] = {
+                "buy_open": columns["buy_open"][index], "buy_close": columns["buy_close"][index],
+                "buy_min": columns["buy_min"][index], "buy_max": columns["buy_max"][index],
+                "sell_open": columns["sell_open"][index], "sell_close": columns["sell_close"][index],
+                "sell_min": columns["sell_min"][index], "sell_max": columns["sell_max"][index],
+                "count": columns["count"][index]
+            }
+        result.append((bucket, point))
+    return result
+
+
+def aggregate_records(records: Iterable[dict], interval: str, cutoff_date, channel_map: Dict[int, str], stats: bool = False) -> List[dict]:
+    """
+    Data points /rates/history з сирих записів (edited DESC, список або
+    генератор): NumPy, якщо доступний, інакше HistoryAggregator.
+    """
+    if not HISTORY_NUMPY:
+        return HistoryAggregator(interval, cutoff_date, channel_map, stats=stats).add_all(records).data_points()
+
+    buckets = aggregate_columns(*records_to_columns(records), to_epoch_us(cutoff_date), INTERVAL_US[interval], stats)
+    return [make_data_point(from_epoch_us(bucket), point, channel_map) for bucket, point in buckets]
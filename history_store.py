@@ -0,0 +1,401 @@
+"""
+Колонкове in-memory сховище історії курсів для /rates/history.
+
+Замість списків dict з PostgREST (рядковий edited, що розбирається на кожен
+запит) історія кожного (обмінник, валютна пара) зберігається в масивах
+array.array: edited та last_seen - epoch мікросекунди (int64), buy та sell -
+float64 (NaN замість null). Валютні пари інтернуються в малі int. Рядок займає
+32 байти замість ~1 КБ dict з рядками.
+
+Пара завантажується з бази у фоновому потоці після першого запиту (останні
+HISTORY_STORE_DAYS днів). Доки вона не завантажена, а також для періодів, довших
+за HISTORY_STORE_DAYS, data_points повертає None - /rates/history тоді читає
+rollup або базу. Далі дочитуються лише записи з edited або last_seen після watermark пари - коли
+змінилася версія пари в snapshot або минув refresh_interval. Записи з
+POST /rates/ingest застосовуються одразу (apply), але watermark пари не
+зсувають: він рухається лише від прочитаного з бази, тож рядки інших
+записувачів з меншим edited не пропускаються.
+
+Bucket рахуються цілочисельним діленням epoch часу, а вибірка періоду - бінарним
+пошуком по edited. Агрегує history_numpy.aggregate_columns (колонки передаються
+в NumPy без розбору рядків) або, без NumPy, HistoryAggregator - data points не
+відрізняються від агрегації сирих записів.
+"""
+import heapq
+import logging
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from itertools import repeat
+from operator import itemgetter
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from history import INTERVAL_US, HistoryAggregator, from_epoch_us, make_data_point, to_epoch_us
+from history_numpy import HISTORY_NUMPY, aggregate_columns, merge_columns
+from snapshot import SNAPSHOT_REFRESH_INTERVAL
+from storage import get_repository
+
+logger = logging.getLogger(__name__)
+
+# /rates/history з колонкового сховища (0 - кожен запит читає rollup або сирі записи з бази)
+HISTORY_STORE = os.getenv("HISTORY_STORE", "1") == "1"
+# Скільки днів історії тримати в пам'яті (максимальний days у /rates/history)
+HISTORY_STORE_DAYS = int(os.getenv("HISTORY_STORE_DAYS", "90"))
+
+NAN = float("nan")
+
+
+def _to_float(value: Optional[float]) -> float:
+    return NAN if value is None else float(value)
+
+
+def _from_float(value: float) -> Optional[float]:
+    return None if value != value else value
+
+
+def _same_value(a: float, b: float) -> bool:
+    return a == b or (a != a and b != b)
+
+
+class RateSeries:
+    """Історія одного (обмінник, пара): колонки, відсортовані за edited."""
+
+    __slots__ = ("edited", "last_seen", "buy", "sell")
+
+    def __init__(self):
+        self.edited = array("q")
+        self.last_seen = array("q")
+        self.buy = array("d")
+        self.sell = array("d")
+
+    def __len__(self) -> int:
+        return len(self.edited)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.itemsize * len(column) for column in (self.edited, self.last_seen, self.buy, self.sell))
+
+    def add(self, edited: int, last_seen: int, buy: float, sell: float) -> bool:
+        """
+        Додає запис (зазвичай у кінець). Уже відомий запис (той самий edited
+        і значення) лише продовжує last_seen.
+
+        Returns:
+            True, якщо запис новий
+        """
+        position = bisect_right(self.edited, edited)
+        index = position - 1
+        while index >= 0 and self.edited[index] == edited:
+            if _same_value(self.buy[index], buy) and _same_value(self.sell[index], sell):
+                if last_seen > self.last_seen[index]:
+                    self.last_seen[index] = last_seen
+                return False
+            index -= 1
+
+        if position == len(self.edited):
+            self.edited.append(edited)
+            self.last_seen.append(last_seen)
+            self.buy.append(buy)
+            self.sell.append(sell)
+        else:
+            # Запізніле котирування
+            self.edited.insert(position, edited)
+            self.last_seen.insert(position, last_seen)
+            self.buy.insert(position, buy)
+            self.sell.insert(position, sell)
+        return True
+
+    def touch(self, edited: int, last_seen: int) -> None:
+        """
+        Продовжує last_seen голови серії - останнього запису з edited <= edited,
+        як touch_rates (повторений запис міг бути злитий у голову compact_rates).
+        """
+        index = bisect_right(self.edited, edited) - 1
+        if index >= 0:
+            self.last_seen[index] = max(self.last_seen[index], last_seen)
+
+    def start_index(self, since: int) -> int:
+        """
+        Перший запис, що діяв після since: edited >= since або стиснутий запис
+        перед ним з last_seen >= since (серії одного ключа не перекриваються,
+        тому такі записи стоять безпосередньо перед межею).
+        """
+        index = bisect_left(self.edited, since)
+        while index > 0 and self.last_seen[index - 1] >= since:
+            index -= 1
+        return index
+
+    def trim(self, horizon: int) -> None:
+        """Відкидає записи, що закінчилися до horizon."""
+        index = self.start_index(horizon)
+        if index:
+            for column in (self.edited, self.last_seen, self.buy, self.sell):
+                del column[:index]
+
+    def columns(self, since: int) -> Tuple[array, array, array, array]:
+        """Копії колонок (edited, last_seen, buy, sell), починаючи з since."""
+        start = self.start_index(since)
+        return self.edited[start:], self.last_seen[start:], self.buy[start:], self.sell[start:]
+
+    def rows_desc(self, channel_id: int, since: int):
+        """(edited, last_seen, channel_id, buy, sell) від нових до старих, починаючи з since."""
+        edited, last_seen, buy, sell = self.columns(since)
+        return zip(reversed(edited), reversed(last_seen), repeat(channel_id, len(edited)), reversed(buy), reversed(sell))
+
+
+class HistoryStore:
+    """Колонкова історія курсів усіх завантажених пар."""
+
+    def __init__(self, days: int = HISTORY_STORE_DAYS, refresh_interval: float = SNAPSHOT_REFRESH_INTERVAL):
+        self.days = days
+        self.refresh_interval = refresh_interval
+        self._pair_ids: Dict[Tuple[str, str], int] = {}
+        # pair id -> channel_id -> RateSeries
+        self._series: Dict[int, Dict[int, RateSeries]] = {}
+        # pair id -> найбільший edited/last_seen серед прочитаних з бази записів (epoch мкс)
+        self._watermarks: Dict[int, int] = {}
+        # pair id -> (версія пари в snapshot, time.monotonic()) останнього оновлення
+        self._refreshed: Dict[int, Tuple[object, float]] = {}
+        # pair id -> (записи, touches) з apply() під час першого завантаження пари
+        self._loading: Dict[int, Tuple[List[dict], List[dict]]] = {}
+        # pair id, нові записи яких зараз дочитуються з бази
+        self._refreshing: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def _pair_id(self, currency_a: str, currency_b: str) -> int:
+        return self._pair_ids.setdefault((currency_a, currency_b), len(self._pair_ids))
+
+    def _horizon(self) -> datetime:
+        # Запас у добу: cutoff запиту обчислюється трохи раніше за оновлення
+        return datetime.utcnow() - timedelta(days=self.days + 1)
+
+    @staticmethod
+    def _fill(series_by_channel: Dict[int, RateSeries], rows: Iterable[dict]) -> Tuple[int, int]:
+        """
+        Додає записи в серії обмінників.
+
+        Returns:
+            (кількість нових записів, найбільший edited/last_seen, epoch мкс)
+        """
+        watermark = 0
+        added = 0
+        for rate in rows:
+            if not rate.get("edited"):
+                continue
+            edited = to_epoch_us(rate["edited"])
+            last_seen = to_epoch_us(rate["last_seen"]) if rate.get("last_seen") else edited
+            series = series_by_channel.get(rate.get("channel_id"))
+            if series is None:
+                series = series_by_channel[rate.get("channel_id")] = RateSeries()
+            added += series.add(edited, last_seen, _to_float(rate.get("buy")), _to_float(rate.get("sell")))
+            watermark = max(watermark, edited, last_seen)
+        return added, watermark
+
+    def _advance(self, pair_id: int, watermark: int) -> None:
+        # edited з майбутнього не заморожує watermark: записи до нього ще можуть з'явитися
+        watermark = max(self._watermarks.get(pair_id, 0), watermark)
+        self._watermarks[pair_id] = min(watermark, to_epoch_us(datetime.utcnow()))
+
+    def _add_rows(self, pair_id: int, rows: Iterable[dict], advance: bool = True) -> int:
+        """Додає записи пари; advance - зсунути watermark (лише для записів, прочитаних з бази)."""
+        added, watermark = self._fill(self._series.setdefault(pair_id, {}), rows)
+        if advance:
+            self._advance(pair_id, watermark)
+        return added
+
+    def _touch(self, pair_id: Optional[int], touch: dict) -> None:
+        series = self._series.get(pair_id, {}).get(touch["channel_id"])
+        if series is not None:
+            series.touch(to_epoch_us(touch["edited"]), to_epoch_us(touch["last_seen"]))
+
+    def refresh_pair(self, currency_a: str, currency_b: str, version=None) -> None:
+        """
+        Завантажує пару або дочитує її нові записи (блокуючий виклик).
+
+        Args:
+            version: Версія пари в snapshot (pair_version) - якщо вона змінилася, пара
+                     оновлюється, не чекаючи refresh_interval
+        """
+        with self._lock:
+            pair_id = self._pair_id(currency_a, currency_b)
+            refreshed = self._refreshed.get(pair_id)
+            if refreshed is None:
+                # Пару вже завантажує інший потік
+                if pair_id in self._loading:
+                    return
+                self._loading[pair_id] = ([], [])
+            else:
+                now = time.monotonic()
+                # Нові записи пари вже дочитує інший потік
+                if pair_id in self._refreshing or (refreshed[0] == version and now - refreshed[1] < self.refresh_interval):
+                    return
+                self._refreshing.add(pair_id)
+                since = from_epoch_us(self._watermarks.get(pair_id, 0))
+        if refreshed is None:
+            self._load_pair(pair_id, currency_a, currency_b, version)
+        else:
+            self._refresh_loaded(pair_id, currency_a, currency_b, version, since, now)
+
+    def _refresh_loaded(self, pair_id: int, currency_a: str, currency_b: str, version, since: datetime, now: float) -> None:
+        """
+        Дочитує нові записи завантаженої пари. Як і в _load_pair, читання з бази -
+        поза lock; під lock лише додавання записів і обрізання за горизонтом.
+        """
+        horizon = self._horizon()
+        try:
+            # edited або last_seen >= watermark: нові записи та продовжені touch_rates
+            rows = list(get_repository().iter_pair_history(currency_a, currency_b, max(since, horizon)))
+            with self._lock:
+                added = self._add_rows(pair_id, rows)
+                horizon_us = to_epoch_us(horizon)
+                for series in self._series[pair_id].values():
+                    series.trim(horizon_us)
+                self._refreshed[pair_id] = (version, now)
+                if added:
+                    logger.info(f"History store {currency_a}/{currency_b}: {added} rows added, {self._pair_rows(pair_id)} total")
+        finally:
+            with self._lock:
+                self._refreshing.discard(pair_id)
+
+    def _load_pair(self, pair_id: int, currency_a: str, currency_b: str, version) -> None:
+        """
+        Перше завантаження пари. Читання з бази - поза lock, тож запити до вже
+        завантажених пар на нього не чекають; apply() тим часом буферизує записи
+        пари в _loading, і вони застосовуються після завантаження.
+        """
+        now = time.monotonic()
+        series_by_channel: Dict[int, RateSeries] = {}
+        try:
+            added, watermark = self._fill(series_by_channel, get_repository().iter_pair_history(currency_a, currency_b, self._horizon()))
+        except Exception:
+            with self._lock:
+                del self._loading[pair_id]
+            raise
+        with self._lock:
+            rows, touches = self._loading.pop(pair_id)
+            self._series[pair_id] = series_by_channel
+            self._advance(pair_id, watermark)
+            self._add_rows(pair_id, rows, advance=False)
+            for touch in touches:
+                self._touch(pair_id, touch)
+            self._refreshed[pair_id] = (version, now)
+            logger.info(f"History store {currency_a}/{currency_b}: {added} rows added, {self._pair_rows(pair_id)} total")
+
+    def warm_up(self, currency_a: str, currency_b: str, version=None) -> None:
+        """Завантажує пару у фоновому потоці, якщо її ще не завантажено і не завантажують."""
+        with self._lock:
+            pair_id = self._pair_id(currency_a, currency_b)
+            if pair_id in self._refreshed or pair_id in self._loading:
+                return
+        threading.Thread(target=self._warm_up, args=(currency_a, currency_b, version), daemon=True).start()
+
+    def _warm_up(self, currency_a: str, currency_b: str, version) -> None:
+        try:
+            self.refresh_pair(currency_a, currency_b, version)
+        except Exception as e:
+            logger.warning(f"History store {currency_a}/{currency_b}: loading failed: {e}")
+
+    def apply(self, rows: Sequence[dict], touches: Sequence[dict] = ()) -> None:
+        """
+        Застосовує вставлені записи та touch_rates до вже завантажених пар.
+
+        Watermark пар не зсувається: наступне оновлення перечитає ці записи
+        (відомі лише продовжать last_seen) разом з рядками інших записувачів.
+        """
+        with self._lock:
+            by_pair: Dict[int, List[dict]] = {}
+            for rate in rows:
+                pair_id = self._pair_ids.get((rate.get("currency_a"), rate.get("currency_b")))
+                if pair_id in self._loading:
+                    self._loading[pair_id][0].append(rate)
+                elif pair_id is not None and pair_id in self._refreshed:
+                    by_pair.setdefault(pair_id, []).append(rate)
+            for pair_id, pair_rows in by_pair.items():
+                self._add_rows(pair_id, pair_rows, advance=False)
+
+            for touch in touches:
+                pair_id = self._pair_ids.get((touch["currency_a"], touch["currency_b"]))
+                if pair_id in self._loading:
+                    self._loading[pair_id][1].append(touch)
+                else:
+                    self._touch(pair_id, touch)
+
+    def data_points(self, currency_a: str, currency_b: str, cutoff_date: datetime, interval: str, channel_ids: Optional[List[int]], channel_map: Dict[int, str], stats: bool = False, version=None) -> Optional[List[dict]]:
+        """
+        Data points /rates/history з колонок пари (оновлює пару за потреби, блокуючий виклик).
+
+        Args:
+            currency_a: Перша валюта пари (напр. "USD")
+            currency_b: Друга валюта пари (напр. "UAH")
+            cutoff_date: Початок періоду (UTC, naive)
+            interval: "hour" або "day"
+            channel_ids: Обмежити вибірку цими обмінниками (None - всі)
+            channel_map: Довідник id -> name для поля exchanger
+            stats: Додати stats до кожного data point
+            version: Версія пари в snapshot (див. refresh_pair)
+
+        Returns:
+            None, якщо період довший за days або пара ще не завантажена
+            (завантаження стартує у фоні, warm_up)
+        """
+        if cutoff_date < self._horizon():
+            return None
+        with self._lock:
+            loaded = self._pair_ids.get((currency_a, currency_b)) in self._refreshed
+        if not loaded:
+            self.warm_up(currency_a, currency_b, version)
+            return None
+        self.refresh_pair(currency_a, currency_b, version)
+
+        step = INTERVAL_US[interval]
+        cutoff = to_epoch_us(cutoff_date)
+        with self._lock:
+            selected = [
+                (channel_id, series)
+                for channel_id, series in self._series.get(self._pair_ids[(currency_a, currency_b)], {}).items()
+                if channel_ids is None or channel_id in channel_ids
+            ]
+            if HISTORY_NUMPY:
+                parts = [(channel_id, *series.columns(cutoff)) for channel_id, series in selected]
+                buckets = aggregate_columns(*merge_columns(parts), cutoff, step, stats)
+            else:
+                buckets = self._aggregate(selected, cutoff, step, HistoryAggregator(interval, cutoff_date, channel_map, stats=stats))
+
+        return [make_data_point(from_epoch_us(bucket), point, channel_map) for bucket, point in buckets]
+
+    @staticmethod
+    def _aggregate(selected: List[Tuple[int, RateSeries]], cutoff: int, step: int, aggregator: HistoryAggregator) -> List[tuple]:
+        """Агрегація без NumPy: колонки подаються в HistoryAggregator.add_values."""
+        streams = [series.rows_desc(channel_id, cutoff) for channel_id, series in selected]
+        # Як у запиті до бази: усі обмінники пари від нових записів до старих
+        for edited, last_seen, channel_id, buy, sell in heapq.merge(*streams, key=itemgetter(0), reverse=True):
+            if last_seen < cutoff:
+                continue
+            buy, sell = _from_float(buy), _from_float(sell)
+            bucket = max(edited, cutoff) // step * step
+            last_bucket = last_seen // step * step
+            while bucket <= last_bucket:
+                aggregator.add_values(bucket, channel_id, buy, sell)
+                bucket += step
+        return aggregator.buckets()
+
+    def _pair_rows(self, pair_id: int) -> int:
+        return sum(len(series) for series in self._series.get(pair_id, {}).values())
+
+    def stats(self) -> dict:
+        """Розмір сховища для /metrics."""
+        with self._lock:
+            all_series = [series for by_channel in self._series.values() for series in by_channel.values()]
+            return {
+                "pairs": len(self._refreshed),
+                "series": len(all_series),
+                "rows": sum(len(series) for series in all_series),
+                "bytes": sum(series.nbytes for series in all_series)
+            }
+
+
+# Спільне сховище для /rates/history
+history_store = HistoryStore()
@@ -0,0 +1,213 @@
+"""
+HTTP транспорт клієнта Supabase (PostgREST).
+
+Усі запити до бази йдуть через один httpx.Client з пулом keep-alive з'єднань
+(і HTTP/2 мультиплексуванням, якщо встановлено h2), тому послідовні запити
+(snapshot, тренди, історія) не платять TCP/TLS handshake щоразу.
+
+Транспорт додає:
+- обмеження одночасних запитів розміром пулу (решта чекає вільного слота);
+- повтор з jittered exponential backoff на тимчасових помилках: помилка
+  з'єднання (запит ще не відправлено) - для будь-якого методу, обрив
+  відповіді, read timeout та 502/503/504 - лише для GET/HEAD;
+- метрики пулу (in_use, waiting, latency) для /metrics.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from importlib.util import find_spec
+from typing import Callable, Optional
+
+import httpx
+
+from db import DB_MAX_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+# Максимум одночасних запитів/з'єднань (за замовчуванням - як пул потоків db)
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", str(DB_MAX_CONCURRENCY)))
+# Скільки секунд тримати невикористане з'єднання відкритим
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "120"))
+# HTTP/2 (потрібен пакет h2; без нього - HTTP/1.1 keep-alive)
+SUPABASE_HTTP2 = os.getenv("SUPABASE_HTTP2", "1") == "1"
+# Таймаути запиту: з'єднання та читання/запис/очікування пулу (секунд)
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "5"))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "30"))
+# Повтори на тимчасових помилках та базова затримка backoff (секунд)
+SUPABASE_RETRIES = int(os.getenv("SUPABASE_RETRIES", "2"))
+SUPABASE_RETRY_BACKOFF = float(os.getenv("SUPABASE_RETRY_BACKOFF", "0.2"))
+
+RETRY_STATUSES = {502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class PoolMetrics:
+    """Лічильники пулу: зайняті слоти, черга, затримки останніх запитів."""
+
+    def __init__(self, size: int, window: int = 1000):
+        self.size = size
+        self.in_use = 0
+        self.waiting = 0
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self._latencies = deque(maxlen=window)
+        self._waits = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def wait_started(self) -> None:
+        with self._lock:
+            self.waiting += 1
+
+    def acquired(self, waited: float) -> None:
+        with self._lock:
+            self.waiting -= 1
+            self.in_use += 1
+            self._waits.append(waited)
+
+    def released(self, latency: float, failed: bool = False) -> None:
+        with self._lock:
+            self.in_use -= 1
+            self.requests += 1
+            self.errors += failed
+            self._latencies.append(latency)
+
+    def retried(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    @staticmethod
+    def _summary(values) -> dict:
+        if not values:
+            return {"avg": None, "p50": None, "p95": None, "max": None}
+        ordered = sorted(values)
+        return {
+            "avg": round(sum(ordered) / len(ordered) * 1000, 2),
+            "p50": round(ordered[len(ordered) // 2] * 1000, 2),
+            "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 2),
+            "max": round(ordered[-1] * 1000, 2)
+        }
+
+    def stats(self) -> dict:
+        """Стан пулу для /metrics (затримки - мс, за останні window запитів)."""
+        with self._lock:
+            return {
+                "size": self.size,
+                "in_use": self.in_use,
+                "waiting": self.waiting,
+                "requests": self.requests,
+                "errors": self.errors,
+                "retries": self.retries,
+                "latency_ms": self._summary(self._latencies),
+                "wait_ms": self._summary(self._waits)
+            }
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """Тіло відповіді, що звільняє слот пулу, коли його дочитано або закрито."""
+
+    def __init__(self, stream: httpx.SyncByteStream, on_close: Callable[[], None]):
+        self._stream = stream
+        self._on_close: Optional[Callable[[], None]] = on_close
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self) -> None:
+        try:
+            self._stream.close()
+        finally:
+            if self._on_close is not None:
+                self._on_close()
+                self._on_close = None
+
+
+class PooledTransport(httpx.BaseTransport):
+    """Обгортка HTTPTransport: ліміт одночасних запитів, повтори, метрики."""
+
+    def __init__(self, transport: httpx.BaseTransport, metrics: PoolMetrics, retries: int = SUPABASE_RETRIES, backoff: float = SUPABASE_RETRY_BACKOFF):
+        self._transport = transport
+        self._slots = threading.BoundedSemaphore(metrics.size)
+        self.metrics = metrics
+        self.retries = retries
+        self.backoff = backoff
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.metrics.wait_started()
+        wait_started = time.perf_counter()
+        self._slots.acquire()
+        self.metrics.acquired(time.perf_counter() - wait_started)
+        started = time.perf_counter()
+
+        def release(failed: bool = False) -> None:
+            self._slots.release()
+            self.metrics.released(time.perf_counter() - started, failed)
+
+        try:
+            response = self._send(request)
+        except Exception:
+            release(failed=True)
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingStream(response.stream, release),
+            extensions=response.extensions
+        )
+
+    def _send(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            try:
+                response = self._transport.handle_request(request)
+                if response.status_code not in RETRY_STATUSES or attempt >= self.retries or request.method not in IDEMPOTENT_METHODS:
+                    return response
+                # Дочитане тіло повертає з'єднання в пул для повтору
+                response.read()
+                response.close()
+                reason = f"HTTP {response.status_code}"
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                # Запит ще не відправлено - повтор безпечний для будь-якого методу
+                if attempt >= self.retries:
+                    raise
+                reason = repr(e)
+            except (httpx.ReadTimeout, httpx.ReadError, httpx.RemoteProtocolError) as e:
+                if attempt >= self.retries or request.method not in IDEMPOTENT_METHODS:
+                    raise
+                reason = repr(e)
+
+            attempt += 1
+            self.metrics.retried()
+            # Full jitter: випадкова затримка до backoff * 2^attempt
+            delay = random.uniform(0, self.backoff * 2 ** (attempt - 1))
+            logger.warning(f"Supabase {request.method} {request.url.path} failed ({reason}), retry {attempt}/{self.retries} in {delay:.2f}s")
+            time.sleep(delay)
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+# Метрики спільного пулу (заповнюються, коли створено клієнт Supabase)
+pool_metrics = PoolMetrics(SUPABASE_POOL_SIZE)
+
+
+def create_http_client() -> httpx.Client:
+    """httpx.Client для клієнта Supabase з пулом keep-alive з'єднань, таймаутами та повторами."""
+    http2 = SUPABASE_HTTP2 and find_spec("h2") is not None
+    if SUPABASE_HTTP2 and not http2:
+        logger.warning("h2 is not installed, Supabase requests use HTTP/1.1 keep-alive")
+
+    limits = httpx.Limits(
+        max_connections=SUPABASE_POOL_SIZE,
+        max_keepalive_connections=SUPABASE_POOL_SIZE,
+        keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY
+    )
+    transport = PooledTransport(httpx.HTTPTransport(http2=http2, limits=limits), pool_metrics)
+    return httpx.Client(
+        transport=transport,
+        timeout=httpx.Timeout(SUPABASE_TIMEOUT, connect=SUPABASE_CONNECT_TIMEOUT),
+        follow_redirects=True
+    )
@@ -0,0 +1,214 @@
+"""
+Прийом нових котирувань (POST /rates/ingest).
+
+Пакет котирувань валідується та нормалізується (коди валют - strip().upper(),
+як у /rates/history; edited - ISO 8601 у UTC), послідовні дублікати на
+(channel_id, currency_a, currency_b) не вставляються - замість них продовжується
+last_seen запису, який вони повторюють (див. sql/rates_compaction.sql). Решта
+вставляється одним bulk insert. Після вставки записи одразу застосовуються до
+snapshot - кеш відповідей, ETag та SSE потік бачать нову версію даних без
+очікування наступного оновлення snapshot.
+"""
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from channels import ChannelDirectory
+from history_store import history_store
+from snapshot import LatestRatesSnapshot
+from storage import get_repository
+from trends import is_value_different
+
+logger = logging.getLogger(__name__)
+
+# Токен для POST /rates/ingest (заголовок X-Ingest-Token); без нього endpoint вимкнений
+INGEST_TOKEN = os.getenv("INGEST_TOKEN")
+# Максимальна кількість котирувань в одному запиті
+INGEST_MAX_BATCH = int(os.getenv("INGEST_MAX_BATCH", "1000"))
+# Допустиме випередження edited відносно годинника сервера (секунд)
+INGEST_MAX_CLOCK_SKEW = float(os.getenv("INGEST_MAX_CLOCK_SKEW", "300"))
+
+
+class QuoteError(ValueError):
+    """Некоректне котирування у пакеті."""
+
+
+def normalize_currency(code) -> str:
+    """Код валюти у форматі rates: без пробілів, у верхньому регістрі ("usd " -> "USD")."""
+    if not isinstance(code, str) or not code.strip().isalpha():
+        raise QuoteError(f"invalid currency code: {code!r}")
+    return code.strip().upper()
+
+
+def normalize_edited(edited) -> str:
+    """
+    Час котирування як ISO 8601 у UTC ("2025-11-03T15:10:00+00:00"); без значення - зараз.
+
+    Час з майбутнього (більше ніж на INGEST_MAX_CLOCK_SKEW) відхиляється: такий
+    edited став би watermark і всі наступні котирування виглядали б запізнілими.
+    """
+    now = datetime.now(timezone.utc)
+    if edited is None:
+        return now.isoformat()
+    try:
+        moment = datetime.fromisoformat(str(edited).replace("Z", "+00:00"))
+    except ValueError:
+        raise QuoteError(f"invalid edited timestamp: {edited!r}")
+    # Час без зони вважаємо UTC
+    moment = moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment.astimezone(timezone.utc)
+    if moment > now + timedelta(seconds=INGEST_MAX_CLOCK_SKEW):
+        raise QuoteError(f"edited is in the future: {edited!r}")
+    return moment.isoformat()
+
+
+def _normalize_value(value, field: str) -> Optional[float]:
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+        raise QuoteError(f"{field} must be a positive number or null")
+    return float(value)
+
+
+def normalize_quote(raw, channels: ChannelDirectory) -> dict:
+    """
+    Перевіряє одне котирування і приводить його до формату рядка rates.
+
+    Приймає channel_id або exchanger (назва з довідника), пару як
+    currency_a/currency_b або currency ("USD/UAH"), buy/sell та необов'язковий edited.
+
+    Raises:
+        QuoteError: якщо котирування некоректне
+    """
+    if not isinstance(raw, dict):
+        raise QuoteError("quote must be an object")
+
+    channel_id = raw.get("channel_id")
+    if channel_id is None and raw.get("exchanger"):
+        channel_id = channels.id_of(str(raw["exchanger"]).strip())
+    if isinstance(channel_id, bool) or not isinstance(channel_id, int) or channel_id not in channels.names:
+        raise QuoteError(f"unknown exchanger: {raw.get('channel_id', raw.get('exchanger'))!r}")
+
+    if raw.get("currency") is not None:
+        if "/" not in str(raw["currency"]):
+            raise QuoteError("currency must use format USD/UAH")
+        currency_a, currency_b = str(raw["currency"]).split("/", 1)
+    else:
+        currency_a, currency_b = raw.get("currency_a"), raw.get("currency_b")
+
+    buy = _normalize_value(raw.get("buy"), "buy")
+    sell = _normalize_value(raw.get("sell"), "sell")
+    if buy is None and sell is None:
+        raise QuoteError("buy or sell is required")
+
+    return {
+        "channel_id": channel_id,
+        "currency_a": normalize_currency(currency_a),
+        "currency_b": normalize_currency(currency_b),
+        "buy": buy,
+        "sell": sell,
+        "edited": normalize_edited(raw.get("edited"))
+    }
+
+
+def validate_batch(quotes, channels: ChannelDirectory) -> Tuple[List[dict], List[dict]]:
+    """
+    Нормалізує весь пакет.
+
+    Returns:
+        (rows, errors): нормалізовані рядки та список {"index": i, "message": ...}
+    """
+    if not isinstance(quotes, list) or not quotes:
+        return [], [{"index": None, "message": "expected a non-empty list of quotes"}]
+    if len(quotes) > INGEST_MAX_BATCH:
+        return [], [{"index": None, "message": f"batch is limited to {INGEST_MAX_BATCH} quotes"}]
+
+    rows, errors = [], []
+    for index, raw in enumerate(quotes):
+        try:
+            rows.append(normalize_quote(raw, channels))
+        except QuoteError as e:
+            errors.append({"index": index, "message": str(e)})
+    return rows, errors
+
+
+def drop_consecutive_duplicates(rows: List[dict], snapshot: LatestRatesSnapshot) -> Tuple[List[dict], List[dict], int]:
+    """
+    Відкидає котирування, що повторюють попереднє для того ж ключа.
+
+    Порівняння - як у skip-duplicate трендів (is_value_different для buy і sell):
+    з попереднім котируванням у пакеті або, для першого в пакеті, з поточним
+    записом snapshot. Запізнілі котирування (старіші за поточний запис) не
+    відкидаються - вони не є послідовними.
+
+    Returns:
+        (rows, touches, dropped): рядки для вставки (edited ASC); оновлення
+        last_seen для записів, які повторили (по одному на запис, з buy/sell -
+        для повторної вставки); кількість відкинутих котирувань
+    """
+    previous: Dict[tuple, dict] = {}
+    touches: Dict[tuple, dict] = {}
+    kept = []
+    for row in sorted(rows, key=lambda row: row["edited"]):
+        key = (row["channel_id"], row["currency_a"], row["currency_b"])
+        last = previous.get(key) or snapshot.current(key)
+        if last is not None and (last.get("edited") or "") <= row["edited"] \
+                and not is_value_different(row["buy"], last.get("buy")) \
+                and not is_value_different(row["sell"], last.get("sell")):
+            # Рядки відсортовані за edited - останній дублікат дає найпізніший last_seen
+            touches[key + (last["edited"],)] = {
+                "channel_id": key[0], "currency_a": key[1], "currency_b": key[2],
+                "buy": last.get("buy"), "sell": last.get("sell"),
+                "edited": last["edited"], "last_seen": row["edited"]
+            }
+            continue
+        previous[key] = row
+        kept.append(row)
+    return kept, list(touches.values()), len(rows) - len(kept)
+
+
+def restore_touches(repository, touches: List[dict], touched: int) -> int:
+    """
+    Повертає в базу записи, яких не знайшов touch_rates: для ключа не лишилося
+    жодного запису з edited <= edited дотику (видалені поза застосунком), хоча
+    snapshot ще тримає його як поточний. Без цього повтор зникав би з історії.
+
+    Returns:
+        Кількість вставлених записів
+    """
+    logger.warning(f"touch_rates updated {touched} of {len(touches)} rates, re-inserting the missing ones")
+    missing = [
+        touch for touch in touches
+        if not repository.rates_for_keys(
+            [(touch["channel_id"], touch["currency_a"], touch["currency_b"])], before=touch["edited"], limit=1
+        )
+    ]
+    return repository.insert_rates(missing) if missing else 0
+
+
+def ingest_rows(rows: List[dict], touches: List[dict], snapshot: LatestRatesSnapshot) -> int:
+    """
+    Вставляє рядки одним запитом, продовжує last_seen повторених записів
+    і застосовує нові рядки та повтори до snapshot і history_store (блокуючий виклик).
+
+    Returns:
+        Кількість вставлених записів
+    """
+    repository = get_repository()
+    inserted = repository.insert_rates(rows) if rows else 0
+    if touches:
+        try:
+            touched = repository.touch_rates(touches)
+            if touched < len(touches):
+                restore_touches(repository, touches, touched)
+        except Exception as e:
+            # last_seen - лише метадані для історії: дублікати все одно не вставляємо
+            logger.warning(f"Could not extend last_seen for {len(touches)} rates: {e}")
+    # Завантажені пари колонкової історії бачать нові записи без запиту до бази
+    history_store.apply(rows, touches)
+    if rows:
+        snapshot.apply(rows)
+        logger.info(f"Ingested {inserted} rates, snapshot watermark {snapshot.watermark}")
+    # Після apply: повтор рядка з цього ж пакета продовжує вже його
+    snapshot.touch(touches)
+    return inserted
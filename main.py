@@ -1,9 +1,25 @@
-from fastapi import FastAPI, Query
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Header, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional, List
-from supabase_client import supabase
+from typing import Optional
+from storage import get_repository
+from snapshot import rates_snapshot
+from db import run_query
+from channels import channel_directory, normalize_city
+from best_rates import compute_best_rates
+from stream import bestrate_stream, sse_events
+from response_cache import bestrate_cache, normalize_filter
+from conditional import is_not_modified, make_etag, not_modified
+from ingest import INGEST_TOKEN, drop_consecutive_duplicates, ingest_rows, validate_batch
+from history import HISTORY_SERVER_AGGREGATION, fetch_history_buckets
+from history_numpy import aggregate_records
+from rollups import fetch_rollup_history
+from history_store import HISTORY_STORE, history_store
+from http_pool import pool_metrics
+from pair_catalog import PairCatalog, pair_catalog
+from cross_rates import cross_rate_engine
 from datetime import datetime, timedelta
+import asyncio
 import logging
 import threading
 
@@ -22,140 +38,6 @@ except Exception as e:
 
 app = FastAPI(title="FX Hub Backend", version="1.0.0")
 
-
-def find_previous_rate(channel_id: int, currency_a: str, currency_b: str, current_buy: Optional[float], current_sell: Optional[float], channel_name: str, compare_value_type: str = "both"):
-    """
-    Знаходить попередній запис курсу для конкретного обмінника та валютної пари.
-    
-    Логіка skip-duplicate:
-    1. Запитуємо останні 100 записів для цього обмінника та пари (відсортовані за timestamp DESC)
-    2. Пропускаємо дублікати залежно від compare_value_type:
-       - "buy": порівнюємо тільки buy значення (для розрахунку buy тренду)
-       - "sell": порівнюємо тільки sell значення (для розрахунку sell тренду)
-       - "both": порівнюємо обидва buy і sell (застарілий режим)
-    3. Зупиняємося при першому записі, де значення відрізняється
-    4. Якщо всі попередні значення ідентичні → повертаємо None (trend = "stable")
-    
-    Args:
-        channel_id: ID обмінника (channel_id в таблиці rates)
-        currency_a: Перша валюта пари (напр. "USD")
-        currency_b: Друга валюта пари (напр. "UAH")
-        current_buy: Поточне значення buy
-        current_sell: Поточне значення sell
-        channel_name: Назва обмінника (для логування)
-        compare_value_type: Що порівнювати для skip-duplicate: "buy", "sell", або "both"
-    
-    Returns:
-        dict з полями "buy" та "sell" (попередні значення) або None якщо всі однакові
-    """
-    try:
-        # Запитуємо останні 100 записів для цього обмінника та валютної пари
-        query = supabase.table("rates").select(
-            "buy, sell, edited"
-        ).eq("channel_id", channel_id).eq("currency_a", currency_a).eq("currency_b", currency_b).order("edited", desc=True).limit(100)
-        
-        response = query.execute()
-        
-        if not response.data or len(response.data) < 2:
-            # Немає попередніх записів або лише один запис
-            return None
-        
-        # Пропускаємо перший запис (це поточний, він має бути першим через DESC order)
-        # Ітеруємо починаючи з другого запису
-        for record in response.data[1:]:  # Пропускаємо перший (поточний)
-            prev_buy = record.get("buy")
-            prev_sell = record.get("sell")
-            
-            # Порівнюємо залежно від типу
-            if compare_value_type == "buy":
-                # Для BUY: порівнюємо тільки buy значення для skip-duplicate
-                buy_different = (current_buy is not None and prev_buy is not None and abs(current_buy - prev_buy) > 0.0001) or \
-                               (current_buy is None) != (prev_buy is None)
-                if buy_different:
-                    return {
-                        "buy": prev_buy,
-                        "sell": prev_sell
-                    }
-            elif compare_value_type == "sell":
-                # Для SELL: порівнюємо тільки sell значення для skip-duplicate
-                sell_different = (current_sell is not None and prev_sell is not None and abs(current_sell - prev_sell) > 0.0001) or \
-                                (current_sell is None) != (prev_sell is None)
-                if sell_different:
-                    return {
-                        "buy": prev_buy,
-                        "sell": prev_sell
-                    }
-            else:
-                # Старий режим "both": порівнюємо обидва значення
-                buy_different = (current_buy is not None and prev_buy is not None and abs(current_buy - prev_buy) > 0.0001) or \
-                               (current_buy is None) != (prev_buy is None)
-                sell_different = (current_sell is not None and prev_sell is not None and abs(current_sell - prev_sell) > 0.0001) or \
-                                (current_sell is None) != (prev_sell is None)
-                
-                # Якщо хоча б одне значення відрізняється - знайшли baseline для порівняння
-                if buy_different or sell_different:
-                    return {
-                        "buy": prev_buy,
-                        "sell": prev_sell
-                    }
-        
-        # Якщо всі попередні значення ідентичні - тренд стабільний
-        return None
-        
-    except Exception as e:
-        logger.warning(f"Error finding previous rate for {channel_name} {currency_a}/{currency_b}: {e}")
-        return None
-
-
-def calculate_trend_and_changes(current_value: Optional[float], previous_value: Optional[float]) -> dict:
-    """
-    Розраховує тренд та зміни для одного значення (buy або sell).
-    
-    Args:
-        current_value: Поточне значення
-        previous_value: Попереднє значення
-    
-    Returns:
-        dict з полями:
-        - trend: "up", "down", або "stable"
-        - change_abs: Абсолютна зміна (округлена до 2 знаків)
-        - change_pct: Відсоткова зміна (округлена до 2 знаків)
-    """
-    # Якщо немає попереднього значення або поточне значення None → стабільний
-    if previous_value is None or current_value is None:
-        return {
-            "trend": "stable",
-            "change_abs": 0.0,
-            "change_pct": 0.0
-        }
-    
-    # Розраховуємо абсолютну зміну
-    change_abs = round(current_value - previous_value, 2)
-    
-    # Розраховуємо відсоткову зміну
-    if previous_value != 0:
-        change_pct = round((change_abs / previous_value) * 100, 2)
-    else:
-        change_pct = 0.0
-    
-    # Визначаємо тренд
-    if change_abs > 0.0001:  # Невеликий поріг для уникнення floating point помилок
-        trend = "up"
-    elif change_abs < -0.0001:
-        trend = "down"
-    else:
-        trend = "stable"
-        change_abs = 0.0  # Округлюємо до 0 якщо зміна мінімальна
-        change_pct = 0.0
-    
-    return {
-        "trend": trend,
-        "change_abs": change_abs,
-        "change_pct": change_pct
-    }
-
-app = FastAPI(title="FX Hub Backend", version="1.0.0")
-
 # CORS middleware для Flutter мобільного додатку
 app.add_middleware(
     CORSMiddleware,
@@ -163,6 +45,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 
@@ -179,9 +62,8 @@ async def health_check():
     Returns API status and database connection status.
     """
     try:
-        # Перевірка підключення до Supabase
-        test_query = supabase.table("channels").select("id").limit(1).execute()
-        db_status = "connected" if test_query.data is not None else "error"
+        # Перевірка підключення до бази (Supabase або локальна replica)
+        db_status = "connected" if await run_query(get_repository().ping) else "error"
     except Exception as e:
         logger.error(f"Database health check failed: {e}")
         db_status = "error"
@@ -198,9 +80,12 @@ async def health_check():
 async def get_best_rates(
     currencies: Optional[str] = Query(None, description="Comma-separated currency pairs (e.g., USD/UAH,EUR/UAH)"),
     exchangers: Optional[str] = Query(None, description="Comma-separated exchanger names"),
-    city: Optional[str] = Query(None, description="Optional city filter"),
+    city: Optional[str] = Query(None, description="Optional city filter (exchangers located in this city)"),
     limit: Optional[int] = Query(None, ge=1, le=100, description="Limit number of results (for pagination)"),
-    offset: Optional[int] = Query(0, ge=0, description="Offset for pagination")
+    offset: Optional[int] = Query(0, ge=0, description="Offset for pagination"),
+    cursor: Optional[str] = Query(None, description="Keyset pagination: meta.next_cursor of the previous page (overrides offset)"),
+    top_k: Optional[int] = Query(None, ge=1, le=10, description="Also return the K best buy and K best sell quotes per pair (buy_top/sell_top)"),
+    if_none_match: Optional[str] = Header(None)
 ):
     """
     Returns best buy/sell rates per currency pair.
@@ -208,6 +93,9 @@ async def get_best_rates(
     Logic:
     - Fetches latest record per exchanger_id, currency_a, currency_b (ordered by timestamp DESC)
     - Computes buy_best = max(buy), sell_best = min(sell)
+    - With `city`, only exchangers located in that city are considered (per-city best-rate index)
+    - With `top_k`, each pair also lists its K best buy/sell quotes, each with its own trend
+    - Results are ordered by currency pair; trends are computed only for the returned page
     """
     try:
         # Parse filters
@@ -219,250 +107,218 @@ async def get_best_rates(
         if exchangers:
             exchanger_names = [ex.strip() for ex in exchangers.split(",")]
         
-        # Get channel mapping (id -> name)
-        channels_resp = supabase.table("channels").select("id, name").execute()
-        channel_map = {ch["id"]: ch["name"] for ch in channels_resp.data}
+        # Load the channel directory (cached) and pick up rates written since the last
+        # snapshot refresh (only rows newer than the watermark) concurrently
+        await asyncio.gather(
+            channel_directory.load(),
+            rates_snapshot.load()
+        )
+        
+        # Responses are cached per normalized filter set until the data version changes
+        # (a newer `edited` watermark or late rows in the snapshot, or a reloaded channel directory)
+        cache_key = (normalize_filter(currency_pairs), normalize_filter(exchanger_names), normalize_city(city), limit, offset, cursor, top_k)
+        data_version = (rates_snapshot.version, channel_directory.version)
+        
+        # Conditional GET: unchanged data + same filters -> 304 without building the response
+        etag = make_etag("bestrate", data_version, cache_key)
+        if is_not_modified(if_none_match, etag):
+            return not_modified(etag)
+        
+        cached_body = bestrate_cache.get(cache_key, data_version)
+        if cached_body is not None:
+            return Response(content=cached_body, media_type="application/json", headers={"ETag": etag})
+        
+        content = await compute_best_rates(currency_pairs, exchanger_names, limit, offset, cursor, city, top_k)
+        response = JSONResponse(status_code=200, content=content if content is not None else [])
+        if content is not None and content["meta"]["degraded"]:
+            # Trends fell back to "stable" (history lookup failed): the same data version
+            # must not keep serving this body, so neither cache it nor give it an ETag
+            response.headers["Cache-Control"] = "no-store"
+            return response
+        bestrate_cache.put(cache_key, data_version, response.body)
+        response.headers["ETag"] = etag
+        return response
         
-        # Build query to get rates
-        query = supabase.table("rates").select(
-            "currency_a, currency_b, buy, sell, edited, channel_id"
+    except Exception as e:
+        logger.error(f"Error in get_best_rates: {e}", exc_info=True)
+        return JSONResponse(
+            status_code=500,
+            content={
+                "success": False,
+                "error": "Internal server error",
+                "message": str(e)
+            }
+        )
+
+
+@app.get("/rates/bestrate/stream")
+async def stream_best_rates(
+    request: Request,
+    currencies: Optional[str] = Query(None, description="Comma-separated currency pairs to subscribe to (default: all)")
+):
+    """
+    Server-Sent Events stream of best rate changes.
+    
+    The first event is a `snapshot` with the current best rates of the subscribed pairs,
+    followed by `update` events with only the changed best buy/sell and trend fields
+    (plus `removed` pairs). One shared background poller computes the diffs for all clients.
+    """
+    pairs = [pair.strip() for pair in currencies.split(",")] if currencies else None
+    subscriber = bestrate_stream.subscribe(pairs)
+    return StreamingResponse(
+        sse_events(request, bestrate_stream, subscriber),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/rates/cross")
+async def get_cross_rates(
+    currencies: str = Query(..., description="Comma-separated currency pairs to synthesize (e.g., EUR/USD,PLN/EUR)"),
+    via: Optional[str] = Query(None, description="Comma-separated intermediate currencies to consider (default: all)"),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Returns synthetic (cross) best buy/sell rates through one intermediate currency.
+    
+    Logic:
+    - Every quote is an edge of the currency graph; the best buy/sell of each pair
+      and the graph are maintained by the latest-rates snapshot as rates arrive
+    - buy_best = max over intermediates M of (base -> M) * (M -> quote)
+    - sell_best = 1 / max over M of (quote -> M) * (M -> base)
+    - Each side lists its legs (pair, quote side used, rate, exchanger) in trade order
+    - Pairs without a common intermediate currency are listed in meta.unresolved
+    """
+    try:
+        pairs = []
+        for pair in currencies.split(","):
+            if pair.count("/") != 1:
+                return JSONResponse(
+                    status_code=400,
+                    content={
+                        "success": False,
+                        "error": "Invalid currency pair format",
+                        "message": "Use format: EUR/USD"
+                    }
+                )
+            currency_a, currency_b = (code.strip().upper() for code in pair.split("/"))
+            pairs.append((currency_a, currency_b))
+        via_currencies = [code.strip().upper() for code in via.split(",")] if via else None
+        
+        await asyncio.gather(
+            channel_directory.load(),
+            rates_snapshot.load()
         )
         
-        # Apply exchanger filter if provided
-        if exchanger_names:
-            # Get channel IDs for these exchangers
-            filtered_channel_ids = [
-                ch_id for ch_id, name in channel_map.items() if name in exchanger_names
-            ]
-            if filtered_channel_ids:
-                query = query.in_("channel_id", filtered_channel_ids)
+        etag = make_etag("rates/cross", rates_snapshot.version, channel_directory.version, pairs, normalize_filter(via_currencies) if via_currencies else None)
+        if is_not_modified(if_none_match, etag):
+            return not_modified(etag)
+        
+        # O(common neighbours) reads of the snapshot's per-pair best index per pair - no scan of the rates
+        channel_map = channel_directory.names
+        data = []
+        unresolved = []
+        for currency_a, currency_b in pairs:
+            result = cross_rate_engine.quote(currency_a, currency_b, channel_map, via_currencies)
+            if result is None:
+                unresolved.append(f"{currency_a}/{currency_b}")
             else:
-                # No matching exchangers found
-                return JSONResponse(status_code=200, content=[])
+                data.append(result)
         
-        # Execute query - order by edited timestamp DESC to get latest first
-        response = query.order("edited", desc=True).execute()
-        
-        if not response.data:
+        return JSONResponse(
+            status_code=200,
+            headers={"ETag": etag},
+            content={
+                "success": True,
+                "data": data,
+                "meta": {
+                    "total": len(data),
+                    "unresolved": unresolved
+                }
+            }
+        )
+    except Exception as e:
+        logger.error(f"Error in get_cross_rates: {e}", exc_info=True)
+        return JSONResponse(
+            status_code=500,
+            content={
+                "success": False,
+                "error": "Internal server error",
+                "message": str(e)
+            }
+        )
+
+
+# Ingestion is serialized so that duplicate detection sees the previous batch
+ingest_lock = asyncio.Lock()
+
+
+@app.post("/rates/ingest")
+async def ingest_rates(request: Request, x_ingest_token: Optional[str] = Header(None)):
+    """
+    Accepts a batch of new rate quotes.
+    
+    Body: a list of quotes (or {"quotes": [...]}), each with channel_id or exchanger,
+    currency_a/currency_b or currency ("USD/UAH"), buy, sell and optional edited (ISO 8601).
+    The whole batch is rejected with 400 if any quote is invalid. Quotes that repeat the
+    previous buy/sell of the same exchanger and pair are not stored (the repeated row's
+    last_seen is extended instead); the rest are inserted in one round trip and are
+    visible to /rates/bestrate immediately.
+    """
+    if not INGEST_TOKEN or x_ingest_token != INGEST_TOKEN:
+        return JSONResponse(
+            status_code=403,
+            content={
+                "success": False,
+                "error": "Forbidden",
+                "message": "Ingestion is disabled" if not INGEST_TOKEN else "Invalid X-Ingest-Token"
+            }
+        )
+    
+    try:
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        quotes = body.get("quotes") if isinstance(body, dict) else body
+        
+        await asyncio.gather(
+            channel_directory.load(),
+            rates_snapshot.load()
+        )
+        rows, errors = validate_batch(quotes, channel_directory)
+        if errors:
             return JSONResponse(
-                status_code=200,
-                content=[]
+                status_code=400,
+                content={
+                    "success": False,
+                    "error": "Invalid quotes",
+                    "details": errors
+                }
             )
         
-        # Group by currency pair and exchanger, keeping only the latest record per combination
-        latest_rates = {}
-        
-        for rate in response.data:
-            channel_id = rate.get("channel_id")
-            channel_name = channel_map.get(channel_id, "Unknown")
-            
-            # Skip if exchanger filter doesn't match
-            if exchanger_names and channel_name not in exchanger_names:
-                continue
-            
-            pair_key = f"{rate['currency_a']}/{rate['currency_b']}"
-            
-            # Apply currency filter if provided
-            if currency_pairs:
-                pair_formatted = f"{rate['currency_a']}/{rate['currency_b']}"
-                if pair_formatted not in currency_pairs:
-                    continue
-            
-            # Create unique key: pair + channel
-            unique_key = f"{pair_key}_{channel_id}"
-            
-            # Only keep the latest record per exchanger and currency pair
-            if unique_key not in latest_rates:
-                latest_rates[unique_key] = {
-                    **rate,
-                    "channel_name": channel_name
-                }
-            else:
-                # Compare timestamps to keep the latest
-                current_time = latest_rates[unique_key].get("edited")
-                new_time = rate.get("edited")
-                if new_time and (not current_time or new_time > current_time):
-                    latest_rates[unique_key] = {
-                        **rate,
-                        "channel_name": channel_name
-                    }
+        async with ingest_lock:
+            rows, touches, duplicates = drop_consecutive_duplicates(rows, rates_snapshot)
+            inserted = await run_query(ingest_rows, rows, touches, rates_snapshot)
         
-        # Group by currency pair and calculate best rates
-        results = {}
-        # Store full rate records for trend calculation
-        rate_records_map = {}  # Maps (pair_key, exchanger) -> full rate record
-        
-        for unique_key, rate in latest_rates.items():
-            pair_key = f"{rate['currency_a']}/{rate['currency_b']}"
-            channel_name = rate.get("channel_name", "Unknown")
-            
-            # Store full rate record for later trend calculation
-            rate_records_map[(pair_key, channel_name)] = rate
-            
-            if pair_key not in results:
-                results[pair_key] = {
-                    "currency": pair_key,
-                    "buy_records": [],
-                    "sell_records": []
-                }
-            
-            if rate.get("buy") is not None:
-                results[pair_key]["buy_records"].append({
-                    "value": rate["buy"],
-                    "exchanger": channel_name,
-                    "timestamp": rate.get("edited")
-                })
-            
-            if rate.get("sell") is not None:
-                results[pair_key]["sell_records"].append({
-                    "value": rate["sell"],
-                    "exchanger": channel_name,
-                    "timestamp": rate.get("edited")
-                })
+        if inserted:
+            bestrate_stream.wake()
         
-        # Calculate best rates and trend analytics
-        final_results = []
-        for pair_key, data in results.items():
-            buy_records = data["buy_records"]
-            sell_records = data["sell_records"]
-            
-            if not buy_records and not sell_records:
-                continue
-            
-            # Parse currency pair
-            currency_a, currency_b = pair_key.split("/")
-            
-            result = {
-                "currency": pair_key
-            }
-            
-            # Process buy rates
-            if buy_records:
-                best_buy = max(buy_records, key=lambda x: x["value"])
-                result["buy_best"] = best_buy["value"]
-                result["buy_exchanger"] = best_buy["exchanger"]
-                result["buy_timestamp"] = best_buy["timestamp"]
-                
-                # Find channel_id for best buy exchanger
-                buy_channel_id = None
-                for ch_id, name in channel_map.items():
-                    if name == best_buy["exchanger"]:
-                        buy_channel_id = ch_id
-                        break
-                
-                # Get full rate record for best buy (to get both buy and sell for duplicate skipping)
-                current_buy_rate = rate_records_map.get((pair_key, best_buy["exchanger"]))
-                current_buy_value = best_buy["value"]
-                current_sell_value = current_buy_rate.get("sell") if current_buy_rate else None
-                
-                # Find previous rate for buy (skip duplicates)
-                # Для BUY порівнюємо тільки buy значення при skip-duplicate
-                if buy_channel_id:
-                    prev_buy_rate = find_previous_rate(
-                        buy_channel_id, currency_a, currency_b,
-                        current_buy_value, current_sell_value, best_buy["exchanger"],
-                        compare_value_type="buy"
-                    )
-                    
-                    # Calculate trend and changes for buy
-                    if prev_buy_rate and prev_buy_rate.get("buy") is not None:
-                        buy_analytics = calculate_trend_and_changes(
-                            best_buy["value"], prev_buy_rate["buy"]
-                        )
-                    else:
-                        # All previous rates identical or no previous record
-                        buy_analytics = {
-                            "trend": "stable",
-                            "change_abs": 0.0,
-                            "change_pct": 0.0
-                        }
-                    
-                    result["buy_trend"] = buy_analytics["trend"]
-                    result["buy_change_abs"] = buy_analytics["change_abs"]
-                    result["buy_change_pct"] = buy_analytics["change_pct"]
-                else:
-                    # Channel not found - set defaults
-                    result["buy_trend"] = "stable"
-                    result["buy_change_abs"] = 0.0
-                    result["buy_change_pct"] = 0.0
-            
-            # Process sell rates
-            if sell_records:
-                best_sell = min(sell_records, key=lambda x: x["value"])
-                result["sell_best"] = best_sell["value"]
-                result["sell_exchanger"] = best_sell["exchanger"]
-                result["sell_timestamp"] = best_sell["timestamp"]
-                
-                # Find channel_id for best sell exchanger
-                sell_channel_id = None
-                for ch_id, name in channel_map.items():
-                    if name == best_sell["exchanger"]:
-                        sell_channel_id = ch_id
-                        break
-                
-                # Get full rate record for best sell (to get both buy and sell for duplicate skipping)
-                current_sell_rate = rate_records_map.get((pair_key, best_sell["exchanger"]))
-                current_sell_value = best_sell["value"]
-                current_buy_value_for_sell = current_sell_rate.get("buy") if current_sell_rate else None
-                
-                # Find previous rate for sell (skip duplicates)
-                # Для SELL порівнюємо тільки sell значення при skip-duplicate
-                if sell_channel_id:
-                    prev_sell_rate = find_previous_rate(
-                        sell_channel_id, currency_a, currency_b,
-                        current_buy_value_for_sell, current_sell_value, best_sell["exchanger"],
-                        compare_value_type="sell"
-                    )
-                    
-                    # Calculate trend and changes for sell
-                    if prev_sell_rate and prev_sell_rate.get("sell") is not None:
-                        sell_analytics = calculate_trend_and_changes(
-                            best_sell["value"], prev_sell_rate["sell"]
-                        )
-                    else:
-                        # All previous rates identical or no previous record
-                        sell_analytics = {
-                            "trend": "stable",
-                            "change_abs": 0.0,
-                            "change_pct": 0.0
-                        }
-                    
-                    result["sell_trend"] = sell_analytics["trend"]
-                    result["sell_change_abs"] = sell_analytics["change_abs"]
-                    result["sell_change_pct"] = sell_analytics["change_pct"]
-                else:
-                    # Channel not found - set defaults
-                    result["sell_trend"] = "stable"
-                    result["sell_change_abs"] = 0.0
-                    result["sell_change_pct"] = 0.0
-            
-            final_results.append(result)
-        
-        # Apply pagination if requested
-        total_count = len(final_results)
-        if limit:
-            start = offset or 0
-            end = start + limit
-            paginated_results = final_results[start:end]
-        else:
-            paginated_results = final_results
-            start = 0
-            end = total_count
-        
-        # Return with metadata for Flutter
         return JSONResponse(status_code=200, content={
             "success": True,
-            "data": paginated_results,
+            "data": {
+                "received": len(rows) + duplicates,
+                "inserted": inserted,
+                "duplicates": duplicates
+            },
             "meta": {
-                "total": total_count,
-                "limit": limit,
-                "offset": start,
-                "returned": len(paginated_results)
+                "watermark": rates_snapshot.watermark,
+                "generated_at": datetime.utcnow().isoformat() + "Z"
             }
         })
         
     except Exception as e:
-        logger.error(f"Error in get_best_rates: {e}", exc_info=True)
+        logger.error(f"Error in ingest_rates: {e}", exc_info=True)
         return JSONResponse(
             status_code=500,
             content={
@@ -473,16 +329,36 @@ async def get_best_rates(
         )
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Runtime counters for monitoring (response cache hit/miss statistics, history store size,
+    Supabase HTTP pool usage and latency).
+    """
+    return JSONResponse(status_code=200, content={
+        "success": True,
+        "data": {
+            "bestrate_cache": bestrate_cache.stats(),
+            "bestrate_stream": {"subscribers": bestrate_stream.subscriber_count},
+            "history_store": history_store.stats(),
+            "supabase_http": pool_metrics.stats()
+        },
+        "meta": {
+            "generated_at": datetime.utcnow().isoformat() + "Z"
+        }
+    })
+
+
 @app.get("/exchangers/list")
 async def get_exchangers_list():
     """
     Returns a list of all unique exchanger names from the rates table.
     """
     try:
-        # Get all unique channel names that have rates
-        response = supabase.table("channels").select("name").execute()
+        # Get all unique channel names from the cached channel directory
+        await channel_directory.load()
 
-        exchanger_names = sorted(set([ch["name"] for ch in response.data]))     
+        exchanger_names = sorted(set(channel_directory.names.values()))
 
         return JSONResponse(
             status_code=200,
@@ -505,85 +381,51 @@ async def get_exchangers_list():
 
 
 @app.get("/exchangers/pairs")
-async def get_exchangers_pairs():
+async def get_exchangers_pairs(
+    active_days: Optional[float] = Query(None, gt=0, le=365, description="Only pairs quoted by the exchanger within the last N days"),
+    if_none_match: Optional[str] = Header(None)
+):
     """
     Returns a mapping of all exchangers and the currency pairs they support.
     
     This endpoint is useful for dependent filtering logic in Flutter History Screen.
     Each exchanger entry contains the list of currency pairs available for that exchanger.
+    With `active_days`, pairs the exchanger has not quoted within that window are left out.
     """
     try:
-        # Get channel mapping (id -> name)
-        channels_resp = supabase.table("channels").select("id, name").execute() 
-        channel_map = {ch["id"]: ch["name"] for ch in channels_resp.data}
-        
-        # Initialize mapping for ALL exchangers (even if they have no rates)
-        exchanger_pairs_map = {name: set() for name in channel_map.values()}
-        all_pairs_set = set()
-        
-        # For each exchanger, get the latest rates (last record per currency pair)
-        # Strategy: Get all rates, group by (channel_id, currency_a, currency_b), keep only latest per group
-        
-        # Get all rates ordered by edited DESC (latest first)
-        response = supabase.table("rates").select(
-            "channel_id, currency_a, currency_b, edited"
-        ).order("edited", desc=True).execute()
-        
-        # Track which (channel_id, currency_a, currency_b) combinations we've already seen
-        # This way we keep only the LATEST record for each combination
-        seen_combinations = set()
-        
-        # Build mapping: add currency pairs from LATEST records only
-        for rate in response.data:
-            channel_id = rate.get("channel_id")
-            currency_a = rate.get("currency_a")
-            currency_b = rate.get("currency_b")
-            
-            # Skip null or empty values
-            if not channel_id or not currency_a or not currency_b:
-                continue
-            
-            exchanger_name = channel_map.get(channel_id)
-            if not exchanger_name:
-                continue
-            
-            # Create unique key: (channel_id, currency_a, currency_b)
-            combination_key = (channel_id, currency_a, currency_b)
-            
-            # Skip if we've already processed this combination (we have the latest record)
-            if combination_key in seen_combinations:
-                continue
-            
-            # Mark this combination as seen
-            seen_combinations.add(combination_key)
-            
-            # Create currency pair string
-            pair = f"{currency_a}/{currency_b}"
-            
-            # Add to exchanger's set of pairs
-            exchanger_pairs_map[exchanger_name].add(pair)
-            all_pairs_set.add(pair)
-        
-        # Convert to list format and sort
-        result_data = []
-        for exchanger_name in sorted(exchanger_pairs_map.keys()):
-            pairs_list = sorted(list(exchanger_pairs_map[exchanger_name]))
-            result_data.append({
-                "exchanger": exchanger_name,
-                "pairs": pairs_list
-            })
+        # Load the channel directory and refresh the latest-rates snapshot concurrently.
+        # The snapshot keeps an exchanger -> pairs index of the LATEST records, updated as rates arrive
+        await asyncio.gather(
+            channel_directory.load(),
+            rates_snapshot.load()
+        )
+        channel_map = channel_directory.names
+        
+        active_since = PairCatalog.active_since(active_days=active_days).isoformat() if active_days else None
+        etag = make_etag("exchangers/pairs", rates_snapshot.version, channel_directory.version, active_since)
+        if is_not_modified(if_none_match, etag):
+            return not_modified(etag)
+        
+        # Built from the index once per data version (and activity window), not per request
+        result_data = pair_catalog.exchanger_pairs(channel_map, active_days, channel_directory.version)
+        all_pairs_set = {pair for entry in result_data for pair in entry["pairs"]}
+        
+        meta = {
+            "total_exchangers": len(result_data),
+            "total_pairs": len(all_pairs_set),
+            "generated_at": datetime.utcnow().isoformat() + "Z"
+        }
+        if active_days:
+            meta["active_days"] = active_days
         
         # Return with metadata
         return JSONResponse(
             status_code=200,
+            headers={"ETag": etag},
             content={
                 "success": True,
                 "data": result_data,
-                "meta": {
-                    "total_exchangers": len(result_data),
-                    "total_pairs": len(all_pairs_set),
-                    "generated_at": datetime.utcnow().isoformat() + "Z"
-                }
+                "meta": meta
             }
         )
     except Exception as e:
@@ -603,7 +445,9 @@ async def get_rates_history(
     currency_pair: str = Query(..., description="Currency pair (e.g., USD/UAH)"),
     exchanger: Optional[str] = Query(None, description="Optional exchanger name filter"),
     days: int = Query(7, ge=1, le=90, description="Number of days of history (1-90)"),
-    interval: Optional[str] = Query("hour", regex="^(hour|day)$", description="Data aggregation interval")
+    interval: Optional[str] = Query("hour", regex="^(hour|day)$", description="Data aggregation interval"),
+    stats: bool = Query(False, description="Include open/close/min/max and record count per data point"),
+    if_none_match: Optional[str] = Header(None)
 ):
     """
     Returns historical rates data for charts/graphs.
@@ -626,24 +470,30 @@ async def get_rates_history(
         currency_a = currency_a.strip().upper()
         currency_b = currency_b.strip().upper()
         
-        # Get channel mapping
-        channels_resp = supabase.table("channels").select("id, name").execute()
-        channel_map = {ch["id"]: ch["name"] for ch in channels_resp.data}
-        
-        # Build query
-        query = supabase.table("rates").select(
-            "currency_a, currency_b, buy, sell, edited, channel_id"
-        ).eq("currency_a", currency_a).eq("currency_b", currency_b)
+        # Get channel mapping; the snapshot gives the pair version for the ETag: its newest `edited`
+        # and newest `last_seen` (repeated quotes that only extended an existing record), from memory
+        await asyncio.gather(
+            channel_directory.load(),
+            rates_snapshot.load()
+        )
+        channel_map = channel_directory.names
+        
+        # The history changes when new records of the pair arrive or get repeated, and as the
+        # window slides (accounted for at hour granularity)
+        window_hour = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        etag = make_etag(
+            "rates/history", rates_snapshot.pair_version(currency_a, currency_b), channel_directory.version,
+            currency_a, currency_b, exchanger, days, interval, stats, window_hour.isoformat()
+        )
+        if is_not_modified(if_none_match, etag):
+            return not_modified(etag)
         
         # Apply exchanger filter if provided
+        filtered_channel_ids = None
         if exchanger:
-            filtered_channel_ids = [
-                ch_id for ch_id, name in channel_map.items() if name == exchanger.strip()
-            ]
-            if filtered_channel_ids:
-                query = query.in_("channel_id", filtered_channel_ids)
-            else:
-                return JSONResponse(status_code=200, content={
+            filtered_channel_ids = channel_directory.ids_for([exchanger.strip()])
+            if not filtered_channel_ids:
+                return JSONResponse(status_code=200, headers={"ETag": etag}, content={
                     "success": True,
                     "data": {
                         "currency": currency_pair,
@@ -655,15 +505,59 @@ async def get_rates_history(
                 })
         
         # Calculate date range
-        from_date = datetime.utcnow()
-        # Supabase PostgREST uses ISO format for date filtering
-        # We'll filter in Python for simplicity, or use Supabase's date functions
+        cutoff_date = datetime.utcnow() - timedelta(days=days)
+        
+        # In-memory columnar history (history_store.py): only new records of the pair are read.
+        # None while the pair is still loading in the background or the range exceeds HISTORY_STORE_DAYS
+        data_points = None
+        if HISTORY_STORE:
+            data_points = await run_query(
+                history_store.data_points, currency_a, currency_b, cutoff_date, interval,
+                filtered_channel_ids, channel_map, stats, rates_snapshot.pair_version(currency_a, currency_b)
+            )
+        
+        # Complete hour/day buckets come from the rollup tables (rollups.py); only the first
+        # (cut by cutoff_date) and the current bucket are aggregated from raw records
+        if data_points is None:
+            data_points = await run_query(
+                fetch_rollup_history, currency_a, currency_b, cutoff_date, interval,
+                filtered_channel_ids, channel_map, stats
+            )
+        
+        # Optional server-side bucketing: one row per hour/day instead of every raw record
+        # (the RPC returns best rates only, so extra stats are always aggregated here)
+        if data_points is None and HISTORY_SERVER_AGGREGATION and not stats:
+            data_points = await run_query(
+                fetch_history_buckets, currency_a, currency_b, cutoff_date, interval,
+                filtered_channel_ids, channel_map
+            )
+        if data_points is not None:
+            return JSONResponse(status_code=200, headers={"ETag": etag}, content={
+                "success": True,
+                "data": {
+                    "currency": currency_pair,
+                    "period_days": days,
+                    "interval": interval,
+                    "data_points": data_points
+                },
+                "meta": {
+                    "count": len(data_points),
+                    "from_date": cutoff_date.isoformat() + "Z",
+                    "to_date": datetime.utcnow().isoformat() + "Z"
+                }
+            })
         
-        # Execute query - get all records for the period
-        response = query.order("edited", desc=True).execute()
+        # Execute query - only records for the period (edited >= cutoff is applied by the database).
+        # Records are streamed page by page and grouped by interval as they arrive (vectorized
+        # with NumPy when available; the date check inside only guards against timezone-shifted values)
+        data_points = await run_query(
+            aggregate_records,
+            get_repository().iter_pair_history(currency_a, currency_b, cutoff_date, filtered_channel_ids),
+            interval, cutoff_date, channel_map, stats
+        )
         
-        if not response.data:
-            return JSONResponse(status_code=200, content={
+        if not data_points:
+            return JSONResponse(status_code=200, headers={"ETag": etag}, content={
                 "success": True,
                 "data": {
                     "currency": currency_pair,
@@ -674,76 +568,7 @@ async def get_rates_history(
                 "meta": {"count": 0}
             })
         
-        # Filter by date range and group by interval
-        cutoff_date = datetime.utcnow()
-        if days > 0:
-            from datetime import timedelta
-            cutoff_date = datetime.utcnow() - timedelta(days=days)
-        
-        data_points = []
-        seen_times = set()  # Для дедуплікації
-        
-        for rate in response.data:
-            edited_str = rate.get("edited")
-            if not edited_str:
-                continue
-            
-            # Parse timestamp
-            try:
-                if isinstance(edited_str, str):
-                    if "T" in edited_str:
-                        rate_time = datetime.fromisoformat(edited_str.replace("Z", "+00:00"))
-                    else:
-                        rate_time = datetime.strptime(edited_str, "%Y-%m-%d %H:%M:%S")
-                else:
-                    rate_time = edited_str
-                
-                # Convert to UTC if timezone-aware
-                if rate_time.tzinfo:
-                    rate_time = rate_time.replace(tzinfo=None)
-                
-                # Filter by date range
-                if rate_time < cutoff_date:
-                    continue
-                
-                # Group by interval
-                if interval == "hour":
-                    time_key = rate_time.replace(minute=0, second=0, microsecond=0)
-                else:  # day
-                    time_key = rate_time.replace(hour=0, minute=0, second=0, microsecond=0)
-                
-                # Deduplicate and aggregate
-                time_iso = time_key.isoformat() + "Z"
-                
-                if time_iso not in seen_times:
-                    channel_id = rate.get("channel_id")
-                    channel_name = channel_map.get(channel_id, "Unknown")
-                    
-                    data_points.append({
-                        "timestamp": time_iso,
-                        "buy": rate.get("buy"),
-                        "sell": rate.get("sell"),
-                        "exchanger": channel_name
-                    })
-                    seen_times.add(time_iso)
-                else:
-                    # If multiple records for same interval, keep best rates
-                    for dp in data_points:
-                        if dp["timestamp"] == time_iso:
-                            if rate.get("buy") and (dp["buy"] is None or rate.get("buy") > dp["buy"]):
-                                dp["buy"] = rate.get("buy")
-                                dp["exchanger"] = channel_map.get(rate.get("channel_id"), "Unknown")
-                            if rate.get("sell") and (dp["sell"] is None or rate.get("sell") < dp["sell"]):
-                                dp["sell"] = rate.get("sell")
-                            break
-            except Exception as e:
-                logger.warning(f"Error parsing timestamp {edited_str}: {e}")
-                continue
-        
-        # Sort by timestamp
-        data_points.sort(key=lambda x: x["timestamp"])
-        
-        return JSONResponse(status_code=200, content={
+        return JSONResponse(status_code=200, headers={"ETag": etag}, content={
             "success": True,
             "data": {
                 "currency": currency_pair,
@@ -771,49 +596,42 @@ async def get_rates_history(
 
 
 @app.get("/currencies/list")
-async def get_currencies_list():
+async def get_currencies_list(if_none_match: Optional[str] = Header(None)):
     """
     Returns all unique currency pairs.
+    
+    Each pair carries first_seen/last_seen and the number of exchangers quoting it
+    (active_exchangers: latest quote within CATALOG_ACTIVE_DAYS).
     """
     try:
-        # Get all unique currency combinations
-        response = supabase.table("rates").select("currency_a, currency_b").execute()
+        # The pair catalog is derived from the snapshot and rebuilt only when its version
+        # (or the hour the activity window starts at) changes
+        await rates_snapshot.load()
         
-        currencies_a = set()
-        currencies_b = set()
-        pairs = []
-        seen_pairs = set()
-        
-        for rate in response.data:
-            if rate.get("currency_a"):
-                currencies_a.add(rate["currency_a"])
-            if rate.get("currency_b"):
-                currencies_b.add(rate["currency_b"])
-            
-            # Create unique pair
-            pair_key = (rate.get("currency_a"), rate.get("currency_b"))
-            if pair_key not in seen_pairs and pair_key[0] and pair_key[1]:
-                pairs.append({
-                    "base": pair_key[0],
-                    "quote": pair_key[1]
-                })
-                seen_pairs.add(pair_key)
+        active_since = PairCatalog.active_since(active_days=pair_catalog.active_days)
+        etag = make_etag("currencies/list", rates_snapshot.version, active_since.isoformat())
+        if is_not_modified(if_none_match, etag):
+            return not_modified(etag)
         
-        sorted_pairs = sorted(pairs, key=lambda x: (x["base"], x["quote"]))
+        pairs = await run_query(pair_catalog.entries)
+        currencies_a = sorted({pair["base"] for pair in pairs})
+        currencies_b = sorted({pair["quote"] for pair in pairs})
         
         return JSONResponse(
             status_code=200,
+            headers={"ETag": etag},
             content={
                 "success": True,
                 "data": {
-                    "currencies_a": sorted(list(currencies_a)),
-                    "currencies_b": sorted(list(currencies_b)),
-                    "pairs": sorted_pairs
+                    "currencies_a": currencies_a,
+                    "currencies_b": currencies_b,
+                    "pairs": pairs
                 },
                 "meta": {
                     "currencies_a_count": len(currencies_a),
                     "currencies_b_count": len(currencies_b),
-                    "pairs_count": len(sorted_pairs)
+                    "pairs_count": len(pairs),
+                    "active_days": pair_catalog.active_days
                 }
             }
         )
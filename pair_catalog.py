@@ -0,0 +1,143 @@
+"""
+Каталог валютних пар для /currencies/list та /exchangers/pairs.
+
+Для кожної пари: first_seen (перший запис пари в історії), last_seen (найновіший
+edited або last_seen - повтор того самого курсу теж котирування), кількість
+обмінників, що котирують пару, та активних серед них - з останнім котируванням,
+не старшим за CATALOG_ACTIVE_DAYS.
+
+last_seen та обмінники беруться з індексу пар у snapshot (оновлюється разом з
+ним при refresh та ingest), first_seen - з таблиці pair_catalog
+(sql/pair_catalog.sql), яка читається один раз; для пар, що з'явилися пізніше,
+first_seen знає snapshot. Готовий список перебудовується лише коли змінюється
+версія snapshot або година, від якої рахується вікно активності, тож
+запит /currencies/list - O(pairs) читання готового списку.
+
+Мапа обмінник -> пари (/exchangers/pairs) будується так само з індексу
+обмінників у snapshot, з необов'язковим фільтром активності (active_days), і
+кешується до зміни версії snapshot, довідника обмінників або години вікна.
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from snapshot import LatestRatesSnapshot, rates_snapshot
+from storage import get_repository
+
+logger = logging.getLogger(__name__)
+
+# Обмінник активний для пари, якщо його останнє котирування не старше за стільки днів
+CATALOG_ACTIVE_DAYS = float(os.getenv("CATALOG_ACTIVE_DAYS", "7"))
+
+
+class PairCatalog:
+    """Список валютних пар з first/last seen та кількістю обмінників."""
+
+    def __init__(self, snapshot: LatestRatesSnapshot, active_days: float = CATALOG_ACTIVE_DAYS):
+        self.snapshot = snapshot
+        self.active_days = active_days
+        self._first_seen: Optional[Dict[Tuple[str, str], str]] = None
+        self._entries: List[dict] = []
+        self._version = None
+        # (версія snapshot, версія довідника, межа вікна) -> мапа обмінник -> пари
+        self._exchanger_pairs: Dict[tuple, List[dict]] = {}
+        self._lock = threading.Lock()
+
+    def _load_first_seen(self) -> Dict[Tuple[str, str], str]:
+        try:
+            rows = get_repository().pair_first_seen()
+        except Exception as e:
+            logger.warning(f"pair_catalog unavailable, first_seen is known only for pairs added since startup: {e}")
+            rows = []
+        return {(row["currency_a"], row["currency_b"]): row["first_seen"] for row in rows}
+
+    @staticmethod
+    def active_since(now: Optional[datetime] = None, active_days: float = CATALOG_ACTIVE_DAYS) -> datetime:
+        """Межа вікна активності (UTC, naive), округлена до години - список не змінюється щосекунди."""
+        now = now or datetime.utcnow()
+        return now.replace(minute=0, second=0, microsecond=0) - timedelta(days=active_days)
+
+    def entries(self, now: Optional[datetime] = None) -> List[dict]:
+        """
+        Пари, відсортовані за (base, quote) (блокуючий виклик при першому зверненні).
+
+        Returns:
+            [{"base", "quote", "first_seen", "last_seen", "exchangers", "active_exchangers"}]
+        """
+        active_since = self.active_since(now, self.active_days)
+        version = (self.snapshot.version, active_since)
+        if version == self._version:
+            return self._entries
+
+        with self._lock:
+            if version == self._version:
+                return self._entries
+            if self._first_seen is None:
+                self._first_seen = self._load_first_seen()
+
+            threshold = active_since.isoformat() + "+00:00"
+            entries = []
+            for (currency_a, currency_b), channels in self.snapshot.pair_index().items():
+                if not currency_a or not currency_b:
+                    continue
+                seen = [last_seen for channel_id, last_seen in channels.items() if channel_id and last_seen]
+                entries.append({
+                    "base": currency_a,
+                    "quote": currency_b,
+                    "first_seen": self._first_seen.get((currency_a, currency_b)) or self.snapshot.pair_first_seen(currency_a, currency_b),
+                    "last_seen": self.snapshot.pair_last_seen(currency_a, currency_b),
+                    "exchangers": len(seen),
+                    "active_exchangers": sum(1 for last_seen in seen if last_seen >= threshold)
+                })
+            entries.sort(key=lambda entry: (entry["base"], entry["quote"]))
+            self._entries = entries
+            self._version = version
+            return entries
+
+    def exchanger_pairs(self, channel_map: Dict[int, str], active_days: Optional[float] = None, channel_version=None, now: Optional[datetime] = None) -> List[dict]:
+        """
+        Пари кожного обмінника довідника (включно з обмінниками без курсів).
+
+        Args:
+            channel_map: {channel_id: назва обмінника}
+            active_days: Лише пари, котирувані обмінником за останні N днів (None - всі)
+            channel_version: Версія довідника (частина ключа кешу)
+
+        Returns:
+            [{"exchanger": назва, "pairs": ["USD/UAH", ...]}], відсортовані за назвою
+        """
+        active_since = self.active_since(now, active_days) if active_days else None
+        version = (self.snapshot.version, channel_version, active_since)
+        cached = self._exchanger_pairs.get(version)
+        if cached is not None:
+            return cached
+
+        threshold = active_since.isoformat() + "+00:00" if active_since else None
+        exchanger_pairs = {name: set() for name in channel_map.values()}
+        for channel_id, pairs in self.snapshot.channel_index().items():
+            exchanger_name = channel_map.get(channel_id) if channel_id else None
+            if not exchanger_name:
+                continue
+            for (currency_a, currency_b), last_seen in pairs.items():
+                if not currency_a or not currency_b:
+                    continue
+                if threshold is not None and (not last_seen or last_seen < threshold):
+                    continue
+                exchanger_pairs[exchanger_name].add(f"{currency_a}/{currency_b}")
+
+        result = [
+            {"exchanger": exchanger_name, "pairs": sorted(exchanger_pairs[exchanger_name])}
+            for exchanger_name in sorted(exchanger_pairs)
+        ]
+        with self._lock:
+            # Старі версії більше не знадобляться; різних active_days небагато
+            if any(key[:2] != version[:2] for key in self._exchanger_pairs) or len(self._exchanger_pairs) >= 16:
+                self._exchanger_pairs.clear()
+            self._exchanger_pairs[version] = result
+        return result
+
+
+# Спільний каталог для /currencies/list
+pair_catalog = PairCatalog(rates_snapshot)
@@ -0,0 +1,73 @@
+"""
+Наповнює локальну SQLite replica (STORAGE_BACKEND=sqlite) даними з Supabase.
+
+Копіює довідник channels повністю, а rates - інкрементально: лише записи,
+новіші за найновіший edited, що вже є в replica, потоково сторінками по PAGE_SIZE. Можна запускати за cron
+поруч із застосунком.
+
+last_seen (повтори котирувань від POST /rates/ingest та compact_rates) змінюється
+у вже скопійованих записах, тому після нових записів переносяться й дотики:
+записи джерела з last_seen, не старішим за те, що вже бачила replica.
+
+Запуск:
+    python replicate_sqlite.py --path fxhub.db
+"""
+import argparse
+
+from storage import SQLITE_PATH, SQLiteRepository, SupabaseRepository
+
+# Максимальна кількість рядків, яку PostgREST віддає за один запит
+PAGE_SIZE = 1000
+
+
+def replicate(path: str) -> int:
+    """
+    Returns:
+        Кількість скопійованих записів rates
+    """
+    source = SupabaseRepository()
+    replica = SQLiteRepository(path)
+
+    replica.upsert_channels(source.list_channels())
+
+    since = replica.max_edited()
+    # Не пізніше за since: нові записи (last_seen >= edited > since) копіюються без
+    # last_seen і отримують його з дотиків. None - порожня replica, усі дотики
+    touched_since = min((since, replica.max_last_seen() or since)) if since is not None else None
+    copied = 0
+    batch = []
+    # Від старих до нових, keyset по (edited, id): вибірка не обрізається лімітом PostgREST
+    for row in source.iter_rates(since, descending=False, page_size=PAGE_SIZE):
+        # Записи з edited == since уже в replica (пачки зберігаються лише цілими групами edited)
+        if row["edited"] == since:
+            continue
+        if len(batch) >= PAGE_SIZE and row["edited"] != batch[-1]["edited"]:
+            copied += replica.insert_rates(batch)
+            print(f"  ... {copied} records (up to {batch[-1]['edited']})")
+            batch = []
+        batch.append(row)
+    if batch:
+        copied += replica.insert_rates(batch)
+        print(f"  ... {copied} records (up to {batch[-1]['edited']})")
+
+    touched = 0
+    batch = []
+    for row in source.iter_touched_rates(touched_since, page_size=PAGE_SIZE):
+        batch.append(row)
+        if len(batch) >= PAGE_SIZE:
+            touched += replica.touch_rates(batch)
+            batch = []
+    if batch:
+        touched += replica.touch_rates(batch)
+    print(f"  ... {touched} records touched (last_seen >= {touched_since or 'any'})")
+    return copied
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default=SQLITE_PATH, help="Файл SQLite бази (за замовчуванням SQLITE_PATH)")
+    args = parser.parse_args()
+
+    print(f"📥 Replicating Supabase -> {args.path}")
+    total = replicate(args.path)
+    print(f"✅ Done: {total} new rates records")
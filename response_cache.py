@@ -0,0 +1,93 @@
+"""
+LRU кеш готових відповідей (JSON bytes) з прив'язкою до версії даних.
+
+Ключ - нормалізований набір фільтрів запиту, версія - те, від чого залежить
+відповідь (напр. watermark snapshot курсів). Щойно версія змінюється, весь кеш
+скидається, тож клієнт не отримає застарілі курси після оновлення snapshot.
+"""
+import os
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable, Optional, Tuple
+
+BESTRATE_CACHE_MAX_ENTRIES = int(os.getenv("BESTRATE_CACHE_MAX_ENTRIES", "256"))
+BESTRATE_CACHE_MAX_BYTES = int(os.getenv("BESTRATE_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+
+
+def normalize_filter(values: Optional[Iterable[str]]) -> Tuple[str, ...]:
+    """Відсортований список унікальних значень фільтра (порядок і дублікати не впливають на ключ)."""
+    return tuple(sorted(set(values or [])))
+
+
+class ResponseCache:
+    """LRU кеш відповідей з обмеженням кількості записів та сумарного розміру."""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._version: Any = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _sync_version(self, version: Any) -> None:
+        """Скидає кеш, якщо дані змінилися з моменту збереження відповідей."""
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self.clear()
+            self._version = version
+
+    def get(self, key: Hashable, version: Any) -> Optional[bytes]:
+        """Повертає збережену відповідь для ключа, якщо вона відповідає поточній версії даних."""
+        self._sync_version(version)
+        body = self._entries.get(key)
+        if body is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return body
+
+    def put(self, key: Hashable, version: Any, body: bytes) -> None:
+        """Зберігає відповідь; найдавніше використані записи витісняються при перевищенні лімітів."""
+        self._sync_version(version)
+        if len(body) > self.max_bytes:
+            return
+
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous)
+
+        self._entries[key] = body
+        self._bytes += len(body)
+
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        """Лічильники для моніторингу."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+
+
+# Кеш відповідей /rates/bestrate
+bestrate_cache = ResponseCache(BESTRATE_CACHE_MAX_ENTRIES, BESTRATE_CACHE_MAX_BYTES)
@@ -0,0 +1,29 @@
+"""
+Інкрементальне оновлення rollup історії курсів (job для cron).
+
+Агрегує закриті hourly/daily bucket кожної валютної пари (по всіх обмінниках
+та по кожному обміннику) після rolled_until і зберігає їх у rate_rollups (див.
+rollups.py, sql/rate_rollups.sql). Працює з поточним STORAGE_BACKEND.
+
+Запуск:
+    python rollup_rates.py
+    python rollup_rates.py --pair USD/UAH --rebuild
+"""
+import argparse
+
+from rollups import ROLLUP_DAYS, refresh_rollups
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pair", action="append", help="Оновити лише цю пару (USD/UAH); можна кілька разів")
+    parser.add_argument("--rebuild", action="store_true", help=f"Перерахувати rollup за останні {ROLLUP_DAYS} днів (запізнілі котирування)")
+    args = parser.parse_args()
+
+    pairs = None
+    if args.pair:
+        pairs = [tuple(code.strip().upper() for code in pair.split("/", 1)) for pair in args.pair]
+
+    print(f"📊 Refreshing history rollups{' (rebuild)' if args.rebuild else ''}")
+    saved = refresh_rollups(pairs, rebuild=args.rebuild)
+    print(f"✅ Done: {saved} buckets saved")
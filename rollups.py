@@ -0,0 +1,146 @@
+"""
+Rollup історії курсів: готові hourly/daily bucket для /rates/history.
+
+Для кожної валютної пари і інтервалу ("hour", "day") зберігаються bucket по
+всіх обмінниках пари (channel_id = ALL_EXCHANGERS) та по кожному обміннику
+окремо. Bucket містить те саме, що HistoryAggregator з stats=True: найкращі
+buy/sell з обмінниками, open/close/min/max для buy і sell та кількість записів -
+rollup будується тим самим агрегатором, тому відповідь не відрізняється від
+агрегації сирих записів.
+
+Rollup підтримується інкрементально (refresh_rollups, job для cron - rollup_rates.py):
+кожен запуск агрегує лише закриті bucket після rolled_until пари. /rates/history
+читає з rollup повні bucket періоду, а з сирих записів рахує лише перший
+(обрізаний cutoff) bucket та все після rolled_until - поточний незакритий bucket.
+
+Котирування, що надійшли із запізненням більше ніж на bucket, у вже закриті
+bucket не потрапляють - їх підхоплює rollup_rates.py --rebuild.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from history import HistoryAggregator, interval_step, make_data_point, parse_edited, truncate_to_interval
+from storage import ALL_EXCHANGERS, get_repository
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_INTERVALS = ("hour", "day")
+# Максимальний період /rates/history (days <= 90)
+ROLLUP_DAYS = 90
+
+STATS_FIELDS = (
+    "buy_open", "buy_close", "buy_min", "buy_max",
+    "sell_open", "sell_close", "sell_min", "sell_max", "count"
+)
+
+
+def _rollup_row(time_key: datetime, channel_id: int, point: dict) -> dict:
+    """Рядок rate_rollups з bucket HistoryAggregator (stats=True)."""
+    return {
+        "bucket": time_key.isoformat() + "+00:00",
+        "channel_id": channel_id,
+        "buy": point["buy"],
+        "sell": point["sell"],
+        "exchanger_id": point["exchanger_id"],
+        "sell_exchanger_id": point["sell_exchanger_id"],
+        **{field: point["stats"][field] for field in STATS_FIELDS}
+    }
+
+
+def build_rollups(currency_a: str, currency_b: str, interval: str, now: Optional[datetime] = None, rebuild: bool = False) -> int:
+    """
+    Агрегує закриті bucket пари після rolled_until (або за ROLLUP_DAYS, якщо
+    rollup ще не будувався чи rebuild=True) і зберігає їх (блокуючий виклик).
+
+    Returns:
+        Кількість збережених bucket
+    """
+    repository = get_repository()
+    now = now or datetime.utcnow()
+    # Поточний bucket ще не закритий - його endpoint рахує з сирих записів
+    end = truncate_to_interval(now, interval)
+    rolled_until = None if rebuild else repository.rollup_state(currency_a, currency_b, interval)
+    start = parse_edited(rolled_until) if rolled_until else truncate_to_interval(now - timedelta(days=ROLLUP_DAYS), interval)
+    if start >= end:
+        return 0
+
+    # Потоково: до 90 днів історії пари не тримаються в пам'яті цілком
+    records = repository.iter_pair_history(currency_a, currency_b, start, until=end)
+    pair_aggregator = HistoryAggregator(interval, start, {}, stats=True, until=end)
+    channel_aggregators: Dict[int, HistoryAggregator] = defaultdict(
+        lambda: HistoryAggregator(interval, start, {}, stats=True, until=end)
+    )
+    for rate in records:
+        pair_aggregator.add(rate)
+        channel_aggregators[rate.get("channel_id")].add(rate)
+
+    rows = [_rollup_row(time_key, ALL_EXCHANGERS, point) for time_key, point in pair_aggregator.buckets()]
+    for channel_id, aggregator in channel_aggregators.items():
+        rows.extend(_rollup_row(time_key, channel_id, point) for time_key, point in aggregator.buckets())
+    return repository.save_rollups(currency_a, currency_b, interval, rows, end)
+
+
+def refresh_rollups(pairs: Optional[Iterable[Tuple[str, str]]] = None, now: Optional[datetime] = None, rebuild: bool = False) -> int:
+    """
+    Оновлює rollup усіх пар (або лише pairs) для всіх ROLLUP_INTERVALS.
+
+    Returns:
+        Кількість збережених bucket
+    """
+    if pairs is None:
+        pairs = {(rate["currency_a"], rate["currency_b"]) for rate in get_repository().latest_rates()}
+    saved = 0
+    for currency_a, currency_b in sorted(pairs):
+        for interval in ROLLUP_INTERVALS:
+            saved += build_rollups(currency_a, currency_b, interval, now=now, rebuild=rebuild)
+    return saved
+
+
+def fetch_rollup_history(currency_a: str, currency_b: str, cutoff_date: datetime, interval: str, channel_ids: Optional[List[int]], channel_map: Dict[int, str], stats: bool = False) -> Optional[List[dict]]:
+    """
+    Data points /rates/history з rollup і сирих записів лише для країв періоду.
+
+    Returns:
+        Список data points (відсортований за timestamp) або None, якщо rollup
+        пари ще не покриває жодного повного bucket періоду (чи фільтр обмінника
+        дає кілька channel_id) - тоді endpoint агрегує сирі записи сам
+    """
+    if channel_ids is not None and len(channel_ids) != 1:
+        return None
+
+    repository = get_repository()
+    try:
+        rolled_until = repository.rollup_state(currency_a, currency_b, interval)
+    except NotImplementedError:
+        return None
+    except Exception as e:
+        logger.warning(f"Rollup state unavailable for {currency_a}/{currency_b}, falling back to raw rows: {e}")
+        return None
+    if not rolled_until:
+        return None
+
+    rolled_until = parse_edited(rolled_until)
+    # Перший bucket обрізаний cutoff_date - rollup містить його повністю, тому він рахується з сирих записів
+    head_end = truncate_to_interval(cutoff_date, interval) + interval_step(interval)
+    if head_end >= rolled_until:
+        return None
+
+    channel_id = channel_ids[0] if channel_ids else ALL_EXCHANGERS
+    rollup_rows = repository.rollups(currency_a, currency_b, interval, channel_id, head_end, rolled_until)
+    head = repository.iter_pair_history(currency_a, currency_b, cutoff_date, channel_ids, until=head_end)
+    tail = repository.iter_pair_history(currency_a, currency_b, rolled_until, channel_ids)
+
+    data_points = HistoryAggregator(interval, cutoff_date, channel_map, stats=stats, until=head_end).add_all(head).data_points()
+    for row in rollup_rows:
+        point = {
+            "buy": row.get("buy"),
+            "sell": row.get("sell"),
+            "exchanger_id": row.get("exchanger_id"),
+            "sell_exchanger_id": row.get("sell_exchanger_id"),
+            "stats": {field: row.get(field) for field in STATS_FIELDS} if stats else None
+        }
+        data_points.append(make_data_point(parse_edited(str(row["bucket"])), point, channel_map))
+    data_points.extend(HistoryAggregator(interval, rolled_until, channel_map, stats=stats).add_all(tail).data_points())
+    return data_points
@@ -0,0 +1,513 @@
+"""
+In-process snapshot останніх курсів: один (найновіший) запис на
+(channel_id, currency_a, currency_b).
+
+Snapshot оновлюється інкрементально: перше завантаження бере з бази лише останній
+запис кожної комбінації (RPC latest_rates, DISTINCT ON), далі запитуються лише
+записи з edited >= межі читання (максимальний edited, прочитаний з бази, не
+пізніше поточного часу). Записи POST /rates/ingest застосовуються одразу, але
+межу читання не зсувають: рядки інших записувачів з меншим edited, які ще не
+прочитано, підхопить наступний refresh.
+/rates/bestrate, /exchangers/pairs та /currencies/list читають з нього замість
+повного сканування таблиці rates на кожен запит.
+
+Разом з останнім записом snapshot тримає baseline трендів кожного ключа:
+останні buy та sell, що відрізнялися від поточних (те, що skip-duplicate шукав
+у 100 записах історії). Вони підтримуються при кожному apply(), а початкові
+значення беруться з таблиці rate_trends (sql/rate_trends.sql), якщо вона є.
+
+Для фільтра city snapshot веде індекс (місто, пара) -> останні записи обмінників
+цього міста з готовими найкращими buy/sell. Індекс будується при першому
+запиті з містом (set_channel_cities) і далі оновлюється в тому самому apply().
+
+Повтори незмінного котирування не стають новими записами (ingest.touch_rates
+продовжує last_seen). Snapshot застосовує їх через touch(): з POST /rates/ingest
+одразу, а дотики інших записувачів refresh читає з бази (last_seen >= межі дотиків).
+Індекси пар і обмінників тримають час останнього котирування - max(edited,
+last_seen), - тож обмінник, що повторює той самий курс, лишається активним.
+
+Так само для всіх обмінників snapshot тримає найкращі buy/sell кожної пари та
+граф валют (валюта -> пари, в яких вона котирується) - з них cross_rates.py
+рахує крос-курси. Новий запис порівнюється лише з поточним найкращим; пара
+переглядається повністю, тільки коли погіршився сам найкращий запис.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from db import run_query
+from storage import get_repository
+from trends import is_value_different
+
+logger = logging.getLogger(__name__)
+
+# Як часто (секунд) snapshot перевіряє нові записи в базі
+SNAPSHOT_REFRESH_INTERVAL = float(os.getenv("SNAPSHOT_REFRESH_INTERVAL", "10"))
+# За скільки днів перше завантаження читає дотики (last_seen поточних записів до старту)
+SNAPSHOT_TOUCH_DAYS = float(os.getenv("SNAPSHOT_TOUCH_DAYS", "7"))
+
+SnapshotKey = Tuple[Optional[int], Optional[str], Optional[str]]
+PairKey = Tuple[Optional[str], Optional[str]]
+
+TREND_SIDES = ("buy", "sell")
+
+
+def _identity(rate: dict) -> tuple:
+    return tuple(rate.get(field) for field in ("channel_id", "currency_a", "currency_b", "edited", "buy", "sell"))
+
+
+def seen_at(rate: dict) -> Optional[str]:
+    """Коли котирування бачили востаннє: last_seen (повтори) або edited."""
+    return max(rate.get("edited") or "", rate.get("last_seen") or "") or None
+
+
+def _is_better(rate: dict, best: Optional[dict], side: str) -> bool:
+    """Чи кращий запис за best: buy - більший, sell - менший; серед рівних - новіший."""
+    value = rate.get(side)
+    if value is None:
+        return False
+    if best is None:
+        return True
+    edited, best_edited = rate.get("edited") or "", best.get("edited") or ""
+    if side == "buy":
+        return (value, edited) > (best["buy"], best_edited)
+    return (-value, edited) > (-best["sell"], best_edited)
+
+
+def _best_quotes(rates: Iterable[dict]) -> Tuple[Optional[dict], Optional[dict]]:
+    """Найкращі (buy, sell) записи серед rates."""
+    best_buy = best_sell = None
+    for rate in rates:
+        if _is_better(rate, best_buy, "buy"):
+            best_buy = rate
+        if _is_better(rate, best_sell, "sell"):
+            best_sell = rate
+    return best_buy, best_sell
+
+
+class LatestRatesSnapshot:
+    """Резидентне сховище останнього курсу на кожну пару (обмінник, валютна пара)."""
+
+    def __init__(self, refresh_interval: float = SNAPSHOT_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._rows: Dict[SnapshotKey, dict] = {}
+        self._watermark: Optional[str] = None
+        # Межа читання refresh: найновіший edited, прочитаний з бази (ingest її не зсуває)
+        self._read_watermark: Optional[str] = None
+        # Рядки з edited >= межі читання: наступний refresh прочитає їх знову і пропустить
+        self._reread: set = set()
+        # Запізнілі записи (edited <= watermark) не зсувають watermark - їх рахує версія даних
+        self._late_rows = 0
+        self._pair_late: Dict[PairKey, int] = {}
+        self._pair_watermarks: Dict[Tuple[Optional[str], Optional[str]], str] = {}
+        # Дотики (touch): межа читання з бази, кількість застосованих і найновіший last_seen пари
+        self._touch_watermark: Optional[str] = None
+        self._touches = 0
+        self._pair_last_seen: Dict[PairKey, str] = {}
+        # Індекс пар: (currency_a, currency_b) -> {channel_id: seen_at останнього запису}
+        self._pair_channels: Dict[Tuple[Optional[str], Optional[str]], Dict[Optional[int], str]] = {}
+        # Індекс обмінників: channel_id -> {(currency_a, currency_b): seen_at останнього запису}
+        self._channel_pairs: Dict[Optional[int], Dict[Tuple[Optional[str], Optional[str]], str]] = {}
+        # Індекс міст: channel_id -> місто, місто -> пара -> {channel_id: запис} та найкращі (buy, sell)
+        self._channel_cities: Dict[Optional[int], str] = {}
+        self._cities_version = None
+        self._city_rows: Dict[str, Dict[PairKey, Dict[Optional[int], dict]]] = {}
+        self._city_best: Dict[str, Dict[PairKey, Tuple[Optional[dict], Optional[dict]]]] = {}
+        # Найкращі (buy, sell) записи пари серед усіх обмінників і граф валют: валюта -> пари з нею
+        self._pair_best: Dict[PairKey, Tuple[Optional[dict], Optional[dict]]] = {}
+        self._currency_pairs: Dict[str, set] = {}
+        # edited першого запису пар, що з'явилися після першого завантаження
+        self._pair_first_seen: Dict[Tuple[Optional[str], Optional[str]], str] = {}
+        # key -> {"buy": ..., "sell": ...}; відсутня сторона - baseline ще невідомий
+        self._baselines: Dict[SnapshotKey, Dict[str, Optional[float]]] = {}
+        self._baseline_lock = threading.Lock()
+        self._last_refresh = 0.0
+        self._lock = threading.Lock()
+        # Поточне оновлення з load(): решта запитів чекає на нього, не займаючи потоків пулу
+        self._pending: Optional[asyncio.Future] = None
+
+    @property
+    def watermark(self) -> Optional[str]:
+        """Найновіший edited серед завантажених записів."""
+        return self._watermark
+
+    @property
+    def version(self) -> Tuple[Optional[str], int, int]:
+        """
+        Версія даних для ETag і кешів відповідей: watermark, кількість
+        запізнілих записів і дотиків (вони змінюють дані, не зсуваючи watermark).
+        """
+        return self._watermark, self._late_rows, self._touches
+
+    def pair_version(self, currency_a: str, currency_b: str) -> Tuple[Optional[str], int, Optional[str]]:
+        """Версія даних валютної пари: її watermark, кількість її запізнілих записів і найновіший last_seen."""
+        pair = (currency_a, currency_b)
+        return self._pair_watermarks.get(pair), self._pair_late.get(pair, 0), self._pair_last_seen.get(pair)
+
+    def apply(self, rows: Iterable[dict]) -> int:
+        """
+        Застосовує нові записи до snapshot.
+
+        Для кожного ключа залишається лише запис з найбільшим edited. Записи
+        обробляються від старих до нових: коли buy (sell) змінюється, попереднє
+        значення стає baseline тренду.
+
+        Returns:
+            Кількість ключів, для яких змінився останній запис
+        """
+        changed = 0
+        # Після першого завантаження snapshot знає всі ключі: новий ключ ще не має історії
+        complete = self._watermark is not None
+        with self._baseline_lock:
+            for rate in sorted(rows, key=lambda rate: rate.get("edited") or ""):
+                changed += self._apply_one(rate, complete)
+        return changed
+
+    def _apply_one(self, rate: dict, complete: bool) -> int:
+        key = (rate.get("channel_id"), rate.get("currency_a"), rate.get("currency_b"))
+        edited = rate.get("edited")
+        current = self._rows.get(key)
+        changed = 0
+        if current is None:
+            self._rows[key] = rate
+            if complete:
+                self._baselines[key] = {side: None for side in TREND_SIDES}
+            changed = 1
+        elif edited and (not current.get("edited") or edited > current["edited"]):
+            baselines = self._baselines.setdefault(key, {})
+            for side in TREND_SIDES:
+                if is_value_different(rate.get(side), current.get(side)):
+                    baselines[side] = current.get(side)
+            self._rows[key] = rate
+            changed = 1
+        pair = (rate.get("currency_a"), rate.get("currency_b"))
+        # Повторно прочитаний запис (той самий edited, що й поточний запис ключа) - не новий.
+        # Новий запис з edited, що дорівнює watermark, теж не зсуває його - рахуємо як запізнілий
+        if edited and (current is None or current.get("edited") != edited):
+            if self._watermark is not None and edited <= self._watermark:
+                self._late_rows += 1
+            if pair in self._pair_watermarks and edited <= self._pair_watermarks[pair]:
+                self._pair_late[pair] = self._pair_late.get(pair, 0) + 1
+        if edited and (self._watermark is None or edited > self._watermark):
+            self._watermark = edited
+        if changed:
+            self._pair_channels.setdefault(pair, {})[key[0]] = seen_at(rate)
+            self._channel_pairs.setdefault(key[0], {})[pair] = seen_at(rate)
+            self._update_pair_best(pair, rate, current)
+            city = self._channel_cities.get(key[0])
+            if city is not None:
+                self._city_rows.setdefault(city, {}).setdefault(pair, {})[key[0]] = rate
+                self._update_city_best(city, pair)
+        if complete and edited and pair not in self._pair_watermarks:
+            # Записи застосовуються від старих до нових - це перший запис нової пари
+            self._pair_first_seen[pair] = edited
+        if edited and (pair not in self._pair_watermarks or edited > self._pair_watermarks[pair]):
+            self._pair_watermarks[pair] = edited
+        seen = seen_at(rate)
+        if seen and seen > self._pair_last_seen.get(pair, ""):
+            self._pair_last_seen[pair] = seen
+        return changed
+
+    def touch(self, touches: Iterable[dict]) -> int:
+        """
+        Застосовує повтори котирувань (touch_rates): продовжує last_seen поточного запису ключа.
+
+        Дотик враховується, якщо повторили саме поточне котирування: його edited не
+        новіший за поточний запис (compact_rates міг злити запис у голову серії), а
+        buy/sell ті самі. Записи змінюються на місці - на них посилаються індекси.
+
+        Args:
+            touches: dict з channel_id, currency_a, currency_b, buy, sell, edited та last_seen
+
+        Returns:
+            Кількість ключів, для яких зсунувся last_seen
+        """
+        touched = 0
+        with self._baseline_lock:
+            for touch in touches:
+                key = (touch.get("channel_id"), touch.get("currency_a"), touch.get("currency_b"))
+                current = self._rows.get(key)
+                last_seen = touch.get("last_seen")
+                if current is None or not last_seen or (touch.get("edited") or "") > (current.get("edited") or ""):
+                    continue
+                if is_value_different(touch.get("buy"), current.get("buy")) or is_value_different(touch.get("sell"), current.get("sell")):
+                    continue
+                if last_seen <= seen_at(current):
+                    continue
+                current["last_seen"] = last_seen
+                pair = key[1:]
+                self._pair_channels.setdefault(pair, {})[key[0]] = last_seen
+                self._channel_pairs.setdefault(key[0], {})[pair] = last_seen
+                if last_seen > self._pair_last_seen.get(pair, ""):
+                    self._pair_last_seen[pair] = last_seen
+                touched += 1
+            self._touches += touched
+        return touched
+
+    def _update_city_best(self, city: str, pair: PairKey) -> None:
+        """Перераховує найкращі buy (max) і sell (min) пари в місті; серед рівних - новіший запис."""
+        self._city_best.setdefault(city, {})[pair] = _best_quotes(self._city_rows[city][pair].values())
+
+    def _update_pair_best(self, pair: PairKey, rate: dict, previous: Optional[dict]) -> None:
+        """
+        Оновлює найкращі buy/sell пари після того, як rate замінив previous.
+
+        Кращий за поточний найкращий запис просто займає його місце; всі записи
+        пари переглядаються лише тоді, коли замінено сам найкращий запис.
+        """
+        if pair not in self._pair_best:
+            currency_a, currency_b = pair
+            if currency_a and currency_b and currency_a != currency_b:
+                self._currency_pairs.setdefault(currency_a, set()).add(pair)
+                self._currency_pairs.setdefault(currency_b, set()).add(pair)
+        best = list(self._pair_best.get(pair, (None, None)))
+        stale = False
+        for index, side in enumerate(TREND_SIDES):
+            if _is_better(rate, best[index], side):
+                best[index] = rate
+            elif previous is not None and best[index] is previous:
+                stale = True
+        if stale:
+            currency_a, currency_b = pair
+            best = _best_quotes(self._rows[(channel_id, currency_a, currency_b)] for channel_id in self._pair_channels[pair])
+        self._pair_best[pair] = tuple(best)
+
+    def set_channel_cities(self, cities: Dict[int, str], version=None) -> None:
+        """
+        Задає міста обмінників (channels.city) і перебудовує індекс міст.
+
+        Args:
+            cities: {channel_id: нормалізоване місто}
+            version: Версія довідника - з тією самою версією індекс не перебудовується
+        """
+        if version is not None and version == self._cities_version:
+            return
+        with self._baseline_lock:
+            self._channel_cities = dict(cities)
+            self._city_rows = {}
+            for (channel_id, currency_a, currency_b), rate in self._rows.items():
+                city = self._channel_cities.get(channel_id)
+                if city is not None:
+                    self._city_rows.setdefault(city, {}).setdefault((currency_a, currency_b), {})[channel_id] = rate
+            self._city_best = {}
+            for city, pairs in self._city_rows.items():
+                for pair in pairs:
+                    self._update_city_best(city, pair)
+            self._cities_version = version
+
+    def city_latest(self, city: str, channel_ids: Optional[Iterable[int]] = None, pairs: Optional[Iterable[str]] = None, best_only: bool = True) -> List[dict]:
+        """
+        Кандидати на найкращий курс у місті, відсортовані за edited DESC.
+
+        Без фільтра обмінників (і з best_only) - лише готові найкращі buy/sell
+        записи кожної пари міста, інакше - останні записи (вибраних) обмінників міста.
+
+        Args:
+            city: Нормалізоване місто (channels.normalize_city)
+            channel_ids: Обмежити вибірку цими обмінниками
+            pairs: Обмежити вибірку цими парами у форматі "USD/UAH"
+            best_only: Без фільтра обмінників повертати лише найкращі записи пар
+        """
+        channel_filter = set(channel_ids) if channel_ids is not None else None
+        pair_filter = set(pairs) if pairs is not None else None
+
+        rows = []
+        with self._baseline_lock:
+            city_best = self._city_best.get(city, {})
+            for (currency_a, currency_b), channel_rows in self._city_rows.get(city, {}).items():
+                if pair_filter is not None and f"{currency_a}/{currency_b}" not in pair_filter:
+                    continue
+                if channel_filter is None and best_only:
+                    best = city_best[(currency_a, currency_b)]
+                    rows.extend({id(rate): rate for rate in best if rate is not None}.values())
+                else:
+                    rows.extend(rate for channel_id, rate in channel_rows.items() if channel_filter is None or channel_id in channel_filter)
+
+        rows.sort(key=lambda rate: rate.get("edited") or "", reverse=True)
+        return rows
+
+    def is_fresh(self) -> bool:
+        """Чи оновлювався snapshot протягом останніх refresh_interval секунд."""
+        return bool(self._last_refresh) and time.monotonic() - self._last_refresh < self.refresh_interval
+
+    async def load(self) -> None:
+        """
+        Гарантує свіжий snapshot для endpoint.
+
+        Якщо він свіжий - без звернення до пулу потоків. Інакше оновлення
+        single-flight: запити, що прийшли під час нього, чекають той самий
+        future в event loop, а не блокуються на lock у потоках пулу db.
+        """
+        if self.is_fresh():
+            return
+        pending = self._pending
+        if pending is None or pending.done():
+            pending = self._pending = asyncio.ensure_future(run_query(self.refresh))
+        # shield: скасування одного запиту не скасовує оновлення для інших
+        await asyncio.shield(pending)
+
+    def refresh(self, force: bool = False) -> None:
+        """
+        Підтягує з бази нові записи (блокуючий виклик).
+
+        Перше завантаження читає лише останні котирування (rate_trends або latest_rates), далі -
+        записи з edited >= межі читання. Між оновленнями витримується refresh_interval,
+        якщо не передано force=True.
+        """
+        if not force and self.is_fresh():
+            return
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._last_refresh and now - self._last_refresh < self.refresh_interval:
+                return
+
+            repository = get_repository()
+            if self._read_watermark is None:
+                rows = self._initial_rows(repository)
+                touched_since = (datetime.utcnow() - timedelta(days=SNAPSHOT_TOUCH_DAYS)).isoformat() + "+00:00"
+            else:
+                # gte, а не gt: записи з тим самим edited могли з'явитися після попереднього оновлення
+                rows = repository.rates_since(self._read_watermark)
+                touched_since = self._touch_watermark
+            changed = self.apply(rate for rate in rows if _identity(rate) not in self._reread)
+            # Дотики інших записувачів (повторне читання межі безпечне - touch() ідемпотентний)
+            touched_rows = self._touched_rows(repository, touched_since)
+            changed += self.touch(touched_rows)
+            self._last_refresh = now
+
+            newest = max((rate["edited"] for rate in rows if rate.get("edited")), default=None)
+            if newest is not None:
+                # edited з майбутнього не заморожує межу: записи до нього ще можуть з'явитися
+                newest = min(newest, datetime.utcnow().isoformat() + "+00:00")
+                if self._read_watermark is None or newest > self._read_watermark:
+                    self._read_watermark = newest
+                self._reread = {_identity(rate) for rate in rows if (rate.get("edited") or "") >= self._read_watermark}
+            newest_seen = max((rate["last_seen"] for rate in touched_rows if rate.get("last_seen")), default=None)
+            bound = max(filter(None, (self._touch_watermark, newest_seen, self._read_watermark)), default=None)
+            if bound is not None:
+                self._touch_watermark = min(bound, datetime.utcnow().isoformat() + "+00:00")
+
+            if changed:
+                logger.info(f"Rates snapshot refreshed: {changed} keys updated, {len(self._rows)} total, watermark {self._watermark}")
+
+    @staticmethod
+    def _touched_rows(repository, since: Optional[str]) -> List[dict]:
+        """Записи з last_seen >= since (порожньо, якщо backend не має last_seen)."""
+        if since is None:
+            return []
+        try:
+            return list(repository.iter_touched_rates(since))
+        except NotImplementedError:
+            return []
+        except Exception as e:
+            logger.warning(f"Could not read touched rates, last_seen of repeated quotes may lag: {e}")
+            return []
+
+    def _initial_rows(self, repository) -> List[dict]:
+        """Перше завантаження: rate_trends (записи з baseline) або лише останні котирування."""
+        try:
+            rows = repository.rate_trends()
+        except NotImplementedError:
+            rows = []
+        except Exception as e:
+            logger.warning(f"rate_trends unavailable, trend baselines will be looked up on demand: {e}")
+            rows = []
+        if not rows:
+            return repository.latest_rates()
+
+        with self._baseline_lock:
+            for row in rows:
+                key = (row.get("channel_id"), row.get("currency_a"), row.get("currency_b"))
+                self._baselines[key] = {"buy": row.pop("prev_buy", None), "sell": row.pop("prev_sell", None)}
+        return rows
+
+    def current(self, key: SnapshotKey) -> Optional[dict]:
+        """Останній запис ключа (None, якщо ключ ще не бачили)."""
+        return self._rows.get(key)
+
+    def baselines(self, key: SnapshotKey) -> Dict[str, Optional[float]]:
+        """
+        Baseline трендів ключа: {"buy": ..., "sell": ...}.
+
+        Сторона відсутня, якщо baseline ще не відомий (тоді його шукає
+        trends.find_previous_rates_batch і зберігає через remember_baseline).
+        """
+        return dict(self._baselines.get(key, {}))
+
+    def remember_baseline(self, key: SnapshotKey, side: str, value: Optional[float], edited: Optional[str]) -> None:
+        """
+        Зберігає знайдений в історії baseline, якщо поточний запис ключа
+        все ще той, для якого його шукали (edited не змінився).
+        """
+        with self._baseline_lock:
+            current = self._rows.get(key)
+            if current is not None and current.get("edited") == edited:
+                self._baselines.setdefault(key, {})[side] = value
+
+    def pair_watermark(self, currency_a: str, currency_b: str) -> Optional[str]:
+        """Найновіший edited для валютної пари (змінюється, коли з'являються нові записи пари)."""
+        return self._pair_watermarks.get((currency_a, currency_b))
+
+    def pair_last_seen(self, currency_a: str, currency_b: str) -> Optional[str]:
+        """Коли пару котирували востаннє: найновіший edited або last_seen (повтори) її записів."""
+        return self._pair_last_seen.get((currency_a, currency_b))
+
+    def pair_index(self) -> Dict[Tuple[Optional[str], Optional[str]], Dict[Optional[int], str]]:
+        """Копія індексу пар: {(currency_a, currency_b): {channel_id: seen_at останнього запису}}."""
+        with self._baseline_lock:
+            return {pair: dict(channels) for pair, channels in self._pair_channels.items()}
+
+    def channel_index(self) -> Dict[Optional[int], Dict[Tuple[Optional[str], Optional[str]], str]]:
+        """Копія індексу обмінників: {channel_id: {(currency_a, currency_b): seen_at останнього запису}}."""
+        with self._baseline_lock:
+            return {channel_id: dict(pairs) for channel_id, pairs in self._channel_pairs.items()}
+
+    def pair_best(self, currency_a: str, currency_b: str) -> Tuple[Optional[dict], Optional[dict]]:
+        """Найкращі (buy, sell) записи пари серед усіх обмінників ((None, None), якщо пару не котирують)."""
+        return self._pair_best.get((currency_a, currency_b), (None, None))
+
+    def currency_pairs(self, currency: str) -> List[PairKey]:
+        """Ребра графа валют: пари (currency_a, currency_b), в яких котирується currency."""
+        with self._baseline_lock:
+            return list(self._currency_pairs.get(currency, ()))
+
+    def pair_first_seen(self, currency_a: str, currency_b: str) -> Optional[str]:
+        """edited першого запису пари, якщо пара з'явилася вже після першого завантаження snapshot."""
+        return self._pair_first_seen.get((currency_a, currency_b))
+
+    def latest(self, channel_ids: Optional[Iterable[int]] = None, pairs: Optional[Iterable[str]] = None) -> List[dict]:
+        """
+        Повертає останні записи, відсортовані за edited DESC.
+
+        Args:
+            channel_ids: Обмежити вибірку цими обмінниками
+            pairs: Обмежити вибірку цими парами у форматі "USD/UAH"
+        """
+        channel_filter = set(channel_ids) if channel_ids is not None else None
+        pair_filter = set(pairs) if pairs is not None else None
+
+        rows = []
+        # apply() змінює _rows у потоках пулу db - обхід під тим самим lock
+        with self._baseline_lock:
+            for (channel_id, currency_a, currency_b), rate in self._rows.items():
+                if channel_filter is not None and channel_id not in channel_filter:
+                    continue
+                if pair_filter is not None and f"{currency_a}/{currency_b}" not in pair_filter:
+                    continue
+                rows.append(rate)
+
+        rows.sort(key=lambda rate: rate.get("edited") or "", reverse=True)
+        return rows
+
+    def keys(self) -> List[SnapshotKey]:
+        """Усі відомі комбінації (channel_id, currency_a, currency_b)."""
+        with self._baseline_lock:
+            return list(self._rows.keys())
+
+
+# Спільний snapshot для всіх endpoints
+rates_snapshot = LatestRatesSnapshot()
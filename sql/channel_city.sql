@@ -0,0 +1,11 @@
+-- Location of every exchanger for the city filter of /rates/bestrate.
+--
+-- The backend reads channels.city with the channel directory and keeps a
+-- per-city, per-pair best buy/sell index next to the latest-quote snapshot.
+-- Cities are matched case-insensitively after trimming ("Kyiv" = "kyiv ").
+-- Exchangers without a city only appear in unfiltered (national) results.
+
+alter table channels add column if not exists city text;
+
+-- Example:
+-- update channels set city = 'Kyiv' where name in ('GARANT', 'KIT_GROUP');
@@ -0,0 +1,39 @@
+-- Latest quote per (channel_id, currency_a, currency_b).
+--
+-- Returns only the newest row of every exchanger/pair combination, so loading
+-- the best-rate snapshot moves O(live quotes) rows instead of the whole history.
+-- The composite index lets DISTINCT ON read each group's first row in index order.
+--
+-- Called from storage.SupabaseRepository.latest_rates via supabase.rpc("latest_rates", {...});
+-- filters are pushed down: p_channel_ids (null = all) and p_pairs as 'USD/UAH' strings (null = all).
+
+create index if not exists rates_latest_idx
+    on rates (channel_id, currency_a, currency_b, edited desc);
+
+create or replace function latest_rates(
+    p_channel_ids bigint[] default null,
+    p_pairs text[] default null
+)
+returns table (
+    channel_id bigint,
+    currency_a text,
+    currency_b text,
+    buy numeric,
+    sell numeric,
+    edited timestamptz
+)
+language sql
+stable
+as $$
+    select distinct on (r.channel_id, r.currency_a, r.currency_b)
+        r.channel_id,
+        r.currency_a,
+        r.currency_b,
+        r.buy,
+        r.sell,
+        r.edited
+    from rates r
+    where (p_channel_ids is null or r.channel_id = any (p_channel_ids))
+      and (p_pairs is null or r.currency_a || '/' || r.currency_b = any (p_pairs))
+    order by r.channel_id, r.currency_a, r.currency_b, r.edited desc;
+$$;
@@ -0,0 +1,43 @@
+-- Distinct currency pairs with the first and last time each pair was quoted.
+--
+-- /currencies/list used to derive the pair list from the rates history. The
+-- backend now keeps the pair catalog in memory from the latest-quote snapshot
+-- and reads first_seen from this table once (storage.SupabaseRepository.pair_first_seen).
+-- A trigger maintains it on every insert; compaction keeps the first row of
+-- every run, so min(edited) per pair never changes when rates are compacted.
+
+create table if not exists pair_catalog (
+    currency_a text not null,
+    currency_b text not null,
+    first_seen timestamptz not null,
+    last_seen timestamptz not null,
+    primary key (currency_a, currency_b)
+);
+
+create or replace function pair_catalog_on_insert()
+returns trigger
+language plpgsql
+as $$
+begin
+    insert into pair_catalog as c (currency_a, currency_b, first_seen, last_seen)
+    values (new.currency_a, new.currency_b, new.edited, new.edited)
+    on conflict (currency_a, currency_b) do update set
+        first_seen = least(c.first_seen, excluded.first_seen),
+        last_seen = greatest(c.last_seen, excluded.last_seen)
+    -- Skip the write (and the row lock churn) when the quote is inside the known range
+    where excluded.first_seen < c.first_seen or excluded.last_seen > c.last_seen;
+    return new;
+end;
+$$;
+
+drop trigger if exists rates_pair_catalog_trigger on rates;
+create trigger rates_pair_catalog_trigger
+    after insert on rates
+    for each row execute function pair_catalog_on_insert();
+
+-- One-off backfill from the existing history
+insert into pair_catalog (currency_a, currency_b, first_seen, last_seen)
+select currency_a, currency_b, min(edited), max(edited)
+from rates
+group by currency_a, currency_b
+on conflict (currency_a, currency_b) do nothing;
@@ -0,0 +1,44 @@
+-- Hourly/daily rollups of rates for /rates/history.
+--
+-- One row per (granularity, pair, channel_id, bucket): best buy/sell with the
+-- exchangers that gave them, open/close/min/max for buy and sell and the number
+-- of records - the same values the backend computes from raw rows
+-- (history.HistoryAggregator). channel_id = 0 holds buckets over all exchangers
+-- of the pair, other rows are per exchanger.
+--
+-- The tables are filled incrementally by rollup_rates.py (rollups.refresh_rollups):
+-- every run aggregates the closed buckets after rate_rollup_state.rolled_until.
+-- /rates/history reads complete buckets from here and aggregates only the edges
+-- of the period (first and current bucket) from raw rates.
+--
+-- Run after rates_compaction.sql (rollups read last_seen).
+
+create table if not exists rate_rollups (
+    granularity text not null check (granularity in ('hour', 'day')),
+    currency_a text not null,
+    currency_b text not null,
+    channel_id bigint not null,
+    bucket timestamptz not null,
+    buy numeric,
+    sell numeric,
+    exchanger_id bigint,
+    sell_exchanger_id bigint,
+    buy_open numeric,
+    buy_close numeric,
+    buy_min numeric,
+    buy_max numeric,
+    sell_open numeric,
+    sell_close numeric,
+    sell_min numeric,
+    sell_max numeric,
+    count integer not null,
+    primary key (granularity, currency_a, currency_b, channel_id, bucket)
+);
+
+create table if not exists rate_rollup_state (
+    granularity text not null,
+    currency_a text not null,
+    currency_b text not null,
+    rolled_until timestamptz not null,
+    primary key (granularity, currency_a, currency_b)
+);
@@ -0,0 +1,68 @@
+-- Materialized current quote and trend baselines per (channel_id, currency_a, currency_b).
+--
+-- For every exchanger/pair the table keeps the latest buy/sell plus the last
+-- *different* buy (prev_buy) and the last *different* sell (prev_sell) - exactly
+-- the skip-duplicate baselines /rates/bestrate used to find by walking up to
+-- 100 history rows. A trigger maintains it on every insert, so the backend
+-- loads it once (storage.SupabaseRepository.rate_trends) and trends are O(1).
+--
+-- "Different" matches trends.is_value_different: NULL vs non-NULL, or |a - b| > 0.0001.
+
+create table if not exists rate_trends (
+    channel_id bigint not null,
+    currency_a text not null,
+    currency_b text not null,
+    buy numeric,
+    sell numeric,
+    edited timestamptz not null,
+    prev_buy numeric,
+    prev_sell numeric,
+    primary key (channel_id, currency_a, currency_b)
+);
+
+create or replace function rate_value_differs(a numeric, b numeric)
+returns boolean
+language sql
+immutable
+as $$
+    select (a is null) <> (b is null) or abs(a - b) > 0.0001;
+$$;
+
+create or replace function rate_trends_on_insert()
+returns trigger
+language plpgsql
+as $$
+begin
+    insert into rate_trends as t (channel_id, currency_a, currency_b, buy, sell, edited, prev_buy, prev_sell)
+    values (new.channel_id, new.currency_a, new.currency_b, new.buy, new.sell, new.edited, null, null)
+    on conflict (channel_id, currency_a, currency_b) do update set
+        prev_buy = case when rate_value_differs(t.buy, excluded.buy) then t.buy else t.prev_buy end,
+        prev_sell = case when rate_value_differs(t.sell, excluded.sell) then t.sell else t.prev_sell end,
+        buy = excluded.buy,
+        sell = excluded.sell,
+        edited = excluded.edited
+    -- Late (older) quotes do not replace the current one
+    where excluded.edited > t.edited;
+    return new;
+end;
+$$;
+
+drop trigger if exists rates_trends_trigger on rates;
+create trigger rates_trends_trigger
+    after insert on rates
+    for each row execute function rate_trends_on_insert();
+
+-- One-off backfill from the existing history (uses rates_latest_idx from latest_rates.sql)
+insert into rate_trends (channel_id, currency_a, currency_b, buy, sell, edited, prev_buy, prev_sell)
+select
+    l.channel_id, l.currency_a, l.currency_b, l.buy, l.sell, l.edited,
+    (select r.buy from rates r
+      where r.channel_id = l.channel_id and r.currency_a = l.currency_a and r.currency_b = l.currency_b
+        and r.edited < l.edited and rate_value_differs(r.buy, l.buy)
+      order by r.edited desc limit 1),
+    (select r.sell from rates r
+      where r.channel_id = l.channel_id and r.currency_a = l.currency_a and r.currency_b = l.currency_b
+        and r.edited < l.edited and rate_value_differs(r.sell, l.sell)
+      order by r.edited desc limit 1)
+from latest_rates() l
+on conflict (channel_id, currency_a, currency_b) do nothing;
@@ -0,0 +1,108 @@
+-- Run-length compaction of rates.
+--
+-- Scrapers insert the same buy/sell for an exchanger and pair over and over.
+-- A run of identical consecutive quotes is stored as ONE row: edited is when the
+-- value was first seen, last_seen is when it was last reported (null = edited).
+-- Trend lookups then touch one row per value change and the table shrinks.
+--
+-- - last_seen column: written by POST /rates/ingest (touch_rates) instead of
+--   inserting duplicates, and by compact_rates for existing history
+-- - touch_rates(p_rows): extends last_seen of the run head of each touched quote,
+--   returns the number of updated rows
+-- - compact_rates(p_before): collapses runs among rows with edited < p_before,
+--   returns the number of deleted rows (storage.SupabaseRepository.compact_rates,
+--   run by compact_rates.py)
+--
+-- Run after rate_trends.sql (uses rate_value_differs) and before re-creating
+-- rates_history_buckets.sql (reads last_seen).
+
+alter table rates add column if not exists last_seen timestamptz;
+
+create index if not exists rates_pair_last_seen_idx
+    on rates (currency_a, currency_b, last_seen desc)
+    where last_seen is not null;
+
+-- Touches from other writers, read by every snapshot refresh (iter_touched_rates)
+create index if not exists rates_last_seen_idx
+    on rates (last_seen)
+    where last_seen is not null;
+
+create or replace function touch_rates(p_rows jsonb)
+returns integer
+language sql
+as $$
+    with touches as (
+        select
+            (t ->> 'channel_id')::bigint as channel_id,
+            t ->> 'currency_a' as currency_a,
+            t ->> 'currency_b' as currency_b,
+            (t ->> 'edited')::timestamptz as edited,
+            (t ->> 'last_seen')::timestamptz as last_seen
+        from jsonb_array_elements(p_rows) t
+    ),
+    updated as (
+        update rates r
+        set last_seen = greatest(coalesce(r.last_seen, r.edited), t.last_seen)
+        from touches t
+        -- The run head: the key's newest row with edited <= t.edited. compact_rates
+        -- may have deleted the row with edited = t.edited and folded it into its head
+        where r.id = (
+            select x.id
+            from rates x
+            where x.channel_id = t.channel_id
+              and x.currency_a = t.currency_a
+              and x.currency_b = t.currency_b
+              and x.edited <= t.edited
+            order by x.edited desc, x.id desc
+            limit 1
+        )
+        returning 1
+    )
+    select count(*)::integer from updated;
+$$;
+
+create or replace function compact_rates(p_before timestamptz default now())
+returns integer
+language plpgsql
+as $$
+declare
+    deleted integer;
+begin
+    create temporary table compaction on commit drop as
+    with ordered as (
+        select
+            id, channel_id, currency_a, currency_b, edited,
+            coalesce(last_seen, edited) as seen,
+            case
+                when lag(id) over w is null
+                  or rate_value_differs(buy, lag(buy) over w)
+                  or rate_value_differs(sell, lag(sell) over w)
+                then 1 else 0
+            end as is_head
+        from rates
+        where edited < p_before
+        window w as (partition by channel_id, currency_a, currency_b order by edited, id)
+    )
+    -- run = ordinal of the run of identical quotes within the key
+    select
+        *,
+        sum(is_head) over (partition by channel_id, currency_a, currency_b order by edited, id) as run
+    from ordered;
+
+    update rates r
+    set last_seen = runs.last_seen
+    from (
+        select max(id) filter (where is_head = 1) as head_id, max(seen) as last_seen, count(*) as size
+        from compaction
+        group by channel_id, currency_a, currency_b, run
+    ) runs
+    where r.id = runs.head_id and runs.size > 1;
+
+    delete from rates r
+    using compaction c
+    where r.id = c.id and c.is_head = 0;
+    get diagnostics deleted = row_count;
+
+    return deleted;
+end;
+$$;
@@ -0,0 +1,80 @@
+-- Server-side bucketing for /rates/history.
+--
+-- Returns one row per hour/day bucket for a currency pair: the best (max) buy
+-- with its exchanger and the best (min) sell with its exchanger, so the backend
+-- moves O(buckets) rows instead of the whole history of the pair.
+--
+-- Called from history.fetch_history_buckets via supabase.rpc("rates_history_buckets", {...})
+-- when HISTORY_SERVER_AGGREGATION=1.
+--
+-- A compacted row (see rates_compaction.sql) counts in every bucket from edited
+-- to last_seen. Requires the last_seen column: run rates_compaction.sql first.
+
+create index if not exists rates_pair_edited_idx
+    on rates (currency_a, currency_b, edited desc);
+
+create or replace function rates_history_buckets(
+    p_currency_a text,
+    p_currency_b text,
+    p_since timestamptz,
+    p_interval text default 'hour',
+    p_channel_ids bigint[] default null
+)
+returns table (
+    bucket timestamp,
+    buy numeric,
+    buy_channel_id bigint,
+    sell numeric,
+    sell_channel_id bigint,
+    latest_channel_id bigint
+)
+language sql
+stable
+as $$
+    with window_rates as (
+        select
+            b.bucket,
+            r.channel_id,
+            r.buy,
+            r.sell,
+            r.edited
+        from rates r
+        cross join lateral generate_series(
+            date_trunc(p_interval, greatest(r.edited, p_since) at time zone 'UTC'),
+            date_trunc(p_interval, coalesce(r.last_seen, r.edited) at time zone 'UTC'),
+            ('1 ' || p_interval)::interval
+        ) as b(bucket)
+        where r.currency_a = p_currency_a
+          and r.currency_b = p_currency_b
+          and (r.edited >= p_since or r.last_seen >= p_since)
+          and (p_channel_ids is null or r.channel_id = any (p_channel_ids))
+    ),
+    best_buy as (
+        select distinct on (bucket) bucket, buy, channel_id
+        from window_rates
+        where buy is not null and buy <> 0
+        order by bucket, buy desc, edited desc
+    ),
+    best_sell as (
+        select distinct on (bucket) bucket, sell, channel_id
+        from window_rates
+        where sell is not null and sell <> 0
+        order by bucket, sell asc, edited desc
+    ),
+    latest as (
+        select distinct on (bucket) bucket, channel_id
+        from window_rates
+        order by bucket, edited desc
+    )
+    select
+        l.bucket,
+        b.buy,
+        b.channel_id as buy_channel_id,
+        s.sell,
+        s.channel_id as sell_channel_id,
+        l.channel_id as latest_channel_id
+    from latest l
+    left join best_buy b on b.bucket = l.bucket
+    left join best_sell s on s.bucket = l.bucket
+    order by l.bucket;
+$$;
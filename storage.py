@@ -0,0 +1,961 @@
+"""
+Шар зберігання: інтерфейс репозиторію для таблиць rates та channels.
+
+Увесь доступ до даних (snapshot, тренди, історія, довідник обмінників, /health)
+іде через RatesRepository, а не напряму через клієнт supabase. Реалізації:
+
+- SupabaseRepository - основна база (PostgREST), клієнт створюється ліниво
+- SQLiteRepository - вбудована база (stdlib sqlite3) з тими самими таблицями та
+  індексами на (channel_id, currency_a, currency_b, edited): read replica поруч
+  із застосунком, офлайн розробка та навантажувальні тести без мережі
+
+Backend обирається змінною STORAGE_BACKEND ("supabase" за замовчуванням або "sqlite",
+шлях до файлу - SQLITE_PATH).
+"""
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "fxhub.db")
+
+RATE_COLUMNS = "channel_id, currency_a, currency_b, buy, sell, edited"
+
+# Розмір сторінки потокового читання rates (keyset по (edited, id)).
+# Не більше max_rows PostgREST (1000): коротша сторінка означає кінець вибірки
+RATES_PAGE_SIZE = int(os.getenv("RATES_PAGE_SIZE", "1000"))
+
+# channel_id rollup bucket, агрегованих по всіх обмінниках пари (див. rollups.py)
+ALL_EXCHANGERS = 0
+
+ROLLUP_COLUMNS = (
+    "bucket, channel_id, buy, sell, exchanger_id, sell_exchanger_id, "
+    "buy_open, buy_close, buy_min, buy_max, sell_open, sell_close, sell_min, sell_max, count"
+)
+# Розмір сторінки читання/запису rollup у PostgREST
+ROLLUP_PAGE_SIZE = 1000
+
+RateKey = Tuple[int, str, str]
+
+
+class RatesRepository:
+    """
+    Інтерфейс сховища курсів та обмінників.
+
+    Усі методи синхронні (блокуючі) - з async коду їх викликають через db.run_query.
+    Записи rates повертаються як dict з полями RATE_COLUMNS.
+    """
+
+    def ping(self) -> bool:
+        """Чи доступна база (для /health)."""
+        raise NotImplementedError
+
+    def list_channels(self) -> List[dict]:
+        """Усі обмінники: [{"id": ..., "name": ..., "city": ...}] (city може бути None)."""
+        raise NotImplementedError
+
+    def rates_since(self, watermark: Optional[str] = None) -> List[dict]:
+        """
+        Записи rates з edited >= watermark (усі, якщо watermark=None),
+        відсортовані за edited DESC.
+        """
+        return list(self.iter_rates(watermark))
+
+    def iter_rates(self, since: Optional[str] = None, descending: bool = True, page_size: int = RATES_PAGE_SIZE) -> Iterator[dict]:
+        """
+        Потокове читання rates: записи з edited >= since (усі, якщо since=None)
+        сторінками по page_size, впорядковані за (edited, id).
+
+        Наступна сторінка починається одразу після (edited, id) останнього
+        рядка попередньої (keyset), тому вибірка не обрізається лімітом
+        рядків PostgREST, а в пам'яті одночасно лише одна сторінка.
+
+        Args:
+            since: Нижня межа edited (ISO 8601), None - вся таблиця
+            descending: Від нових до старих (True) чи від старих до нових
+            page_size: Кількість рядків за запит
+        """
+        raise NotImplementedError
+
+    def latest_rates(self, channel_ids: Optional[Iterable[int]] = None, pairs: Optional[Iterable[str]] = None) -> List[dict]:
+        """
+        Останній запис на кожну комбінацію (channel_id, currency_a, currency_b).
+
+        Args:
+            channel_ids: Обмежити вибірку цими обмінниками (None - всі)
+            pairs: Обмежити вибірку цими парами у форматі "USD/UAH" (None - всі)
+
+        Базова реалізація дедуплікує повну історію в пам'яті; backends
+        перевизначають її запитом, що повертає лише останні записи.
+        """
+        channel_filter = set(channel_ids) if channel_ids is not None else None
+        pair_filter = set(pairs) if pairs is not None else None
+        latest = {}
+        for rate in self.iter_rates():
+            key = (rate.get("channel_id"), rate.get("currency_a"), rate.get("currency_b"))
+            if key in latest:
+                continue
+            if channel_filter is not None and key[0] not in channel_filter:
+                continue
+            if pair_filter is not None and f"{key[1]}/{key[2]}" not in pair_filter:
+                continue
+            latest[key] = rate
+        return list(latest.values())
+
+    def pair_first_seen(self) -> List[dict]:
+        """
+        Перший запис кожної валютної пари: [{"currency_a", "currency_b", "first_seen"}].
+
+        Backend без каталогу пар (sql/pair_catalog.sql) піднімає помилку -
+        pair_catalog.PairCatalog тоді не знає first_seen пар, що існували до старту.
+        """
+        raise NotImplementedError
+
+    def rate_trends(self) -> List[dict]:
+        """
+        Матеріалізований стан на кожну комбінацію (channel_id, currency_a, currency_b):
+        останній запис (RATE_COLUMNS) плюс prev_buy / prev_sell - останні значення
+        buy / sell, що відрізнялися від поточних (baseline для трендів).
+
+        Backend без такої таблиці піднімає NotImplementedError.
+        """
+        raise NotImplementedError
+
+    def rates_for_keys(self, keys: Sequence[RateKey], before: Optional[str] = None, after: Optional[Tuple[str, int]] = None, limit: int = 1000) -> List[dict]:
+        """
+        Історія для набору (channel_id, currency_a, currency_b), (edited, id) DESC.
+
+        Args:
+            keys: Комбінації, записи яких потрібні
+            before: Верхня межа edited (edited <= before), None - без межі
+            after: (edited, id) останнього запису попередньої сторінки (keyset
+                   пагінація) - лише записи після нього, None - з початку
+            limit: Максимальна кількість записів
+
+        Returns:
+            Записи RATE_COLUMNS та id (курсор наступної сторінки)
+        """
+        raise NotImplementedError
+
+    def pair_history(self, currency_a: str, currency_b: str, since: datetime, channel_ids: Optional[List[int]] = None, until: Optional[datetime] = None) -> List[dict]:
+        """
+        Записи валютної пари, що діяли після since (UTC, naive), edited DESC.
+
+        Окрім RATE_COLUMNS містять last_seen: стиснутий запис (серія однакових
+        котирувань) з edited < since потрапляє у вибірку, якщо last_seen >= since.
+        until (UTC, naive) - лише записи з edited < until.
+        """
+        return list(self.iter_pair_history(currency_a, currency_b, since, channel_ids, until))
+
+    def iter_pair_history(self, currency_a: str, currency_b: str, since: datetime, channel_ids: Optional[List[int]] = None, until: Optional[datetime] = None, page_size: int = RATES_PAGE_SIZE) -> Iterator[dict]:
+        """Те саме, що pair_history, але потоково - сторінками по page_size (keyset по (edited, id))."""
+        raise NotImplementedError
+
+    def pair_last_seen(self, currency_a: str, currency_b: str) -> Optional[str]:
+        """
+        Найпізніший last_seen записів пари (ISO 8601; None - пару не повторювали
+        або backend без колонки last_seen). Змінюється від touch_rates, коли
+        edited пари вже не змінюється.
+        """
+        return None
+
+    def insert_rates(self, rows: Iterable[dict]) -> int:
+        """Додає записи rates одним запитом (bulk insert). Returns: кількість доданих записів."""
+        raise NotImplementedError
+
+    def touch_rates(self, touches: Sequence[dict]) -> int:
+        """
+        Продовжує last_seen існуючих записів замість вставки дублікатів.
+
+        Оновлюється голова серії - найновіший запис ключа з edited <= edited
+        дотику: compact_rates міг видалити сам повторений запис, злив його в голову.
+
+        Args:
+            touches: dict з channel_id, currency_a, currency_b, edited (запис,
+                     який повторили) та last_seen (коли його повторили)
+
+        Returns:
+            Кількість оновлених записів (менша за len(touches), якщо для ключа
+            не лишилося жодного запису з edited <= edited дотику)
+        """
+        raise NotImplementedError
+
+    def iter_touched_rates(self, since: Optional[str] = None, page_size: int = RATES_PAGE_SIZE) -> Iterator[dict]:
+        """
+        Записи з last_seen >= since (ISO 8601; None - усі з last_seen) - продовжені
+        touch_rates або compact_rates. RATE_COLUMNS та last_seen, keyset по (edited, id).
+        """
+        raise NotImplementedError
+
+    def compact_rates(self, before: datetime) -> int:
+        """
+        Стискає серії однакових послідовних котирувань (edited < before, UTC naive)
+        на кожен ключ в один запис: edited - перша поява, last_seen - остання.
+
+        Returns:
+            Кількість видалених записів
+        """
+        raise NotImplementedError
+
+    def history_buckets(self, currency_a: str, currency_b: str, since: datetime, interval: str, channel_ids: Optional[List[int]] = None) -> List[dict]:
+        """
+        Вже агреговані bucket історії (RPC rates_history_buckets).
+
+        Backend без серверної агрегації піднімає NotImplementedError -
+        history.fetch_history_buckets тоді повертається до агрегації сирих записів.
+        """
+        raise NotImplementedError
+
+    def rollup_state(self, currency_a: str, currency_b: str, interval: str) -> Optional[str]:
+        """
+        Межа rollup пари: bucket з початком < rolled_until вже агреговані
+        (ISO 8601; None - rollup пари ще не будувався).
+        """
+        raise NotImplementedError
+
+    def rollups(self, currency_a: str, currency_b: str, interval: str, channel_id: int, since: datetime, until: datetime) -> List[dict]:
+        """
+        Rollup bucket пари з since <= bucket < until (UTC, naive), bucket ASC.
+
+        channel_id - обмінник або ALL_EXCHANGERS (bucket по всіх обмінниках пари).
+        """
+        raise NotImplementedError
+
+    def save_rollups(self, currency_a: str, currency_b: str, interval: str, rows: Sequence[dict], rolled_until: datetime) -> int:
+        """
+        Зберігає (upsert) rollup bucket пари і переносить межу rollup на rolled_until.
+
+        Returns:
+            Кількість збережених bucket
+        """
+        raise NotImplementedError
+
+
+def _key_filter(keys: Iterable[RateKey]) -> str:
+    """PostgREST or-фільтр, що обмежує вибірку рівно потрібними комбінаціями."""
+    return ",".join(
+        f"and(channel_id.eq.{channel_id},currency_a.eq.{currency_a},currency_b.eq.{currency_b})"
+        for channel_id, currency_a, currency_b in keys
+    )
+
+
+class SupabaseRepository(RatesRepository):
+    """Supabase (PostgREST) backend."""
+
+    # Чи є в таблиці rates колонка last_seen (None - ще не перевіряли)
+    _has_last_seen: Optional[bool] = None
+    # Чи створені таблиці rate_rollups / rate_rollup_state (None - ще не перевіряли)
+    _has_rollups: Optional[bool] = None
+    # Чи є в таблиці channels колонка city (None - ще не перевіряли)
+    _has_channel_city: Optional[bool] = None
+
+    @property
+    def client(self):
+        # Ліниво: supabase_client перевіряє .env і створює клієнт лише при першому зверненні
+        import supabase_client
+        return supabase_client.supabase
+
+    def ping(self) -> bool:
+        response = self.client.table("channels").select("id").limit(1).execute()
+        return response.data is not None
+
+    def list_channels(self) -> List[dict]:
+        if self._has_channel_city is not False:
+            try:
+                rows = self.client.table("channels").select("id, name, city").execute().data or []
+                self._has_channel_city = True
+                return rows
+            except Exception as e:
+                if self._has_channel_city:
+                    raise
+                # Колонки city ще немає (sql/channel_city.sql не виконано)
+                logger.warning(f"channels.city unavailable, the city filter matches no exchangers: {e}")
+                self._has_channel_city = False
+        response = self.client.table("channels").select("id, name").execute()
+        return response.data or []
+
+    def _iter_keyset(self, build_query: Callable, descending: bool = True, page_size: int = RATES_PAGE_SIZE) -> Iterator[dict]:
+        """
+        Сторінки rates за keyset (edited, id).
+
+        Args:
+            build_query: Фабрика запиту з фільтрами (select має містити id)
+        """
+        bound, direction = ("lte", "lt") if descending else ("gte", "gt")
+        after = None
+        while True:
+            query = build_query()
+            if after is not None:
+                edited, row_id = after
+                # (edited, id) після курсора; окремий bound на edited - для індексу.
+                # Кілька or-фільтрів PostgREST поєднує через AND (pair_history має власний)
+                query = query.filter("edited", bound, edited).or_(f"edited.{direction}.{edited},id.{direction}.{row_id}")
+            rows = query.order("edited", desc=descending).order("id", desc=descending).limit(page_size).execute().data or []
+            if rows:
+                after = (rows[-1]["edited"], rows[-1]["id"])
+            for row in rows:
+                del row["id"]
+                yield row
+            if len(rows) < page_size:
+                return
+
+    def iter_rates(self, since: Optional[str] = None, descending: bool = True, page_size: int = RATES_PAGE_SIZE) -> Iterator[dict]:
+        def build_query():
+            query = self.client.table("rates").select(f"id, {RATE_COLUMNS}")
+            return query.gte("edited", since) if since is not None else query
+
+        return self._iter_keyset(build_query, descending, page_size)
+
+    def latest_rates(self, channel_ids: Optional[Iterable[int]] = None, pairs: Optional[Iterable[str]] = None) -> List[dict]:
+        # DISTINCT ON на боці бази (sql/latest_rates.sql): лише живі котирування замість усієї історії
+        try:
+            response = self.client.rpc("latest_rates", {
+                "p_channel_ids": list(channel_ids) if channel_ids is not None else None,
+                "p_pairs": list(pairs) if pairs is not None else None
+            }).execute()
+            return response.data or []
+        except Exception as e:
+            logger.warning(f"latest_rates RPC failed, falling back to full scan: {e}")
+        return super().latest_rates(channel_ids, pairs)
+
+    def pair_first_seen(self) -> List[dict]:
+        # Таблиця підтримується тригером на rates (sql/pair_catalog.sql)
+        rows: List[dict] = []
+        while True:
+            page = (
+                self.client.table("pair_catalog").select("currency_a, currency_b, first_seen")
+                .order("currency_a").order("currency_b")
+                .range(len(rows), len(rows) + RATES_PAGE_SIZE - 1)
+                .execute().data or []
+            )
+            rows.extend(page)
+            if len(page) < RATES_PAGE_SIZE:
+                return rows
+
+    def rate_trends(self) -> List[dict]:
+        # Таблиця підтримується тригером на rates (sql/rate_trends.sql); рядок на ключ,
+        # але ключів може бути більше за max_rows PostgREST - читаємо сторінками
+        rows: List[dict] = []
+        while True:
+            page = (
+                self.client.table("rate_trends").select(f"{RATE_COLUMNS}, prev_buy, prev_sell")
+                .order("channel_id").order("currency_a").order("currency_b")
+                .range(len(rows), len(rows) + RATES_PAGE_SIZE - 1)
+                .execute().data or []
+            )
+            rows.extend(page)
+            if len(page) < RATES_PAGE_SIZE:
+                return rows
+
+    def rates_for_keys(self, keys: Sequence[RateKey], before: Optional[str] = None, after: Optional[Tuple[str, int]] = None, limit: int = 1000) -> List[dict]:
+        query = self.client.table("rates").select(f"id, {RATE_COLUMNS}").or_(_key_filter(keys))
+        if before is not None:
+            query = query.lte("edited", before)
+        if after is not None:
+            # Як у _iter_keyset: (edited, id) < курсора; кілька or-фільтрів PostgREST поєднує через AND
+            edited, row_id = after
+            query = query.lte("edited", edited).or_(f"edited.lt.{edited},id.lt.{row_id}")
+        return query.order("edited", desc=True).order("id", desc=True).limit(limit).execute().data or []
+
+    def iter_pair_history(self, currency_a: str, currency_b: str, since: datetime, channel_ids: Optional[List[int]] = None, until: Optional[datetime] = None, page_size: int = RATES_PAGE_SIZE) -> Iterator[dict]:
+        since_value = since.isoformat() + "Z"
+
+        def build_query(columns: str):
+            query = self.client.table("rates").select(f"id, {columns}").eq("currency_a", currency_a).eq("currency_b", currency_b)
+            if channel_ids is not None:
+                query = query.in_("channel_id", channel_ids)
+            if until is not None:
+                query = query.lt("edited", until.isoformat() + "Z")
+            return query
+
+        if self._has_last_seen is not False:
+            rows = self._iter_keyset(
+                lambda: build_query(f"{RATE_COLUMNS}, last_seen").or_(f"edited.gte.{since_value},last_seen.gte.{since_value}"),
+                page_size=page_size
+            )
+            try:
+                # Перша сторінка показує, чи є колонка last_seen
+                first = next(rows, None)
+                self._has_last_seen = True
+            except Exception as e:
+                if self._has_last_seen:
+                    raise
+                # Колонки last_seen ще немає (sql/rates_compaction.sql не виконано)
+                logger.warning(f"rates.last_seen unavailable, reading history by edited only: {e}")
+                self._has_last_seen = False
+            else:
+                if first is not None:
+                    yield first
+                    yield from rows
+                return
+
+        yield from self._iter_keyset(lambda: build_query(RATE_COLUMNS).gte("edited", since_value), page_size=page_size)
+
+    def iter_touched_rates(self, since: Optional[str] = None, page_size: int = RATES_PAGE_SIZE) -> Iterator[dict]:
+        if self._has_last_seen is False:
+            return
+
+        def build_query():
+            query = self.client.table("rates").select(f"id, {RATE_COLUMNS}, last_seen")
+            return query.gte("last_seen", since) if since is not None else query.not_.is_("last_seen", "null")
+
+        rows = self._iter_keyset(build_query, descending=False, page_size=page_size)
+        try:
+            first = next(rows, None)
+        except Exception as e:
+            if self._has_last_seen:
+                raise
+            logger.warning(f"rates.last_seen unavailable, nothing to touch: {e}")
+            self._has_last_seen = False
+            return
+        self._has_last_seen = True
+        if first is not None:
+            yield first
+            yield from rows
+
+    def pair_last_seen(self, currency_a: str, currency_b: str) -> Optional[str]:
+        if self._has_last_seen is False:
+            return None
+        try:
+            rows = (
+                self.client.table("rates").select("last_seen").eq("currency_a", currency_a).eq("currency_b", currency_b)
+                .not_.is_("last_seen", "null").order("last_seen", desc=True).limit(1).execute().data
+            )
+        except Exception as e:
+            if self._has_last_seen:
+                raise
+            logger.warning(f"rates.last_seen unavailable, reading history by edited only: {e}")
+            self._has_last_seen = False
+            return None
+        self._has_last_seen = True
+        return rows[0]["last_seen"] if rows else None
+
+    def insert_rates(self, rows: Iterable[dict]) -> int:
+        # Один POST з масивом рядків; порядок edited ASC - для тригера rate_trends
+        rows = sorted(rows, key=lambda row: row["edited"])
+        if not rows:
+            return 0
+        self.client.table("rates").insert(rows).execute()
+        return len(rows)
+
+    def touch_rates(self, touches: Sequence[dict]) -> int:
+        if not touches:
+            return 0
+        # Усі оновлення одним RPC (sql/rates_compaction.sql)
+        response = self.client.rpc("touch_rates", {"p_rows": list(touches)}).execute()
+        return response.data or 0
+
+    def compact_rates(self, before: datetime) -> int:
+        response = self.client.rpc("compact_rates", {"p_before": before.isoformat() + "Z"}).execute()
+        return response.data or 0
+
+    def history_buckets(self, currency_a: str, currency_b: str, since: datetime, interval: str, channel_ids: Optional[List[int]] = None) -> List[dict]:
+        response = self.client.rpc("rates_history_buckets", {
+            "p_currency_a": currency_a,
+            "p_currency_b": currency_b,
+            "p_since": since.isoformat() + "Z",
+            "p_interval": interval,
+            "p_channel_ids": channel_ids
+        }).execute()
+        return response.data or []
+
+    def rollup_state(self, currency_a: str, currency_b: str, interval: str) -> Optional[str]:
+        if self._has_rollups is False:
+            return None
+        try:
+            rows = (
+                self.client.table("rate_rollup_state").select("rolled_until")
+                .eq("granularity", interval).eq("currency_a", currency_a).eq("currency_b", currency_b)
+                .execute().data or []
+            )
+        except Exception as e:
+            if self._has_rollups:
+                raise
+            # Таблиць rollup ще немає (sql/rate_rollups.sql не виконано)
+            logger.warning(f"rate_rollup_state unavailable, history is aggregated from raw rates: {e}")
+            self._has_rollups = False
+            return None
+        self._has_rollups = True
+        return rows[0]["rolled_until"] if rows else None
+
+    def rollups(self, currency_a: str, currency_b: str, interval: str, channel_id: int, since: datetime, until: datetime) -> List[dict]:
+        rows: List[dict] = []
+        # PostgREST віддає не більше max_rows (1000) рядків - 90 днів по годинах читаємо сторінками
+        while True:
+            page = (
+                self.client.table("rate_rollups").select(ROLLUP_COLUMNS)
+                .eq("granularity", interval).eq("currency_a", currency_a).eq("currency_b", currency_b)
+                .eq("channel_id", channel_id)
+                .gte("bucket", since.isoformat() + "Z").lt("bucket", until.isoformat() + "Z")
+                .order("bucket").range(len(rows), len(rows) + ROLLUP_PAGE_SIZE - 1)
+                .execute().data or []
+            )
+            rows.extend(page)
+            if len(page) < ROLLUP_PAGE_SIZE:
+                return rows
+
+    def save_rollups(self, currency_a: str, currency_b: str, interval: str, rows: Sequence[dict], rolled_until: datetime) -> int:
+        rows = [{**row, "granularity": interval, "currency_a": currency_a, "currency_b": currency_b} for row in rows]
+        for start in range(0, len(rows), ROLLUP_PAGE_SIZE):
+            self.client.table("rate_rollups").upsert(
+                rows[start:start + ROLLUP_PAGE_SIZE], on_conflict="granularity,currency_a,currency_b,channel_id,bucket"
+            ).execute()
+        # Межу переносимо лише після того, як усі bucket збережено
+        self.client.table("rate_rollup_state").upsert({
+            "granularity": interval, "currency_a": currency_a, "currency_b": currency_b,
+            "rolled_until": rolled_until.isoformat() + "Z"
+        }, on_conflict="granularity,currency_a,currency_b").execute()
+        return len(rows)
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS channels (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    city TEXT
+);
+CREATE TABLE IF NOT EXISTS rates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel_id INTEGER NOT NULL,
+    currency_a TEXT NOT NULL,
+    currency_b TEXT NOT NULL,
+    buy REAL,
+    sell REAL,
+    edited TEXT NOT NULL,
+    last_seen TEXT
+);
+CREATE INDEX IF NOT EXISTS rates_key_edited_idx ON rates (channel_id, currency_a, currency_b, edited);
+CREATE INDEX IF NOT EXISTS rates_pair_edited_idx ON rates (currency_a, currency_b, edited);
+CREATE INDEX IF NOT EXISTS rates_edited_idx ON rates (edited);
+CREATE TABLE IF NOT EXISTS rate_trends (
+    channel_id INTEGER NOT NULL,
+    currency_a TEXT NOT NULL,
+    currency_b TEXT NOT NULL,
+    buy REAL,
+    sell REAL,
+    edited TEXT NOT NULL,
+    prev_buy REAL,
+    prev_sell REAL,
+    PRIMARY KEY (channel_id, currency_a, currency_b)
+);
+CREATE TRIGGER IF NOT EXISTS rates_trends_trigger AFTER INSERT ON rates
+BEGIN
+    INSERT INTO rate_trends (channel_id, currency_a, currency_b, buy, sell, edited, prev_buy, prev_sell)
+    VALUES (NEW.channel_id, NEW.currency_a, NEW.currency_b, NEW.buy, NEW.sell, NEW.edited, NULL, NULL)
+    ON CONFLICT (channel_id, currency_a, currency_b) DO UPDATE SET
+        prev_buy = CASE WHEN (rate_trends.buy IS NULL) <> (excluded.buy IS NULL) OR abs(rate_trends.buy - excluded.buy) > 0.0001
+                        THEN rate_trends.buy ELSE rate_trends.prev_buy END,
+        prev_sell = CASE WHEN (rate_trends.sell IS NULL) <> (excluded.sell IS NULL) OR abs(rate_trends.sell - excluded.sell) > 0.0001
+                         THEN rate_trends.sell ELSE rate_trends.prev_sell END,
+        buy = excluded.buy,
+        sell = excluded.sell,
+        edited = excluded.edited
+    WHERE excluded.edited > rate_trends.edited;
+END;
+CREATE TABLE IF NOT EXISTS pair_catalog (
+    currency_a TEXT NOT NULL,
+    currency_b TEXT NOT NULL,
+    first_seen TEXT NOT NULL,
+    last_seen TEXT NOT NULL,
+    PRIMARY KEY (currency_a, currency_b)
+);
+CREATE TRIGGER IF NOT EXISTS rates_pair_catalog_trigger AFTER INSERT ON rates
+BEGIN
+    INSERT INTO pair_catalog (currency_a, currency_b, first_seen, last_seen)
+    VALUES (NEW.currency_a, NEW.currency_b, NEW.edited, NEW.edited)
+    ON CONFLICT (currency_a, currency_b) DO UPDATE SET
+        first_seen = min(pair_catalog.first_seen, excluded.first_seen),
+        last_seen = max(pair_catalog.last_seen, excluded.last_seen);
+END;
+CREATE TABLE IF NOT EXISTS rate_rollups (
+    granularity TEXT NOT NULL,
+    currency_a TEXT NOT NULL,
+    currency_b TEXT NOT NULL,
+    channel_id INTEGER NOT NULL,
+    bucket TEXT NOT NULL,
+    buy REAL,
+    sell REAL,
+    exchanger_id INTEGER,
+    sell_exchanger_id INTEGER,
+    buy_open REAL,
+    buy_close REAL,
+    buy_min REAL,
+    buy_max REAL,
+    sell_open REAL,
+    sell_close REAL,
+    sell_min REAL,
+    sell_max REAL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (granularity, currency_a, currency_b, channel_id, bucket)
+);
+CREATE TABLE IF NOT EXISTS rate_rollup_state (
+    granularity TEXT NOT NULL,
+    currency_a TEXT NOT NULL,
+    currency_b TEXT NOT NULL,
+    rolled_until TEXT NOT NULL,
+    PRIMARY KEY (granularity, currency_a, currency_b)
+);
+"""
+
+# Заповнення rate_trends для бази, створеної до появи тригера (sql/rate_trends.sql робить те саме в Postgres)
+SQLITE_TRENDS_BACKFILL = f"""
+INSERT OR IGNORE INTO rate_trends (channel_id, currency_a, currency_b, buy, sell, edited, prev_buy, prev_sell)
+SELECT
+    l.channel_id, l.currency_a, l.currency_b, l.buy, l.sell, l.edited,
+    (SELECT r.buy FROM rates r
+      WHERE r.channel_id = l.channel_id AND r.currency_a = l.currency_a AND r.currency_b = l.currency_b
+        AND r.edited < l.edited AND ((r.buy IS NULL) <> (l.buy IS NULL) OR abs(r.buy - l.buy) > 0.0001)
+      ORDER BY r.edited DESC LIMIT 1),
+    (SELECT r.sell FROM rates r
+      WHERE r.channel_id = l.channel_id AND r.currency_a = l.currency_a AND r.currency_b = l.currency_b
+        AND r.edited < l.edited AND ((r.sell IS NULL) <> (l.sell IS NULL) OR abs(r.sell - l.sell) > 0.0001)
+      ORDER BY r.edited DESC LIMIT 1)
+FROM (
+    SELECT {RATE_COLUMNS}, ROW_NUMBER() OVER (
+        PARTITION BY channel_id, currency_a, currency_b ORDER BY edited DESC
+    ) AS position
+    FROM rates
+) l
+WHERE l.position = 1
+"""
+
+# Run-length стиснення (те саме, що compact_rates у sql/rates_compaction.sql)
+SQLITE_COMPACTION = [
+    "DROP TABLE IF EXISTS temp.compaction",
+    """
+    CREATE TEMP TABLE compaction AS
+    WITH ordered AS (
+        SELECT
+            id, channel_id, currency_a, currency_b, edited,
+            COALESCE(last_seen, edited) AS seen,
+            CASE
+                WHEN LAG(id) OVER w IS NULL
+                  OR (buy IS NULL) <> (LAG(buy) OVER w IS NULL) OR abs(buy - LAG(buy) OVER w) > 0.0001
+                  OR (sell IS NULL) <> (LAG(sell) OVER w IS NULL) OR abs(sell - LAG(sell) OVER w) > 0.0001
+                THEN 1 ELSE 0
+            END AS is_head
+        FROM rates
+        WHERE edited < ?
+        WINDOW w AS (PARTITION BY channel_id, currency_a, currency_b ORDER BY edited, id)
+    )
+    SELECT *, SUM(is_head) OVER (PARTITION BY channel_id, currency_a, currency_b ORDER BY edited, id) AS run
+    FROM ordered
+    """,
+    """
+    UPDATE rates SET last_seen = runs.last_seen
+    FROM (
+        SELECT MAX(CASE WHEN is_head = 1 THEN id END) AS head_id, MAX(seen) AS last_seen, COUNT(*) AS size
+        FROM compaction
+        GROUP BY channel_id, currency_a, currency_b, run
+    ) AS runs
+    WHERE rates.id = runs.head_id AND runs.size > 1
+    """,
+    "DELETE FROM rates WHERE id IN (SELECT id FROM compaction WHERE is_head = 0)",
+]
+
+
+class SQLiteRepository(RatesRepository):
+    """
+    Вбудований SQLite backend.
+
+    edited зберігається як ISO 8601 текст у UTC (як його повертає Supabase),
+    тому порівняння рядків відповідає порівнянню часу. Кожен потік пулу db
+    отримує власне з'єднання.
+    """
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        # ":memory:" живе в межах одного з'єднання - для нього спільне з'єднання під lock
+        self._shared = None
+        self._shared_lock = threading.Lock()
+        if path == ":memory:":
+            self._shared = self._connect()
+        with self._cursor() as conn:
+            conn.executescript(SQLITE_SCHEMA)
+            # База, створена до появи last_seen
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(rates)")}
+            if "last_seen" not in columns:
+                conn.execute("ALTER TABLE rates ADD COLUMN last_seen TEXT")
+            # База, створена до появи channels.city
+            if "city" not in {row["name"] for row in conn.execute("PRAGMA table_info(channels)")}:
+                conn.execute("ALTER TABLE channels ADD COLUMN city TEXT")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS rates_pair_last_seen_idx ON rates (currency_a, currency_b, last_seen) "
+                "WHERE last_seen IS NOT NULL"
+            )
+            # Дотики інших записувачів для snapshot (iter_touched_rates)
+            conn.execute("CREATE INDEX IF NOT EXISTS rates_last_seen_idx ON rates (last_seen) WHERE last_seen IS NOT NULL")
+            if conn.execute("SELECT 1 FROM rate_trends LIMIT 1").fetchone() is None:
+                conn.execute(SQLITE_TRENDS_BACKFILL)
+            if conn.execute("SELECT 1 FROM pair_catalog LIMIT 1").fetchone() is None:
+                conn.execute(
+                    "INSERT OR IGNORE INTO pair_catalog (currency_a, currency_b, first_seen, last_seen) "
+                    "SELECT currency_a, currency_b, MIN(edited), MAX(edited) FROM rates GROUP BY currency_a, currency_b"
+                )
+
+    def _connect(self) -> sqlite3.Connection:
+        in_memory = self.path == ":memory:"
+        # Спільне з'єднання :memory: використовують потоки пулу db (під _shared_lock)
+        conn = sqlite3.connect(self.path, check_same_thread=not in_memory)
+        conn.row_factory = sqlite3.Row
+        if not in_memory:
+            # WAL: читачі не блокуються записом replica
+            conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _cursor(self):
+        if self._shared is not None:
+            return _LockedConnection(self._shared, self._shared_lock)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return _LockedConnection(conn, None)
+
+    def _select(self, sql: str, params: Sequence = ()) -> List[dict]:
+        with self._cursor() as conn:
+            return [dict(row) for row in conn.execute(sql, params).fetchall()]
+
+    @staticmethod
+    def _format_since(since: datetime) -> str:
+        return since.isoformat() + "+00:00"
+
+    def ping(self) -> bool:
+        self._select("SELECT 1")
+        return True
+
+    def list_channels(self) -> List[dict]:
+        return self._select("SELECT id, name, city FROM channels")
+
+    def _iter_keyset(self, columns: str, where: str, params: Sequence, descending: bool = True, page_size: int = RATES_PAGE_SIZE) -> Iterator[dict]:
+        """
+        Сторінки rates за keyset (edited, id) - окремий запит на сторінку, тому
+        з'єднання (і lock спільної :memory: бази) не тримається між сторінками.
+        """
+        direction, order = ("<", "DESC") if descending else (">", "ASC")
+        after: list = []
+        while True:
+            keyset = f" AND edited {direction}= ? AND (edited {direction} ? OR id {direction} ?)" if after else ""
+            rows = self._select(
+                f"SELECT id, {columns} FROM rates WHERE {where}{keyset} ORDER BY edited {order}, id {order} LIMIT ?",
+                [*params, *after, page_size]
+            )
+            if rows:
+                after = [rows[-1]["edited"], rows[-1]["edited"], rows[-1]["id"]]
+            for row in rows:
+                del row["id"]
+                yield row
+            if len(rows) < page_size:
+                return
+
+    def iter_rates(self, since: Optional[str] = None, descending: bool = True, page_size: int = RATES_PAGE_SIZE) -> Iterator[dict]:
+        if since is None:
+            return self._iter_keyset(RATE_COLUMNS, "1", (), descending, page_size)
+        return self._iter_keyset(RATE_COLUMNS, "edited >= ?", (since,), descending, page_size)
+
+    def latest_rates(self, channel_ids: Optional[Iterable[int]] = None, pairs: Optional[Iterable[str]] = None) -> List[dict]:
+        conditions = []
+        params: list = []
+        if channel_ids is not None:
+            channel_ids = list(channel_ids)
+            conditions.append(f"channel_id IN ({','.join('?' * len(channel_ids))})")
+            params.extend(channel_ids)
+        if pairs is not None:
+            pairs = list(pairs)
+            conditions.append(f"currency_a || '/' || currency_b IN ({','.join('?' * len(pairs))})")
+            params.extend(pairs)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        # Перший запис кожної групи в порядку індексу rates_key_edited_idx
+        return self._select(f"""
+            SELECT {RATE_COLUMNS} FROM (
+                SELECT {RATE_COLUMNS}, ROW_NUMBER() OVER (
+                    PARTITION BY channel_id, currency_a, currency_b ORDER BY edited DESC
+                ) AS position
+                FROM rates {where}
+            ) WHERE position = 1
+        """, params)
+
+    def pair_first_seen(self) -> List[dict]:
+        return self._select("SELECT currency_a, currency_b, first_seen FROM pair_catalog")
+
+    def rate_trends(self) -> List[dict]:
+        return self._select(f"SELECT {RATE_COLUMNS}, prev_buy, prev_sell FROM rate_trends")
+
+    def rates_for_keys(self, keys: Sequence[RateKey], before: Optional[str] = None, after: Optional[Tuple[str, int]] = None, limit: int = 1000) -> List[dict]:
+        if not keys:
+            return []
+        params: list = []
+        conditions = []
+        for channel_id, currency_a, currency_b in keys:
+            conditions.append("(channel_id = ? AND currency_a = ? AND currency_b = ?)")
+            params.extend((channel_id, currency_a, currency_b))
+        sql = f"SELECT id, {RATE_COLUMNS} FROM rates WHERE ({' OR '.join(conditions)})"
+        if before is not None:
+            sql += " AND edited <= ?"
+            params.append(before)
+        if after is not None:
+            sql += " AND edited <= ? AND (edited < ? OR id < ?)"
+            params.extend((after[0], after[0], after[1]))
+        sql += " ORDER BY edited DESC, id DESC LIMIT ?"
+        params.append(limit)
+        return self._select(sql, params)
+
+    def iter_pair_history(self, currency_a: str, currency_b: str, since: datetime, channel_ids: Optional[List[int]] = None, until: Optional[datetime] = None, page_size: int = RATES_PAGE_SIZE) -> Iterator[dict]:
+        where = "currency_a = ? AND currency_b = ? AND (edited >= ? OR last_seen >= ?)"
+        params: list = [currency_a, currency_b, self._format_since(since), self._format_since(since)]
+        if until is not None:
+            where += " AND edited < ?"
+            params.append(self._format_since(until))
+        if channel_ids is not None:
+            where += f" AND channel_id IN ({','.join('?' * len(channel_ids))})" if channel_ids else " AND 0"
+            params.extend(channel_ids)
+        return self._iter_keyset(f"{RATE_COLUMNS}, last_seen", where, params, page_size=page_size)
+
+    def pair_last_seen(self, currency_a: str, currency_b: str) -> Optional[str]:
+        rows = self._select(
+            "SELECT MAX(last_seen) AS last_seen FROM rates WHERE currency_a = ? AND currency_b = ? AND last_seen IS NOT NULL",
+            (currency_a, currency_b)
+        )
+        return rows[0]["last_seen"] if rows else None
+
+    def upsert_channels(self, channels: Iterable[dict]) -> None:
+        """Додає або оновлює обмінники (для наповнення replica)."""
+        with self._cursor() as conn:
+            conn.executemany(
+                "INSERT INTO channels (id, name, city) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET name = excluded.name, city = excluded.city",
+                [(ch["id"], ch["name"], ch.get("city")) for ch in channels]
+            )
+
+    def insert_rates(self, rows: Iterable[dict]) -> int:
+        # Від старих до нових: тригер rate_trends ігнорує записи, старіші за поточний.
+        # last_seen - для стиснутих записів (replica, повторна вставка дотику)
+        values = [
+            (row["channel_id"], row["currency_a"], row["currency_b"], row.get("buy"), row.get("sell"), row["edited"], row.get("last_seen"))
+            for row in sorted(rows, key=lambda row: row["edited"])
+        ]
+        with self._cursor() as conn:
+            conn.executemany(
+                "INSERT INTO rates (channel_id, currency_a, currency_b, buy, sell, edited, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                values
+            )
+        return len(values)
+
+    def touch_rates(self, touches: Sequence[dict]) -> int:
+        with self._cursor() as conn:
+            # Голова серії: найновіший запис ключа з edited <= edited дотику (rates_key_edited_idx)
+            cursor = conn.executemany(
+                "UPDATE rates SET last_seen = max(COALESCE(last_seen, edited), ?) WHERE id = ("
+                "SELECT id FROM rates WHERE channel_id = ? AND currency_a = ? AND currency_b = ? AND edited <= ? "
+                "ORDER BY edited DESC, id DESC LIMIT 1)",
+                [(t["last_seen"], t["channel_id"], t["currency_a"], t["currency_b"], t["edited"]) for t in touches]
+            )
+            return cursor.rowcount
+
+    def iter_touched_rates(self, since: Optional[str] = None, page_size: int = RATES_PAGE_SIZE) -> Iterator[dict]:
+        if since is None:
+            return self._iter_keyset(f"{RATE_COLUMNS}, last_seen", "last_seen IS NOT NULL", (), descending=False, page_size=page_size)
+        return self._iter_keyset(f"{RATE_COLUMNS}, last_seen", "last_seen >= ?", (since,), descending=False, page_size=page_size)
+
+    def compact_rates(self, before: datetime) -> int:
+        with self._cursor() as conn:
+            for statement in SQLITE_COMPACTION:
+                cursor = conn.execute(statement, (self._format_since(before),) if "?" in statement else ())
+            return cursor.rowcount
+
+    def rollup_state(self, currency_a: str, currency_b: str, interval: str) -> Optional[str]:
+        rows = self._select(
+            "SELECT rolled_until FROM rate_rollup_state WHERE granularity = ? AND currency_a = ? AND currency_b = ?",
+            (interval, currency_a, currency_b)
+        )
+        return rows[0]["rolled_until"] if rows else None
+
+    def rollups(self, currency_a: str, currency_b: str, interval: str, channel_id: int, since: datetime, until: datetime) -> List[dict]:
+        return self._select(
+            f"SELECT {ROLLUP_COLUMNS} FROM rate_rollups "
+            "WHERE granularity = ? AND currency_a = ? AND currency_b = ? AND channel_id = ? AND bucket >= ? AND bucket < ? "
+            "ORDER BY bucket",
+            (interval, currency_a, currency_b, channel_id, self._format_since(since), self._format_since(until))
+        )
+
+    def save_rollups(self, currency_a: str, currency_b: str, interval: str, rows: Sequence[dict], rolled_until: datetime) -> int:
+        columns = [column.strip() for column in ROLLUP_COLUMNS.split(",")]
+        with self._cursor() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO rate_rollups (granularity, currency_a, currency_b, {ROLLUP_COLUMNS}) "
+                f"VALUES (?, ?, ?, {', '.join('?' * len(columns))})",
+                [(interval, currency_a, currency_b, *(row.get(column) for column in columns)) for row in rows]
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_rollup_state (granularity, currency_a, currency_b, rolled_until) VALUES (?, ?, ?, ?)",
+                (interval, currency_a, currency_b, self._format_since(rolled_until))
+            )
+        return len(rows)
+
+    def max_edited(self) -> Optional[str]:
+        """Найновіший edited у replica (звідки продовжувати копіювання)."""
+        rows = self._select("SELECT MAX(edited) AS edited FROM rates")
+        return rows[0]["edited"] if rows else None
+
+    def max_last_seen(self) -> Optional[str]:
+        """Найновіший last_seen у replica (звідки продовжувати копіювання дотиків)."""
+        rows = self._select("SELECT MAX(last_seen) AS last_seen FROM rates")
+        return rows[0]["last_seen"] if rows else None
+
+
+class _LockedConnection:
+    """Контекст з'єднання: commit/rollback наприкінці та (для :memory:) взаємне виключення."""
+
+    def __init__(self, conn: sqlite3.Connection, lock: Optional[threading.Lock]):
+        self.conn = conn
+        self.lock = lock
+
+    def __enter__(self) -> sqlite3.Connection:
+        if self.lock is not None:
+            self.lock.acquire()
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            if exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            if self.lock is not None:
+                self.lock.release()
+
+
+_repository: Optional[RatesRepository] = None
+_repository_lock = threading.Lock()
+
+
+def create_repository(backend: str = STORAGE_BACKEND) -> RatesRepository:
+    """Створює репозиторій за назвою backend ("supabase" або "sqlite")."""
+    if backend == "supabase":
+        return SupabaseRepository()
+    if backend == "sqlite":
+        return SQLiteRepository(SQLITE_PATH)
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend!r} (expected 'supabase' or 'sqlite')")
+
+
+def get_repository() -> RatesRepository:
+    """Спільний репозиторій процесу (створюється при першому зверненні)."""
+    global _repository
+    if _repository is None:
+        with _repository_lock:
+            if _repository is None:
+                _repository = create_repository()
+                logger.info(f"Storage backend: {type(_repository).__name__}")
+    return _repository
+
+
+def set_repository(repository: RatesRepository) -> None:
+    """Підміняє репозиторій процесу (тести, benchmark, replica)."""
+    global _repository
+    _repository = repository
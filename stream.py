@@ -0,0 +1,185 @@
+"""
+Push-потік змін найкращих курсів (Server-Sent Events) для /rates/bestrate/stream.
+
+Один спільний фоновий poller на весь процес: коли змінюється версія даних
+(версія snapshot або довідник обмінників), він один раз перераховує best rates
+тією ж логікою, що й /rates/bestrate, порівнює з попереднім станом і розсилає
+diff усім підписникам. Кожен підписник має обмежену чергу: якщо клієнт не
+встигає читати, накопичені diff відкидаються і замість них надсилається
+повний snapshot (backpressure без необмеженого росту пам'яті).
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import Dict, Iterable, Optional, Set
+
+from best_rates import compute_best_rates
+from channels import channel_directory
+from snapshot import rates_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Як часто (секунд) poller перевіряє нові дані
+STREAM_POLL_INTERVAL = float(os.getenv("STREAM_POLL_INTERVAL", "5"))
+# Скільки подій може чекати в черзі одного підписника
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "16"))
+# Як часто (секунд) надсилати коментар keep-alive, якщо подій немає
+STREAM_HEARTBEAT_INTERVAL = float(os.getenv("STREAM_HEARTBEAT_INTERVAL", "15"))
+
+# Поля, зміна яких означає зміну best rate або тренду для пари
+TRACKED_FIELDS = (
+    "buy_best", "buy_exchanger", "buy_trend", "buy_change_abs", "buy_change_pct",
+    "sell_best", "sell_exchanger", "sell_trend", "sell_change_abs", "sell_change_pct",
+)
+
+
+def diff_states(previous: Dict[str, dict], current: Dict[str, dict]) -> tuple:
+    """
+    Порівнює два стани {pair: row}.
+
+    Returns:
+        (changed, removed): changed - {pair: {"currency": pair, <змінені поля>}},
+        removed - список пар, яких більше немає
+    """
+    changed = {}
+    for pair, row in current.items():
+        old = previous.get(pair, {})
+        fields = {field: row.get(field) for field in TRACKED_FIELDS if field in row and old.get(field) != row.get(field)}
+        if fields:
+            changed[pair] = {"currency": pair, **fields}
+    removed = sorted(pair for pair in previous if pair not in current)
+    return changed, removed
+
+
+class Subscriber:
+    """Один SSE клієнт: фільтр пар та обмежена черга подій."""
+
+    def __init__(self, pairs: Optional[Set[str]]):
+        self.pairs = pairs
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        self.synced = False
+
+    def wants(self, pair: str) -> bool:
+        return self.pairs is None or pair in self.pairs
+
+
+class BestRateStream:
+    """Спільний poller best rates з розсилкою diff підписникам."""
+
+    def __init__(self, poll_interval: float = STREAM_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._subscribers: Set[Subscriber] = set()
+        self._state: Dict[str, dict] = {}
+        self._version = None
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self, pairs: Optional[Iterable[str]] = None) -> Subscriber:
+        """Реєструє підписника; poller стартує разом з першим підписником."""
+        subscriber = Subscriber(set(pairs) if pairs else None)
+        self._subscribers.add(subscriber)
+        if self._version is not None:
+            self._deliver(subscriber, self._snapshot_event(subscriber))
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._poll_loop())
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        """Знімає підписку; без підписників poller зупиняється."""
+        self._subscribers.discard(subscriber)
+        if not self._subscribers and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _poll_loop(self) -> None:
+        while self._subscribers:
+            try:
+                await self.poll_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Best rate stream poll failed: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def wake(self) -> None:
+        """Запускає перевірку негайно, не чекаючи poll_interval (напр. після POST /rates/ingest)."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def poll_once(self) -> None:
+        """Перевіряє версію даних і, якщо вона змінилась, розсилає diff."""
+        await asyncio.gather(
+            channel_directory.load(),
+            rates_snapshot.load()
+        )
+        version = (rates_snapshot.version, channel_directory.version)
+        if version == self._version:
+            return
+
+        content = await compute_best_rates([], [])
+        state = {row["currency"]: row for row in content["data"]} if content else {}
+        changed, removed = diff_states(self._state, state)
+        self._state = state
+        # Тренди без історії (degraded) - наступна перевірка перерахує ту ж версію
+        self._version = None if content and content["meta"]["degraded"] else version
+
+        for subscriber in list(self._subscribers):
+            if not subscriber.synced:
+                self._deliver(subscriber, self._snapshot_event(subscriber))
+                continue
+            subscriber_changed = [row for pair, row in changed.items() if subscriber.wants(pair)]
+            subscriber_removed = [pair for pair in removed if subscriber.wants(pair)]
+            if subscriber_changed or subscriber_removed:
+                self._deliver(subscriber, {
+                    "event": "update",
+                    "data": {"changed": subscriber_changed, "removed": subscriber_removed}
+                })
+
+    def _snapshot_event(self, subscriber: Subscriber) -> dict:
+        return {
+            "event": "snapshot",
+            "data": {"data": [row for pair, row in sorted(self._state.items()) if subscriber.wants(pair)]}
+        }
+
+    def _deliver(self, subscriber: Subscriber, event: dict) -> None:
+        if subscriber.queue.full():
+            # Повільний клієнт: накопичені diff замінюємо одним актуальним snapshot
+            while not subscriber.queue.empty():
+                subscriber.queue.get_nowait()
+            event = self._snapshot_event(subscriber)
+        subscriber.queue.put_nowait(event)
+        if event["event"] == "snapshot":
+            subscriber.synced = True
+
+
+def format_sse(event: dict) -> str:
+    """Подія у форматі text/event-stream."""
+    return f"event: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+
+async def sse_events(request, stream: "BestRateStream", subscriber: Subscriber):
+    """Генератор тіла SSE відповіді; знімає підписку, коли клієнт відключився."""
+    try:
+        while not await request.is_disconnected():
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), timeout=STREAM_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse(event)
+    finally:
+        stream.unsubscribe(subscriber)
+
+
+# Спільний потік для всіх SSE клієнтів
+bestrate_stream = BestRateStream()
@@ -1,4 +1,4 @@
-from supabase import create_client
+import logging
 import os
 from dotenv import load_dotenv
 from pathlib import Path
@@ -10,10 +10,50 @@ load_dotenv(dotenv_path=env_path)
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError(
-        "⚠️  Не знайдено SUPABASE_URL або SUPABASE_KEY у .env файлі. "
-        "Перевірте, чи файл .env існує та містить обидва ключі."
-    )
+logger = logging.getLogger(__name__)
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+_client = None
+
+
+def get_supabase():
+    """
+    Клієнт Supabase, створений при першому зверненні.
+
+    Імпорт модуля більше не вимагає .env: помилка про відсутні ключі виникає лише
+    тоді, коли клієнт справді потрібен (STORAGE_BACKEND=supabase).
+
+    Запити йдуть через спільний пул keep-alive з'єднань з таймаутами та
+    повторами (http_pool.py).
+    """
+    global _client
+    if _client is None:
+        if not SUPABASE_URL or not SUPABASE_KEY:
+            raise ValueError(
+                "⚠️  Не знайдено SUPABASE_URL або SUPABASE_KEY у .env файлі. "
+                "Перевірте, чи файл .env існує та містить обидва ключі."
+            )
+        from supabase import create_client
+        _client = create_client(SUPABASE_URL, SUPABASE_KEY, options=_client_options())
+    return _client
+
+
+def _client_options():
+    """Опції клієнта з транспортом http_pool (supabase-py без httpx_client - транспорт за замовчуванням)."""
+    from http_pool import SUPABASE_TIMEOUT, create_http_client
+    try:
+        from supabase.lib.client_options import SyncClientOptions as ClientOptions
+    except ImportError:
+        from supabase.lib.client_options import ClientOptions
+
+    try:
+        return ClientOptions(httpx_client=create_http_client())
+    except TypeError:
+        logger.warning("supabase-py does not accept httpx_client, using its default transport (no pool metrics)")
+        return ClientOptions(postgrest_client_timeout=SUPABASE_TIMEOUT)
+
+
+def __getattr__(name):
+    # `from supabase_client import supabase` (скрипти) продовжує працювати
+    if name == "supabase":
+        return get_supabase()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,55 @@
+"""
+Спільні fixtures: SQLite репозиторій у тимчасовому файлі замість Supabase,
+свіжі snapshot та довідник обмінників для кожного тесту.
+"""
+from datetime import datetime, time, timedelta
+
+import pytest
+
+import storage
+from channels import ChannelDirectory
+from snapshot import LatestRatesSnapshot
+from storage import SQLiteRepository
+
+CHANNELS = [
+    {"id": 1, "name": "Garant", "city": "Kyiv"},
+    {"id": 2, "name": "Mirvalut", "city": "Kyiv"},
+    {"id": 3, "name": "Valuta", "city": "Lviv"},
+    {"id": 4, "name": "Obmen", "city": None},
+]
+
+
+# Учорашня дата: записи в межах вікна history_store і не з майбутнього для ingest
+DAY = datetime.utcnow().date() - timedelta(days=1)
+
+
+def ts(hour: int, minute: int = 0, days_ago: int = 0) -> str:
+    """edited у форматі бази (ISO 8601 UTC) для години вчорашнього дня (або на days_ago днів раніше)."""
+    moment = datetime.combine(DAY - timedelta(days=days_ago), time(hour, minute))
+    return moment.isoformat() + "+00:00"
+
+
+def rate(channel_id: int, pair: str, buy, sell, edited: str) -> dict:
+    currency_a, currency_b = pair.split("/")
+    return {"channel_id": channel_id, "currency_a": currency_a, "currency_b": currency_b, "buy": buy, "sell": sell, "edited": edited}
+
+
+@pytest.fixture
+def repository(tmp_path, monkeypatch):
+    """SQLite репозиторій процесу (get_repository) з обмінниками CHANNELS."""
+    repository = SQLiteRepository(str(tmp_path / "rates.db"))
+    repository.upsert_channels(CHANNELS)
+    monkeypatch.setattr(storage, "_repository", repository)
+    return repository
+
+
+@pytest.fixture
+def snapshot(repository):
+    return LatestRatesSnapshot(refresh_interval=0)
+
+
+@pytest.fixture
+def directory(repository):
+    directory = ChannelDirectory()
+    directory.refresh()
+    return directory
@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+
+import best_rates
+from conftest import rate, ts
+
+HISTORY = [
+    rate(1, "USD/UAH", 40.9, 41.6, ts(9)),
+    rate(1, "USD/UAH", 41.0, 41.5, ts(10)),
+    rate(2, "USD/UAH", 41.2, 41.4, ts(10)),
+    rate(3, "USD/UAH", 41.3, 41.3, ts(10)),
+    rate(4, "USD/UAH", 41.1, 41.7, ts(10)),
+    rate(2, "EUR/UAH", 45.0, 45.9, ts(9)),
+    rate(2, "EUR/UAH", 45.1, 45.8, ts(10)),
+    rate(3, "EUR/UAH", 45.4, 45.6, ts(10)),
+]
+
+
+@pytest.fixture
+def compute(repository, snapshot, directory, monkeypatch):
+    """compute_best_rates на snapshot і довіднику тесту."""
+    monkeypatch.setattr(best_rates, "rates_snapshot", snapshot)
+    monkeypatch.setattr(best_rates, "channel_directory", directory)
+    repository.insert_rates(HISTORY)
+    snapshot.refresh(force=True)
+
+    def compute(**kwargs):
+        kwargs.setdefault("currency_pairs", [])
+        kwargs.setdefault("exchanger_names", [])
+        return asyncio.run(best_rates.compute_best_rates(**kwargs))
+
+    return compute
+
+
+def test_city_filter_matches_exchanger_filter(compute, snapshot):
+    kyiv = compute(city=" KYIV ")["data"]
+    assert kyiv == compute(exchanger_names=["Garant", "Mirvalut"])["data"]
+    assert [(row["currency"], row["buy_exchanger"], row["sell_exchanger"]) for row in kyiv] == [
+        ("EUR/UAH", "Mirvalut", "Mirvalut"),
+        ("USD/UAH", "Mirvalut", "Mirvalut"),
+    ]
+    assert compute(city="kyiv", exchanger_names=["Garant"])["data"] == compute(exchanger_names=["Garant"])["data"]
+    assert compute(city="Odesa") is None
+
+    # Індекс міст оновлюється новими записами без перебудови
+    snapshot.apply([rate(3, "USD/UAH", 41.9, 41.0, ts(11))])
+    assert compute(city="kyiv", currency_pairs=["USD/UAH"])["data"] == kyiv[1:]
+    snapshot.apply([rate(1, "USD/UAH", 41.8, 41.1, ts(11))])
+    usd = compute(city="kyiv", currency_pairs=["USD/UAH"])["data"][0]
+    assert (usd["buy_best"], usd["buy_exchanger"], usd["sell_best"]) == (41.8, "Garant", 41.1)
+
+
+def test_top_k_lists_best_quotes_with_trends(compute):
+    plain = compute()["data"]
+    top = compute(top_k=3)["data"]
+
+    for row, with_top in zip(plain, top):
+        assert {key: value for key, value in with_top.items() if not key.endswith("_top")} == row
+        assert with_top["buy_top"][0]["value"] == row["buy_best"]
+        assert with_top["sell_top"][0]["value"] == row["sell_best"]
+
+    usd = top[1]
+    assert [(entry["value"], entry["exchanger"]) for entry in usd["buy_top"]] == [(41.3, "Valuta"), (41.2, "Mirvalut"), (41.1, "Obmen")]
+    assert [(entry["value"], entry["exchanger"]) for entry in usd["sell_top"]] == [(41.3, "Valuta"), (41.4, "Mirvalut"), (41.5, "Garant")]
+    # Тренд кожного запису - від попереднього котирування його обмінника
+    garant = usd["sell_top"][2]
+    assert (garant["trend"], garant["change_abs"]) == ("down", -0.1)
+    assert usd["buy_top"][0]["trend"] == "stable"
+    # Пара з двома обмінниками - списки коротші за K
+    assert len(top[0]["buy_top"]) == len(top[0]["sell_top"]) == 2
+
+
+def test_timestamps_follow_repeated_quotes(compute, snapshot):
+    snapshot.touch([
+        {"channel_id": 1, "currency_a": "USD", "currency_b": "UAH", "buy": 41.0, "sell": 41.5, "edited": ts(10), "last_seen": ts(12)},
+        {"channel_id": 3, "currency_a": "USD", "currency_b": "UAH", "buy": 41.3, "sell": 41.3, "edited": ts(10), "last_seen": ts(11)},
+    ])
+    usd = compute(currency_pairs=["USD/UAH"], top_k=3)["data"][0]
+
+    # timestamp - останнє котирування (повтор), тренд - як і раніше від попереднього значення
+    assert (usd["buy_timestamp"], usd["sell_timestamp"]) == (ts(11), ts(11))
+    garant = usd["sell_top"][2]
+    assert (garant["exchanger"], garant["timestamp"], garant["trend"], garant["change_abs"]) == ("Garant", ts(12), "down", -0.1)
+    assert usd["buy_top"][1]["timestamp"] == ts(10)
+
+
+def test_failed_trend_lookup_is_reported_as_degraded(compute, snapshot, monkeypatch):
+    # Без baseline з rate_trends тренди шукаються в історії
+    snapshot._baselines.clear()
+
+    def failing_lookup(*args, **kwargs):
+        raise ConnectionError("history unavailable")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(best_rates, "find_previous_rates_batch", failing_lookup)
+        degraded = compute(top_k=3)
+    assert degraded["meta"]["degraded"] is True
+    assert {entry["trend"] for row in degraded["data"] for entry in row["buy_top"] + row["sell_top"]} == {"stable"}
+
+    # Невдалий пошук не запам'ятовується як базовий рівень: наступний розрахунок - з трендами
+    recovered = compute(top_k=3)
+    assert recovered["meta"]["degraded"] is False
+    assert recovered["data"][1]["sell_top"][2]["trend"] == "down"
+
+
+def test_cursor_pages_cover_all_pairs_once(compute, snapshot, monkeypatch):
+    snapshot.apply([rate(1, "PLN/UAH", 10.3, 10.5, ts(10)), rate(2, "GBP/UAH", 52.0, 52.8, ts(10))])
+    full = compute()["data"]
+
+    pages, cursor = [], None
+    while True:
+        page = compute(limit=2, cursor=cursor)
+        pages.extend(page["data"])
+        assert page["meta"]["total"] == 4
+        cursor = page["meta"]["next_cursor"]
+        if cursor is None:
+            break
+    assert pages == full
+    assert [row["currency"] for row in full] == ["EUR/UAH", "GBP/UAH", "PLN/UAH", "USD/UAH"]
+    assert compute(limit=2, offset=2)["data"] == full[2:]
+
+    # Тренди рахуються лише для пар сторінки
+    snapshot._baselines.clear()
+    lookups = []
+
+    def lookup(batch, strict=False):
+        lookups.extend(f"{item['currency_a']}/{item['currency_b']}" for item in batch)
+        return [None] * len(batch)
+
+    monkeypatch.setattr(best_rates, "find_previous_rates_batch", lookup)
+    compute(limit=1, cursor="GBP/UAH")
+    assert set(lookups) == {"PLN/UAH"}
@@ -0,0 +1,11 @@
+def test_version_changes_only_with_channels(repository, directory):
+    version = directory.version
+    # Перезавантаження за TTL без змін - та сама версія (кеші й ETag живуть далі)
+    directory.refresh(force=True)
+    assert directory.version == version
+
+    repository.upsert_channels([{"id": 4, "name": "Obmen", "city": "Odesa"}])
+    directory.refresh(force=True)
+    assert directory.version == version + 1
+    assert directory.cities[4] == "odesa"
+
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+import best_rates  # noqa: E402
+import main  # noqa: E402
+from conditional import is_not_modified, make_etag  # noqa: E402
+from conftest import rate, ts  # noqa: E402
+from cross_rates import CrossRateEngine  # noqa: E402
+from pair_catalog import PairCatalog  # noqa: E402
+from response_cache import ResponseCache  # noqa: E402
+
+ENDPOINTS = {
+    "bestrate": lambda etag: main.get_best_rates(
+        currencies=None, exchangers=None, city=None, limit=None, offset=0, cursor=None, top_k=None, if_none_match=etag
+    ),
+    "cross": lambda etag: main.get_cross_rates(currencies="EUR/USD", via=None, if_none_match=etag),
+    "pairs": lambda etag: main.get_exchangers_pairs(active_days=None, if_none_match=etag),
+    "currencies": lambda etag: main.get_currencies_list(if_none_match=etag),
+    "history": lambda etag: main.get_rates_history(
+        currency_pair="USD/UAH", exchanger=None, days=7, interval="hour", stats=False, if_none_match=etag
+    ),
+}
+
+
+def test_if_none_match_forms():
+    etag = make_etag("bestrate", (1, 2), ("USD/UAH",))
+    assert etag == make_etag("bestrate", (1, 2), ("USD/UAH",)) != make_etag("bestrate", (1, 3), ("USD/UAH",))
+    assert is_not_modified(etag, etag)
+    assert is_not_modified(f'"other", W/{etag}', etag)
+    assert is_not_modified("*", etag)
+    assert not is_not_modified(None, etag)
+    assert not is_not_modified('"other"', etag)
+
+
+@pytest.fixture
+def app(snapshot, directory, monkeypatch):
+    """Endpoints main.py на snapshot і довіднику тесту (history - з бази, без history_store)."""
+    for module in (main, best_rates):
+        monkeypatch.setattr(module, "rates_snapshot", snapshot)
+        monkeypatch.setattr(module, "channel_directory", directory)
+    monkeypatch.setattr(main, "cross_rate_engine", CrossRateEngine(snapshot))
+    monkeypatch.setattr(main, "pair_catalog", PairCatalog(snapshot))
+    monkeypatch.setattr(main, "bestrate_cache", ResponseCache(16, 1024 * 1024))
+    monkeypatch.setattr(main, "HISTORY_STORE", False)
+    return main
+
+
+@pytest.mark.parametrize("endpoint", sorted(ENDPOINTS))
+def test_endpoint_answers_304_until_data_changes(app, repository, endpoint):
+    repository.insert_rates([
+        rate(1, "USD/UAH", 41.0, 41.5, ts(10)),
+        rate(2, "EUR/UAH", 45.1, 45.8, ts(10)),
+    ])
+    call = ENDPOINTS[endpoint]
+
+    response = asyncio.run(call(None))
+    etag = response.headers["ETag"]
+    assert response.status_code == 200
+    assert asyncio.run(call(etag)).status_code == 304
+    assert asyncio.run(call(f"W/{etag}")).status_code == 304
+
+    # Нове котирування змінює версію даних - повна відповідь з новим ETag
+    repository.insert_rates([rate(1, "USD/UAH", 41.1, 41.6, ts(11))])
+    response = asyncio.run(call(etag))
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
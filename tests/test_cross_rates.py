@@ -0,0 +1,77 @@
+import random
+
+from conftest import rate, ts
+from cross_rates import CROSS_RATE_DECIMALS, CrossRateEngine
+
+QUOTED = ["USD/UAH", "EUR/UAH", "PLN/UAH", "EUR/USD", "USD/PLN"]
+CHANNEL_MAP = {1: "Garant", 2: "Mirvalut", 3: "Valuta", 4: "Obmen"}
+
+
+def brute_force(rows, base, quote):
+    """Найкращі крос-курси перебором усіх останніх котирувань."""
+    latest = {}
+    for row in sorted(rows, key=lambda row: row["edited"]):
+        latest[(row["channel_id"], row["currency_a"], row["currency_b"])] = row
+
+    def conversion(source, target):
+        rates = [row["buy"] for (_, a, b), row in latest.items() if (a, b) == (source, target)]
+        rates += [1 / row["sell"] for (_, a, b), row in latest.items() if (a, b) == (target, source)]
+        return max(rates, default=None)
+
+    currencies = {currency for _, a, b in latest for currency in (a, b)} - {base, quote}
+
+    def best(source, target):
+        paths = [
+            (conversion(source, currency) * conversion(currency, target), currency)
+            for currency in sorted(currencies)
+            if conversion(source, currency) and conversion(currency, target)
+        ]
+        # Серед рівних - перша за алфавітом проміжна валюта
+        return max(paths, key=lambda path: path[0], default=None)
+
+    buy, sell = best(base, quote), best(quote, base)
+    return (
+        (round(buy[0], CROSS_RATE_DECIMALS), buy[1]) if buy else None,
+        (round(1 / sell[0], CROSS_RATE_DECIMALS), sell[1]) if sell else None,
+    )
+
+
+def engine_quote(engine, base, quote):
+    result = engine.quote(base, quote, CHANNEL_MAP)
+    if result is None:
+        return None, None
+    return (
+        (result["buy_best"], result["buy_via"]) if "buy_best" in result else None,
+        (result["sell_best"], result["sell_via"]) if "sell_best" in result else None,
+    )
+
+
+def test_cross_rates_match_brute_force(repository, snapshot):
+    generator = random.Random(11)
+    rows = []
+    for hour in (9, 10):
+        for channel_id in CHANNEL_MAP:
+            for pair in QUOTED:
+                if generator.random() < 0.7:
+                    middle = {"USD/UAH": 41.3, "EUR/UAH": 45.2, "PLN/UAH": 10.4, "EUR/USD": 1.09, "USD/PLN": 3.97}[pair]
+                    spread = middle * generator.uniform(0.001, 0.02)
+                    rows.append(rate(channel_id, pair, round(middle - spread, 4), round(middle + spread, 4), ts(hour)))
+    repository.insert_rates(rows)
+    snapshot.refresh(force=True)
+    engine = CrossRateEngine(snapshot)
+
+    def check():
+        for base, quote in [("EUR", "USD"), ("USD", "EUR"), ("PLN", "EUR"), ("EUR", "PLN"), ("USD", "UAH")]:
+            assert engine_quote(engine, base, quote) == brute_force(rows, base, quote), (base, quote)
+
+    check()
+    # Найкращі котирування пар оновлюються інкрементально: кращий запис і заміна найкращого гіршим
+    best_buy, _ = snapshot.pair_best("EUR", "UAH")
+    updates = [
+        rate(best_buy["channel_id"], "EUR/UAH", 40.0, 50.0, ts(11)),
+        rate(3, "USD/UAH", 42.5, 42.6, ts(11)),
+    ]
+    snapshot.apply(updates)
+    rows.extend(updates)
+    check()
+    assert engine.quote("GBP", "USD", CHANNEL_MAP) is None
@@ -0,0 +1,133 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import history_numpy
+import history_store
+from history import INTERVAL_US, HistoryAggregator, from_epoch_us, make_data_point, to_epoch_us, truncate_to_interval
+from history_store import HistoryStore
+from rollups import fetch_rollup_history, refresh_rollups
+
+CHANNEL_MAP = {1: "Garant", 2: "Mirvalut", 3: "Valuta"}
+NOW = datetime.utcnow().replace(second=0, microsecond=0)
+# Межі bucket посеред періоду: cutoff не на початку години
+CUTOFF = NOW - timedelta(days=3, minutes=17)
+
+
+def make_history():
+    """
+    Записи USD/UAH за 4 дні, edited DESC. Частина - стиснуті серії (last_seen
+    через кілька bucket), частина - без buy; серії одного обмінника не перекриваються.
+    """
+    generator = random.Random(5)
+    rows = []
+    for channel_id in CHANNEL_MAP:
+        # Різні секунди: жодних однакових edited між обмінниками
+        moment = NOW - timedelta(days=4, seconds=channel_id)
+        while True:
+            gap = timedelta(minutes=generator.randint(5, 240))
+            if moment + gap > NOW:
+                break
+            row = {
+                "channel_id": channel_id, "currency_a": "USD", "currency_b": "UAH",
+                "buy": generator.choice([41.0, 41.1, 41.2, None]), "sell": generator.choice([41.5, 41.6, 41.7]),
+                "edited": moment.isoformat() + "+00:00", "last_seen": None
+            }
+            if generator.random() < 0.3:
+                row["last_seen"] = (moment + gap * generator.uniform(0.2, 0.9)).isoformat() + "+00:00"
+            rows.append(row)
+            moment += gap
+    rows.sort(key=lambda row: row["edited"], reverse=True)
+    return rows
+
+
+@pytest.fixture(params=["hour", "day"])
+def interval(request):
+    return request.param
+
+
+@pytest.fixture(params=[None, [2]], ids=["all", "exchanger"])
+def channel_ids(request):
+    return request.param
+
+
+def aggregate(rows, interval, channel_ids, cutoff=CUTOFF):
+    """Еталон: HistoryAggregator зі stats по сирих записах (edited DESC)."""
+    selected = [row for row in rows if channel_ids is None or row["channel_id"] in channel_ids]
+    return HistoryAggregator(interval, cutoff, CHANNEL_MAP, stats=True).add_all(selected).data_points()
+
+
+def test_aggregator_matches_per_bucket_scan(interval, channel_ids):
+    rows = make_history()
+    points = aggregate(rows, interval, channel_ids)
+
+    step = timedelta(hours=1) if interval == "hour" else timedelta(days=1)
+    expected = {}
+    for row in rows:
+        if channel_ids is not None and row["channel_id"] not in channel_ids:
+            continue
+        edited = datetime.fromisoformat(row["edited"]).replace(tzinfo=None)
+        last_seen = datetime.fromisoformat(row["last_seen"]).replace(tzinfo=None) if row["last_seen"] else edited
+        bucket = truncate_to_interval(max(edited, CUTOFF), interval)
+        # Стиснута серія - у кожному bucket від edited до last_seen
+        while bucket <= last_seen and last_seen >= CUTOFF:
+            expected.setdefault(bucket, []).append(row)
+            bucket += step
+
+    assert [point["timestamp"] for point in points] == [bucket.isoformat() + "Z" for bucket in sorted(expected)]
+    for point, bucket in zip(points, sorted(expected)):
+        quotes = expected[bucket]
+        buys = [row for row in quotes if row["buy"]]
+        best_buy = max(buys, key=lambda row: row["buy"]) if buys else quotes[0]
+        best_sell = min(quotes, key=lambda row: row["sell"])
+        assert (point["buy"], point["exchanger"]) == (best_buy["buy"], CHANNEL_MAP[best_buy["channel_id"]])
+        assert (point["sell"], point["sell_exchanger"]) == (best_sell["sell"], CHANNEL_MAP[best_sell["channel_id"]])
+        assert point["stats"]["count"] == len(quotes)
+        assert point["stats"]["sell_open"] == quotes[-1]["sell"]
+        assert point["stats"]["sell_close"] == quotes[0]["sell"]
+
+
+def test_numpy_aggregation_matches_aggregator(interval, channel_ids, monkeypatch):
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(history_numpy, "HISTORY_NUMPY", True)
+    rows = [row for row in make_history() if channel_ids is None or row["channel_id"] in channel_ids]
+    assert history_numpy.aggregate_records(rows, interval, CUTOFF, CHANNEL_MAP, stats=True) == aggregate(rows, interval, channel_ids)
+    # Колонки з генератора частинами, меншими за кількість записів, - як при потоковому читанні з бази
+    columns = history_numpy.records_to_columns(iter(rows), chunk_size=7)
+    buckets = history_numpy.aggregate_columns(*columns, to_epoch_us(CUTOFF), INTERVAL_US[interval])
+    assert [make_data_point(from_epoch_us(bucket), point, CHANNEL_MAP) for bucket, point in buckets] == [
+        {key: value for key, value in point.items() if key != "stats"} for point in aggregate(rows, interval, channel_ids)
+    ]
+
+
+def test_rollup_history_matches_aggregator(repository, interval, channel_ids):
+    rows = make_history()
+    repository.insert_rates(rows)
+    # Закриті bucket - з rollup, перший (обрізаний cutoff) і поточний - з сирих записів
+    assert refresh_rollups([("USD", "UAH")], now=NOW) > 0
+    points = fetch_rollup_history("USD", "UAH", CUTOFF, interval, channel_ids, CHANNEL_MAP, stats=True)
+    assert points == aggregate(rows, interval, channel_ids)
+
+
+@pytest.mark.parametrize("use_numpy", [False, True], ids=["aggregator", "numpy"])
+def test_history_store_matches_aggregator(repository, interval, channel_ids, use_numpy, monkeypatch):
+    if use_numpy:
+        pytest.importorskip("numpy")
+    monkeypatch.setattr(history_store, "HISTORY_NUMPY", use_numpy)
+    rows = make_history()
+    # Частина записів - у базі до завантаження пари, решта - через apply() та дочитування.
+    # Межа - після last_seen усіх старіших записів: новіші рядки не запізнілі для watermark
+    split = next(
+        index for index in range(len(rows) // 2, len(rows))
+        if all((row["last_seen"] or row["edited"]) < rows[index - 1]["edited"] for row in rows[index:])
+    )
+    repository.insert_rates(rows[split:])
+    store = HistoryStore(refresh_interval=0)
+    store.refresh_pair("USD", "UAH")
+    store.apply(rows[:split // 2])
+    repository.insert_rates(rows[:split])
+    store.refresh_pair("USD", "UAH")
+
+    points = store.data_points("USD", "UAH", CUTOFF, interval, channel_ids, CHANNEL_MAP, stats=True)
+    assert points == aggregate(rows, interval, channel_ids)
@@ -0,0 +1,60 @@
+import httpx
+import pytest
+
+from http_pool import PoolMetrics, PooledTransport
+
+
+def client(responses, size=2, retries=2):
+    """httpx.Client на PooledTransport, де мережу заміняє черга відповідей (або винятків)."""
+    calls = []
+
+    def handler(request):
+        calls.append(request.method)
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return httpx.Response(response, content=b"body")
+
+    transport = PooledTransport(httpx.MockTransport(handler), PoolMetrics(size), retries=retries, backoff=0)
+    return httpx.Client(transport=transport, base_url="http://supabase.test"), transport.metrics, calls
+
+
+def test_idempotent_requests_are_retried():
+    http, metrics, calls = client([503, 502, 200])
+    assert http.get("/rest/v1/rates").status_code == 200
+    assert calls == ["GET"] * 3
+    stats = metrics.stats()
+    assert (stats["requests"], stats["retries"], stats["errors"], stats["in_use"], stats["waiting"]) == (1, 2, 0, 0, 0)
+
+    # Повтори вичерпано - повертається остання відповідь
+    http, metrics, calls = client([503, 503], retries=1)
+    assert http.get("/rest/v1/rates").status_code == 503
+    assert len(calls) == 2
+
+
+def test_writes_are_retried_only_before_sending():
+    http, metrics, calls = client([503])
+    assert http.post("/rest/v1/rates", json={}).status_code == 503
+    assert calls == ["POST"]
+
+    http, metrics, calls = client([httpx.ReadTimeout("read")])
+    with pytest.raises(httpx.ReadTimeout):
+        http.post("/rest/v1/rates", json={})
+    assert calls == ["POST"] and metrics.stats()["errors"] == 1 and metrics.stats()["in_use"] == 0
+
+    # З'єднання не встановлено - запит не відправлено, повтор безпечний
+    http, metrics, calls = client([httpx.ConnectError("refused"), 201])
+    assert http.post("/rest/v1/rates", json={}).status_code == 201
+    assert calls == ["POST"] * 2 and metrics.stats()["retries"] == 1
+
+
+def test_slot_is_held_until_the_body_is_closed():
+    http, metrics, calls = client([200, 200], size=1)
+    with http.stream("GET", "/rest/v1/rates") as response:
+        assert metrics.stats()["in_use"] == 1
+        assert response.read() == b"body"
+    assert metrics.stats()["in_use"] == 0
+
+    # Звільнений слот доступний наступному запиту (пул на одне з'єднання)
+    assert http.get("/rest/v1/rates").status_code == 200
+    assert metrics.stats()["requests"] == 2
@@ -0,0 +1,161 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import ingest
+from conftest import rate, ts
+from history_store import HistoryStore
+from ingest import QuoteError, drop_consecutive_duplicates, ingest_rows, normalize_edited, validate_batch
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = HistoryStore(refresh_interval=0)
+    monkeypatch.setattr(ingest, "history_store", store)
+    return store
+
+
+def test_ingest_does_not_skip_unread_rows_of_other_writers(repository, snapshot, store):
+    repository.insert_rates([rate(1, "USD/UAH", 41.0, 41.5, ts(10))])
+    snapshot.refresh(force=True)
+
+    # Інший записувач пише в базу напряму; snapshot цього ще не бачив
+    repository.insert_rates([rate(2, "USD/UAH", 41.2, 41.4, ts(10, 5))])
+    ingest_rows([rate(3, "USD/UAH", 41.1, 41.6, ts(10, 6))], [], snapshot)
+    version = snapshot.version
+
+    snapshot.refresh(force=True)
+    assert snapshot.current((2, "USD", "UAH"))["buy"] == 41.2
+    # Запізнілий рядок не зсуває watermark, але змінює версію даних (ETag, кеш)
+    assert snapshot.watermark == ts(10, 6)
+    assert snapshot.version != version
+    # Повторне читання тих самих рядків версію не змінює
+    version = snapshot.version
+    snapshot.refresh(force=True)
+    assert snapshot.version == version
+
+
+def test_history_store_picks_up_rows_behind_ingested_ones(repository, snapshot, store):
+    repository.insert_rates([rate(1, "USD/UAH", 41.0, 41.5, ts(10))])
+    store.refresh_pair("USD", "UAH", version=1)
+
+    repository.insert_rates([rate(2, "USD/UAH", 41.2, 41.4, ts(10, 5))])
+    ingest_rows([rate(3, "USD/UAH", 41.1, 41.6, ts(10, 6))], [], snapshot)
+    store.refresh_pair("USD", "UAH", version=2)
+
+    series = store._series[store._pair_ids[("USD", "UAH")]]
+    assert sorted(series) == [1, 2, 3]
+    assert all(len(channel_series) == 1 for channel_series in series.values())
+
+
+def test_future_edited_is_rejected():
+    future = (datetime.utcnow() + timedelta(hours=1)).isoformat() + "Z"
+    with pytest.raises(QuoteError):
+        normalize_edited(future)
+    # Невелике розходження годинників допускається
+    assert normalize_edited((datetime.utcnow() + timedelta(seconds=30)).isoformat())
+
+
+def test_refresh_does_not_freeze_on_future_rows(repository, snapshot):
+    future = [(datetime.utcnow() + timedelta(hours=hours)).isoformat() + "+00:00" for hours in (23, 24)]
+    repository.insert_rates([rate(1, "USD/UAH", 41.0, 41.5, future[0]), rate(1, "USD/UAH", 41.1, 41.5, future[1])])
+    snapshot.refresh(force=True)
+    snapshot.refresh(force=True)
+    # Рядки за межею читання перечитуються, але версію даних більше не змінюють
+    version = snapshot.version
+    snapshot.refresh(force=True)
+    assert snapshot.version == version
+
+    # Наступний запис з поточним часом - раніше за той, що з майбутнього
+    repository.insert_rates([rate(2, "USD/UAH", 41.2, 41.4, datetime.utcnow().isoformat() + "+00:00")])
+    snapshot.refresh(force=True)
+    assert snapshot.current((2, "USD", "UAH")) is not None
+
+
+def test_duplicates_are_dropped_and_extend_last_seen(repository, snapshot, directory, store):
+    repository.insert_rates([rate(1, "USD/UAH", 41.0, 41.5, ts(10))])
+    snapshot.refresh(force=True)
+
+    rows, errors = validate_batch([
+        {"channel_id": 1, "currency": "usd/uah", "buy": 41.0, "sell": 41.5, "edited": ts(11)},
+        {"channel_id": 1, "currency": "USD/UAH", "buy": 41.0, "sell": 41.5, "edited": ts(12)},
+        {"channel_id": 1, "currency": "USD/UAH", "buy": 41.3, "sell": 41.5, "edited": ts(13)},
+        {"channel_id": 1, "currency": "USD/UAH", "buy": 41.3, "sell": 41.5, "edited": ts(14)},
+    ], directory)
+    assert errors == []
+
+    kept, touches, dropped = drop_consecutive_duplicates(rows, snapshot)
+    assert dropped == 3
+    assert [row["edited"] for row in kept] == [ts(13)]
+    assert {(touch["edited"], touch["last_seen"]) for touch in touches} == {(ts(10), ts(12)), (ts(13), ts(14))}
+
+    ingest_rows(kept, touches, snapshot)
+    history = repository.pair_history("USD", "UAH", datetime.utcnow() - timedelta(days=3))
+    assert [(row["edited"], row["last_seen"]) for row in history] == [(ts(13), ts(14)), (ts(10), ts(12))]
+    assert snapshot.current((1, "USD", "UAH"))["buy"] == 41.3
+
+
+def test_duplicate_after_compaction_touches_run_head(repository, snapshot, store):
+    repository.insert_rates([rate(1, "USD/UAH", 41.0, 41.5, ts(10)), rate(1, "USD/UAH", 41.0, 41.5, ts(11))])
+    snapshot.refresh(force=True)
+    repository.compact_rates(datetime.utcnow())
+
+    # snapshot тримає видалений запис 11:00 як поточний
+    rows, touches, _ = drop_consecutive_duplicates([rate(1, "USD/UAH", 41.0, 41.5, ts(12))], snapshot)
+    assert touches[0]["edited"] == ts(11)
+    ingest_rows(rows, touches, snapshot)
+    assert repository.pair_last_seen("USD", "UAH") == ts(12)
+    assert len(repository.pair_history("USD", "UAH", datetime.utcnow() - timedelta(days=3))) == 1
+
+
+def test_missing_touched_rows_are_reinserted(repository, snapshot, store):
+    repository.insert_rates([rate(1, "USD/UAH", 41.0, 41.5, ts(10))])
+    snapshot.refresh(force=True)
+    with repository._cursor() as conn:
+        conn.execute("DELETE FROM rates")
+
+    rows, touches, _ = drop_consecutive_duplicates([rate(1, "USD/UAH", 41.0, 41.5, ts(12))], snapshot)
+    ingest_rows(rows, touches, snapshot)
+    history = repository.pair_history("USD", "UAH", datetime.utcnow() - timedelta(days=3))
+    assert [(row["buy"], row["edited"], row["last_seen"]) for row in history] == [(41.0, ts(10), ts(12))]
+
+
+def test_history_store_warms_up_in_background(repository, store):
+    repository.insert_rates([rate(1, "USD/UAH", 41.0, 41.5, ts(10))])
+    cutoff = datetime.utcnow() - timedelta(days=3)
+    channel_map = {1: "Garant"}
+
+    # Холодна пара: None (rollup або база), завантаження - у фоні
+    assert store.data_points("USD", "UAH", cutoff, "hour", None, channel_map) is None
+    for _ in range(100):
+        if store.stats()["pairs"]:
+            break
+        time.sleep(0.01)
+    points = store.data_points("USD", "UAH", cutoff, "hour", None, channel_map)
+    assert [point["buy"] for point in points] == [41.0]
+    # Період, довший за сховище
+    assert store.data_points("USD", "UAH", datetime.utcnow() - timedelta(days=store.days + 2), "day", None, channel_map) is None
+
+
+def test_history_store_reads_new_rows_outside_the_lock(repository, snapshot, store, monkeypatch):
+    repository.insert_rates([rate(1, "USD/UAH", 41.0, 41.5, ts(10))])
+    store.refresh_pair("USD", "UAH", version=1)
+    repository.insert_rates([rate(2, "USD/UAH", 41.2, 41.4, ts(10, 5))])
+
+    iter_pair_history = repository.iter_pair_history
+    locked = []
+
+    def watched(*args, **kwargs):
+        for row in iter_pair_history(*args, **kwargs):
+            # Поки дочитуються рядки, apply() і запити до інших пар не чекають
+            if not locked:
+                ingest_rows([rate(3, "USD/UAH", 41.1, 41.6, ts(10, 6))], [], snapshot)
+            locked.append(store._lock.locked())
+            yield row
+
+    monkeypatch.setattr(repository, "iter_pair_history", watched)
+    store.refresh_pair("USD", "UAH", version=2)
+
+    assert locked and not any(locked)
+    assert sorted(store._series[store._pair_ids[("USD", "UAH")]]) == [1, 2, 3]
@@ -0,0 +1,83 @@
+import pytest
+
+import ingest
+from conftest import rate, ts
+from history_store import HistoryStore
+from ingest import drop_consecutive_duplicates, ingest_rows
+from pair_catalog import PairCatalog
+
+CHANNEL_MAP = {1: "Garant", 2: "Mirvalut", 3: "Valuta"}
+
+
+@pytest.fixture
+def catalog(repository, snapshot, monkeypatch):
+    monkeypatch.setattr(ingest, "history_store", HistoryStore(refresh_interval=0))
+    repository.insert_rates([
+        rate(1, "USD/UAH", 41.0, 41.5, ts(10, days_ago=10)),
+        rate(2, "USD/UAH", 41.1, 41.6, ts(10, days_ago=10)),
+    ])
+    snapshot.refresh(force=True)
+    return PairCatalog(snapshot, active_days=3)
+
+
+def active_pairs(catalog):
+    return {entry["exchanger"]: entry["pairs"] for entry in catalog.exchanger_pairs(CHANNEL_MAP, active_days=3)}
+
+
+def test_repeated_quote_keeps_exchanger_active(catalog, snapshot):
+    version = snapshot.version
+    rows, touches, _ = drop_consecutive_duplicates([rate(1, "USD/UAH", 41.0, 41.5, ts(10))], snapshot)
+    assert rows == []
+    ingest_rows(rows, touches, snapshot)
+
+    # Повтор не змінює edited, але котирування - свіже
+    assert snapshot.current((1, "USD", "UAH"))["edited"] == ts(10, days_ago=10)
+    assert snapshot.version != version
+    assert active_pairs(catalog) == {"Garant": ["USD/UAH"], "Mirvalut": [], "Valuta": []}
+    [entry] = catalog.entries()
+    assert (entry["last_seen"], entry["exchangers"], entry["active_exchangers"]) == (ts(10), 2, 1)
+
+
+def test_touches_of_other_writers_reach_the_snapshot(catalog, repository, snapshot):
+    version = snapshot.pair_version("USD", "UAH")
+    repository.touch_rates([
+        {"channel_id": 2, "currency_a": "USD", "currency_b": "UAH", "buy": 41.1, "sell": 41.6, "edited": ts(10, days_ago=10), "last_seen": ts(11)}
+    ])
+    snapshot.refresh(force=True)
+
+    assert snapshot.current((2, "USD", "UAH"))["last_seen"] == ts(11)
+    assert snapshot.pair_version("USD", "UAH") != version
+    assert active_pairs(catalog)["Mirvalut"] == ["USD/UAH"]
+    # Повторне читання тих самих дотиків версію не змінює
+    version = snapshot.version
+    snapshot.refresh(force=True)
+    assert snapshot.version == version
+
+
+def test_active_days_window(catalog, snapshot):
+    snapshot.apply([rate(3, "EUR/UAH", 45.1, 45.8, ts(10, days_ago=1)), rate(1, "EUR/UAH", 45.0, 45.9, ts(10, days_ago=4))])
+
+    def pairs(active_days):
+        return {entry["exchanger"]: entry["pairs"] for entry in catalog.exchanger_pairs(CHANNEL_MAP, active_days=active_days)}
+
+    # Без вікна - усі пари, з вікном - лише котировані за останні N днів
+    assert pairs(None) == {"Garant": ["EUR/UAH", "USD/UAH"], "Mirvalut": ["USD/UAH"], "Valuta": ["EUR/UAH"]}
+    assert pairs(3) == {"Garant": [], "Mirvalut": [], "Valuta": ["EUR/UAH"]}
+    assert pairs(7) == {"Garant": ["EUR/UAH"], "Mirvalut": [], "Valuta": ["EUR/UAH"]}
+    assert pairs(30) == pairs(None)
+
+    counts = {(entry["base"], entry["quote"]): (entry["exchangers"], entry["active_exchangers"]) for entry in catalog.entries()}
+    assert counts == {("EUR", "UAH"): (2, 1), ("USD", "UAH"): (2, 0)}
+
+
+def test_first_seen_comes_from_the_whole_history(catalog, repository, snapshot):
+    # Старіший запис пари: у snapshot не потрапляє (не останній), але тригер pair_catalog його враховує
+    repository.insert_rates([rate(3, "USD/UAH", 40.0, 40.5, ts(10, days_ago=20)), rate(3, "USD/UAH", 41.2, 41.7, ts(10, days_ago=9))])
+    snapshot.refresh(force=True)
+    assert [(entry["base"], entry["first_seen"]) for entry in catalog.entries()] == [("USD", ts(10, days_ago=20))]
+
+    # Пара, що з'явилася після читання pair_catalog: first_seen знає snapshot
+    ingest_rows([rate(1, "GBP/UAH", 52.0, 52.5, ts(11, days_ago=1)), rate(1, "GBP/UAH", 52.1, 52.5, ts(11))], [], snapshot)
+    first_seen = {(entry["base"], entry["quote"]): entry["first_seen"] for entry in catalog.entries()}
+    assert first_seen == {("GBP", "UAH"): ts(11, days_ago=1), ("USD", "UAH"): ts(10, days_ago=20)}
+    assert {(row["currency_a"], row["first_seen"]) for row in repository.pair_first_seen()} == {("USD", ts(10, days_ago=20)), ("GBP", ts(11, days_ago=1))}
@@ -0,0 +1,37 @@
+from response_cache import ResponseCache, normalize_filter
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ResponseCache(max_entries=2, max_bytes=10)
+    cache.put("a", 1, b"aaa")
+    cache.put("b", 1, b"bbb")
+    # Звернення до "a" робить найдавнішим "b"
+    assert cache.get("a", 1) == b"aaa"
+    cache.put("c", 1, b"ccc")
+    assert (cache.get("b", 1), cache.get("a", 1), cache.get("c", 1)) == (None, b"aaa", b"ccc")
+
+    # Ліміт байтів: новий запис витісняє стільки старих, скільки потрібно
+    cache.put("d", 1, b"dddddddd")
+    assert (cache.get("a", 1), cache.get("c", 1), cache.get("d", 1)) == (None, None, b"dddddddd")
+    # Відповідь, більша за весь кеш, не зберігається
+    cache.put("e", 1, b"e" * 11)
+    assert cache.get("e", 1) is None
+    assert cache.stats()["evictions"] == 3
+    assert cache.stats()["bytes"] == 8
+
+
+def test_new_data_version_drops_all_entries():
+    cache = ResponseCache(max_entries=10, max_bytes=1000)
+    cache.put(("USD/UAH",), (1, 1), b"old")
+    assert cache.get(("USD/UAH",), (1, 1)) == b"old"
+
+    assert cache.get(("USD/UAH",), (2, 1)) is None
+    # Повернення старої версії не відновлює скинуті записи
+    assert cache.get(("USD/UAH",), (1, 1)) is None
+    stats = cache.stats()
+    assert (stats["entries"], stats["invalidations"], stats["hits"], stats["misses"]) == (0, 1, 1, 2)
+
+
+def test_filter_order_and_duplicates_share_a_key():
+    assert normalize_filter(["USD/UAH", "EUR/UAH", "USD/UAH"]) == normalize_filter(["EUR/UAH", "USD/UAH"])
+    assert normalize_filter(None) == normalize_filter([]) == ()
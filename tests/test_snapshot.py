@@ -0,0 +1,94 @@
+import asyncio
+import threading
+import time
+
+from conftest import rate, ts
+
+
+def test_refresh_keeps_latest_row_per_key(repository, snapshot):
+    repository.insert_rates([
+        rate(1, "USD/UAH", 41.0, 41.5, ts(10)),
+        rate(1, "USD/UAH", 41.2, 41.6, ts(11)),
+        rate(2, "USD/UAH", 41.1, 41.4, ts(10, 30)),
+    ])
+    snapshot.refresh(force=True)
+
+    latest = snapshot.latest()
+    assert [(row["channel_id"], row["buy"]) for row in latest] == [(1, 41.2), (2, 41.1)]
+    assert snapshot.watermark == ts(11)
+
+
+def test_refresh_picks_up_only_new_rows(repository, snapshot):
+    repository.insert_rates([rate(1, "USD/UAH", 41.0, 41.5, ts(10))])
+    snapshot.refresh(force=True)
+    repository.insert_rates([rate(1, "USD/UAH", 41.3, 41.7, ts(12))])
+    snapshot.refresh(force=True)
+
+    assert snapshot.current((1, "USD", "UAH"))["buy"] == 41.3
+    # Попереднє значення стало baseline тренду
+    assert snapshot.baselines((1, "USD", "UAH")) == {"buy": 41.0, "sell": 41.5}
+
+
+
+def test_row_at_the_watermark_changes_the_version(repository, snapshot):
+    repository.insert_rates([rate(1, "USD/UAH", 41.0, 41.5, ts(10))])
+    snapshot.refresh(force=True)
+    version, pair_version = snapshot.version, snapshot.pair_version("USD", "UAH")
+
+    # Інший обмінник з тим самим edited: watermark не зсувається, але дані змінились
+    repository.insert_rates([rate(2, "USD/UAH", 41.2, 41.4, ts(10))])
+    snapshot.refresh(force=True)
+    assert snapshot.watermark == ts(10)
+    assert snapshot.version != version
+    assert snapshot.pair_version("USD", "UAH") != pair_version
+
+def test_latest_is_safe_while_rows_are_applied(snapshot):
+    errors = []
+    done = threading.Event()
+
+    def writer():
+        try:
+            for index in range(20000):
+                snapshot.apply([rate(index % 500, f"C{index}/UAH", 1.0, 1.1, ts(10))])
+        finally:
+            done.set()
+
+    def reader():
+        try:
+            while not done.is_set():
+                snapshot.latest()
+                snapshot.keys()
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_load_is_single_flight(repository, snapshot, monkeypatch):
+    repository.insert_rates([rate(1, "USD/UAH", 41.0, 41.5, ts(10))])
+    snapshot.refresh(force=True)
+    snapshot.refresh_interval = 60
+    snapshot._last_refresh = 0.0
+
+    calls = []
+    rates_since = repository.rates_since
+
+    def slow_rates_since(watermark):
+        calls.append(threading.current_thread().name)
+        time.sleep(0.2)
+        return rates_since(watermark)
+
+    monkeypatch.setattr(repository, "rates_since", slow_rates_since)
+
+    async def requests():
+        await asyncio.gather(*(snapshot.load() for _ in range(20)))
+        # Свіжий snapshot - без звернення до бази
+        await snapshot.load()
+
+    asyncio.run(requests())
+    assert len(calls) == 1
@@ -0,0 +1,175 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import rate, ts
+from storage import SQLiteRepository
+from trends import find_baseline
+
+
+def test_pair_last_seen_follows_touches(repository):
+    repository.insert_rates([rate(1, "USD/UAH", 41.0, 41.5, ts(10)), rate(2, "EUR/UAH", 45.0, 45.5, ts(10))])
+    assert repository.pair_last_seen("USD", "UAH") is None
+
+    touched = repository.touch_rates([
+        {"channel_id": 1, "currency_a": "USD", "currency_b": "UAH", "edited": ts(10), "last_seen": ts(12)}
+    ])
+    assert touched == 1
+    assert repository.pair_last_seen("USD", "UAH") == ts(12)
+    assert repository.pair_last_seen("EUR", "UAH") is None
+
+
+def test_compaction_keeps_run_heads(repository):
+    repository.insert_rates([
+        rate(1, "USD/UAH", 41.0, 41.5, ts(10)),
+        rate(1, "USD/UAH", 41.0, 41.5, ts(11)),
+        rate(1, "USD/UAH", 41.2, 41.5, ts(12)),
+        rate(1, "USD/UAH", 41.2, 41.5, ts(13)),
+        rate(1, "USD/UAH", 41.2, 41.5, ts(14)),
+        rate(2, "USD/UAH", 41.1, 41.6, ts(10)),
+    ])
+    assert repository.compact_rates(datetime.utcnow()) == 3
+
+    history = sorted(repository.pair_history("USD", "UAH", datetime.utcnow() - timedelta(days=3)), key=lambda row: (row["edited"], row["channel_id"]))
+    assert [(row["channel_id"], row["buy"], row["edited"], row["last_seen"]) for row in history] == [
+        (1, 41.0, ts(10), ts(11)),
+        (2, 41.1, ts(10), None),
+        (1, 41.2, ts(12), ts(14)),
+    ]
+
+
+def test_touch_after_compaction_extends_run_head(repository):
+    repository.insert_rates([rate(1, "USD/UAH", 41.0, 41.5, ts(10)), rate(1, "USD/UAH", 41.0, 41.5, ts(11))])
+    repository.compact_rates(datetime.utcnow())
+
+    # Дотик до запису 11:00, який стиснення злило в голову 10:00
+    touched = repository.touch_rates([
+        {"channel_id": 1, "currency_a": "USD", "currency_b": "UAH", "edited": ts(11), "last_seen": ts(13)}
+    ])
+    assert touched == 1
+    assert repository.pair_last_seen("USD", "UAH") == ts(13)
+
+
+def test_touch_without_rows_reports_shortfall(repository):
+    repository.insert_rates([rate(1, "USD/UAH", 41.0, 41.5, ts(12))])
+    touched = repository.touch_rates([
+        {"channel_id": 1, "currency_a": "USD", "currency_b": "UAH", "edited": ts(11), "last_seen": ts(13)},
+        {"channel_id": 2, "currency_a": "USD", "currency_b": "UAH", "edited": ts(11), "last_seen": ts(13)},
+    ])
+    assert touched == 0
+
+
+def test_replication_copies_last_seen(repository, tmp_path, monkeypatch):
+    import replicate_sqlite
+
+    monkeypatch.setattr(replicate_sqlite, "SupabaseRepository", lambda: repository)
+    repository.insert_rates([rate(1, "USD/UAH", 41.0, 41.5, ts(10)), rate(1, "USD/UAH", 41.0, 41.5, ts(11))])
+    repository.compact_rates(datetime.utcnow())
+    path = str(tmp_path / "replica.db")
+    assert replicate_sqlite.replicate(path) == 1
+    assert SQLiteRepository(path).pair_last_seen("USD", "UAH") == ts(11)
+
+    # Дотик до вже скопійованого запису переноситься наступним запуском
+    repository.insert_rates([rate(2, "USD/UAH", 41.1, 41.6, ts(12))])
+    repository.touch_rates([{"channel_id": 1, "currency_a": "USD", "currency_b": "UAH", "edited": ts(10), "last_seen": ts(14)}])
+    assert replicate_sqlite.replicate(path) == 1
+    assert SQLiteRepository(path).pair_last_seen("USD", "UAH") == ts(14)
+
+
+def test_keyset_pages_cover_ties_once(repository):
+    # Кілька записів з однаковим edited: межа сторінки проходить посеред групи
+    rows = [rate(channel_id, "USD/UAH", 41.0 + channel_id / 10, 41.5, ts(10 + hour)) for hour in range(3) for channel_id in (1, 2, 3)]
+    repository.insert_rates(rows)
+
+    def listed(rows):
+        return [(row["edited"], row["channel_id"]) for row in rows]
+
+    everything = listed(repository.iter_rates(page_size=1000))
+    assert len(everything) == 9 and everything == sorted(everything, reverse=True)
+    for page_size in (1, 2, 4):
+        assert listed(repository.iter_rates(page_size=page_size)) == everything
+        assert listed(repository.iter_rates(descending=False, page_size=page_size)) == everything[::-1]
+        assert listed(repository.iter_rates(ts(11), page_size=page_size)) == everything[:6]
+        since = datetime.fromisoformat(ts(11)[:-6])
+        assert listed(repository.iter_pair_history("USD", "UAH", since, page_size=page_size)) == everything[:6]
+
+
+def make_rates(seed=7):
+    """Випадкова історія: 3 обмінники, 2 пари, повтори значень, None, однакові edited."""
+    generator = random.Random(seed)
+    rows = []
+    for channel_id in (1, 2, 3):
+        for pair in ("USD/UAH", "EUR/UAH"):
+            buy, sell = 41.0, 41.5
+            for step in range(40):
+                if generator.random() < 0.4:
+                    buy = None if generator.random() < 0.2 else round(buy + generator.choice((-0.1, 0.1)), 2) if buy else 41.0
+                if generator.random() < 0.4:
+                    sell = round(sell + generator.choice((-0.1, 0.1)), 2)
+                rows.append(rate(channel_id, pair, buy, sell, ts(step // 2, 30 * (step % 2) if generator.random() < 0.8 else 0, days_ago=step % 3)))
+    # Один запис на (ключ, edited): інакше "останній" запис неоднозначний
+    unique = {(row["channel_id"], row["currency_a"], row["currency_b"], row["edited"]): row for row in rows}
+    return list(unique.values())
+
+
+def test_pair_history_window_matches_full_scan(repository):
+    rows = make_rates()
+    repository.insert_rates(rows)
+    since, until = datetime.fromisoformat(ts(6, days_ago=1)[:-6]), datetime.fromisoformat(ts(15, days_ago=1)[:-6])
+
+    def listed(rows):
+        return sorted(((row["channel_id"], row["edited"], row["buy"], row["sell"]) for row in rows), key=lambda row: row[:2])
+
+    for channel_ids in (None, [2], [1, 3], []):
+        expected = listed(
+            row for row in rows
+            if (row["currency_a"], row["currency_b"]) == ("USD", "UAH")
+            and row["edited"] >= ts(6, days_ago=1) and row["edited"] < ts(15, days_ago=1)
+            and (channel_ids is None or row["channel_id"] in channel_ids)
+        )
+        assert listed(repository.pair_history("USD", "UAH", since, channel_ids, until=until)) == expected
+        assert len(expected) > 0 or channel_ids == []
+
+
+def test_latest_rates_match_full_scan(repository):
+    rows = make_rates()
+    repository.insert_rates(rows)
+    latest = {}
+    for row in sorted(rows, key=lambda row: row["edited"]):
+        latest[(row["channel_id"], row["currency_a"], row["currency_b"])] = row
+
+    def keyed(rows):
+        return {(row["channel_id"], row["currency_a"], row["currency_b"]): (row["buy"], row["sell"], row["edited"]) for row in rows}
+
+    for channel_ids, pairs in ((None, None), ([1, 3], None), (None, ["EUR/UAH"]), ([2], ["USD/UAH", "GBP/UAH"]), ([], None)):
+        expected = {
+            key: (row["buy"], row["sell"], row["edited"]) for key, row in latest.items()
+            if (channel_ids is None or key[0] in channel_ids) and (pairs is None or f"{key[1]}/{key[2]}" in pairs)
+        }
+        assert keyed(repository.latest_rates(channel_ids, pairs)) == expected
+
+
+@pytest.mark.parametrize("backfill", [False, True])
+def test_rate_trends_match_find_baseline(tmp_path, backfill):
+    rows = make_rates()
+    path = str(tmp_path / "rates.db")
+    repository = SQLiteRepository(path)
+    # Тригер отримує записи кількома вставками, як від ingest
+    for day in (2, 1, 0):
+        repository.insert_rates([row for row in rows if row["edited"][:10] == ts(0, days_ago=day)[:10]])
+    if backfill:
+        # База, створена до тригера: таблицю заповнює SQLITE_TRENDS_BACKFILL при відкритті
+        with repository._cursor() as conn:
+            conn.execute("DELETE FROM rate_trends")
+        repository = SQLiteRepository(path)
+
+    trends = repository.rate_trends()
+    assert len(trends) == 6
+    for trend in trends:
+        key = (trend["channel_id"], trend["currency_a"], trend["currency_b"])
+        history = repository.rates_for_keys([key], limit=1000)
+        assert (trend["buy"], trend["sell"], trend["edited"]) == (history[0]["buy"], history[0]["sell"], history[0]["edited"])
+        for side in ("buy", "sell"):
+            baseline = find_baseline(history, trend["buy"], trend["sell"], side)
+            assert trend[f"prev_{side}"] == (baseline[side] if baseline else None)
@@ -0,0 +1,89 @@
+import asyncio
+import json
+
+import pytest
+
+import best_rates
+import stream
+from conftest import rate, ts
+from stream import BestRateStream, format_sse
+
+RATES = [
+    rate(1, "USD/UAH", 41.0, 41.5, ts(10)),
+    rate(2, "USD/UAH", 41.2, 41.4, ts(10)),
+    rate(3, "USD/UAH", 41.3, 41.3, ts(10)),
+    rate(2, "EUR/UAH", 45.1, 45.8, ts(10)),
+]
+
+
+@pytest.fixture
+def best_rate_stream(repository, snapshot, directory, monkeypatch):
+    """BestRateStream на snapshot і довіднику тесту; poller прокидається лише через wake()."""
+    for module in (stream, best_rates):
+        monkeypatch.setattr(module, "rates_snapshot", snapshot)
+        monkeypatch.setattr(module, "channel_directory", directory)
+    repository.insert_rates(RATES)
+    return BestRateStream(poll_interval=3600)
+
+
+async def next_event(subscriber):
+    return await asyncio.wait_for(subscriber.queue.get(), timeout=5)
+
+
+def test_subscribers_get_snapshot_then_diffs(best_rate_stream, repository):
+    async def scenario():
+        everything = best_rate_stream.subscribe()
+        usd = best_rate_stream.subscribe(["USD/UAH"])
+        try:
+            first = await next_event(everything)
+            assert first["event"] == "snapshot"
+            assert [row["currency"] for row in first["data"]["data"]] == ["EUR/UAH", "USD/UAH"]
+            assert [row["currency"] for row in (await next_event(usd))["data"]["data"]] == ["USD/UAH"]
+
+            # Кращий buy USD/UAH: у diff лише змінені поля пари
+            repository.insert_rates([rate(2, "USD/UAH", 41.4, 41.35, ts(11))])
+            best_rate_stream.wake()
+            update = await next_event(usd)
+            assert update == await next_event(everything)
+            assert update["event"] == "update" and update["data"]["removed"] == []
+            [changed] = update["data"]["changed"]
+            assert (changed["currency"], changed["buy_best"], changed["buy_exchanger"], changed["buy_trend"]) == ("USD/UAH", 41.4, "Mirvalut", "up")
+            assert "sell_best" not in changed and "sell_exchanger" not in changed
+
+            # Зміна іншої пари не надсилається підписнику з фільтром
+            repository.insert_rates([rate(3, "EUR/UAH", 45.3, 45.7, ts(11))])
+            best_rate_stream.wake()
+            update = await next_event(everything)
+            assert [row["currency"] for row in update["data"]["changed"]] == ["EUR/UAH"]
+            assert usd.queue.empty()
+
+            text = format_sse(update)
+            assert text.startswith("event: update\ndata: ") and text.endswith("\n\n")
+            assert json.loads(text.split("data: ", 1)[1]) == update["data"]
+        finally:
+            best_rate_stream.unsubscribe(everything)
+            best_rate_stream.unsubscribe(usd)
+
+    asyncio.run(scenario())
+
+
+def test_slow_subscriber_gets_one_fresh_snapshot(best_rate_stream, repository, monkeypatch):
+    monkeypatch.setattr(stream, "STREAM_QUEUE_SIZE", 1)
+
+    async def scenario():
+        slow = best_rate_stream.subscribe()
+        try:
+            # Перший snapshot у черзі не прочитаний; далі poller чекає wake()
+            while slow.queue.empty():
+                await asyncio.sleep(0.01)
+            repository.insert_rates([rate(2, "USD/UAH", 41.4, 41.35, ts(11))])
+            await best_rate_stream.poll_once()
+
+            # Черга повна: diff не додається, а замінює все одним свіжим snapshot
+            event = await next_event(slow)
+            assert event["event"] == "snapshot" and slow.queue.empty()
+            assert {row["currency"]: row["buy_best"] for row in event["data"]["data"]} == {"EUR/UAH": 45.1, "USD/UAH": 41.4}
+        finally:
+            best_rate_stream.unsubscribe(slow)
+
+    asyncio.run(scenario())
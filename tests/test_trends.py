@@ -0,0 +1,59 @@
+import random
+
+import trends
+from conftest import rate, ts
+from trends import find_baseline, find_previous_rates_batch
+
+PAIRS = ["USD/UAH", "EUR/UAH"]
+
+
+def test_batch_lookup_matches_per_key_lookup(repository, monkeypatch):
+    # Маленькі сторінки: кілька запитів і межі сторінок посеред однакових edited
+    monkeypatch.setattr(trends, "BATCH_PAGE_SIZE", 4)
+    generator = random.Random(7)
+    rows = []
+    for minute in range(40):
+        for channel_id in (1, 2, 3):
+            for pair in PAIRS:
+                if generator.random() < 0.6:
+                    # Часті повтори - skip-duplicate мусить переглядати кілька записів
+                    rows.append(rate(channel_id, pair, generator.choice([41.0, 41.1]), generator.choice([41.5, 41.6]), ts(10 + minute // 60, minute % 60)))
+    repository.insert_rates(rows)
+
+    lookups = []
+    for channel_id in (1, 2, 3, 4):
+        for pair in PAIRS:
+            currency_a, currency_b = pair.split("/")
+            current_buy, current_sell = generator.choice([41.0, 41.1]), generator.choice([41.5, 41.6])
+            for compare_value_type in ("buy", "sell", "both"):
+                lookups.append({
+                    "channel_id": channel_id, "currency_a": currency_a, "currency_b": currency_b,
+                    "current_buy": current_buy, "current_sell": current_sell,
+                    "compare_value_type": compare_value_type
+                })
+
+    expected = []
+    for lookup in lookups:
+        key = (lookup["channel_id"], lookup["currency_a"], lookup["currency_b"])
+        records = repository.rates_for_keys([key], limit=trends.HISTORY_DEPTH)
+        expected.append(find_baseline(records, lookup["current_buy"], lookup["current_sell"], lookup["compare_value_type"]))
+
+    assert find_previous_rates_batch(lookups, strict=True) == expected
+    assert any(result is not None for result in expected)
+    assert any(result is None for result in expected)
+
+
+def test_batch_lookup_pages_through_tied_timestamps(repository, monkeypatch):
+    # Повна сторінка з однаковим edited: решта записів з тим самим edited не губиться
+    monkeypatch.setattr(trends, "BATCH_PAGE_SIZE", 4)
+    keys = [(channel_id, "USD", "UAH") for channel_id in (1, 2, 3, 4)] + [(1, "EUR", "UAH")]
+    repository.insert_rates(
+        [rate(channel_id, f"{a}/{b}", 41.0, 41.5, ts(9)) for channel_id, a, b in keys]
+        + [rate(channel_id, f"{a}/{b}", 41.2, 41.7, ts(10)) for channel_id, a, b in keys]
+    )
+
+    lookups = [{
+        "channel_id": channel_id, "currency_a": a, "currency_b": b,
+        "current_buy": 41.2, "current_sell": 41.7, "compare_value_type": "buy"
+    } for channel_id, a, b in keys]
+    assert find_previous_rates_batch(lookups, strict=True) == [{"buy": 41.0, "sell": 41.5}] * len(keys)
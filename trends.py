@@ -0,0 +1,208 @@
+"""
+Batch trend engine для /rates/bestrate.
+
+Замість окремого запиту історії на кожного найкращого обмінника
+(2 запити на валютну пару) отримуємо історію для всіх переможців кількома
+bulk-запитами і виконуємо skip-duplicate логіку в пам'яті.
+"""
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from storage import get_repository
+
+logger = logging.getLogger(__name__)
+
+# Скільки записів на (channel_id, currency_a, currency_b) переглядає skip-duplicate
+# (так само, як .limit(100) в окремому запиті на обмінника)
+HISTORY_DEPTH = 100
+
+# Максимальна кількість рядків, яку PostgREST віддає за один запит
+BATCH_PAGE_SIZE = 1000
+
+TrendKey = Tuple[int, str, str]
+
+
+def is_value_different(current: Optional[float], previous: Optional[float]) -> bool:
+    """Чи відрізняються два значення курсу (з урахуванням None та floating point похибки)."""
+    return (current is not None and previous is not None and abs(current - previous) > 0.0001) or \
+           (current is None) != (previous is None)
+
+
+def match_baseline(record: dict, current_buy: Optional[float], current_sell: Optional[float], compare_value_type: str = "both") -> Optional[dict]:
+    """
+    Перевіряє один попередній запис за правилами skip-duplicate.
+
+    Returns:
+        dict з полями "buy" та "sell", якщо запис відрізняється від поточного
+        (це baseline для тренду), інакше None (дублікат, шукаємо далі)
+    """
+    prev_buy = record.get("buy")
+    prev_sell = record.get("sell")
+
+    if compare_value_type == "buy":
+        # Для BUY: порівнюємо тільки buy значення
+        different = is_value_different(current_buy, prev_buy)
+    elif compare_value_type == "sell":
+        # Для SELL: порівнюємо тільки sell значення
+        different = is_value_different(current_sell, prev_sell)
+    else:
+        # Старий режим "both": достатньо, щоб відрізнялося хоча б одне значення
+        different = is_value_different(current_buy, prev_buy) or is_value_different(current_sell, prev_sell)
+
+    if different:
+        return {
+            "buy": prev_buy,
+            "sell": prev_sell
+        }
+    return None
+
+
+def find_baseline(records: List[dict], current_buy: Optional[float], current_sell: Optional[float], compare_value_type: str = "both") -> Optional[dict]:
+    """
+    Skip-duplicate пошук baseline у вже отриманій історії.
+
+    Args:
+        records: Записи одного обмінника та пари, відсортовані за edited DESC
+                 (records[0] — поточний запис, його пропускаємо)
+        current_buy: Поточне значення buy
+        current_sell: Поточне значення sell
+        compare_value_type: "buy", "sell" або "both"
+
+    Returns:
+        dict з полями "buy" та "sell" або None якщо всі попередні значення однакові
+    """
+    for record in records[1:HISTORY_DEPTH]:
+        baseline = match_baseline(record, current_buy, current_sell, compare_value_type)
+        if baseline:
+            return baseline
+    return None
+
+
+def find_previous_rates_batch(lookups: List[dict], strict: bool = False) -> List[Optional[dict]]:
+    """
+    Попередні курси (skip-duplicate) для багатьох обмінників і пар одночасно.
+
+    Історія для всіх ключів читається сторінками (keyset за (edited, id) DESC), причому
+    кожна наступна сторінка запитується лише для ключів, які ще не визначились.
+    Ключ визначений, коли для всіх його lookup знайдено baseline або переглянуто
+    HISTORY_DEPTH записів. Зазвичай вистачає одного-двох запитів.
+
+    Args:
+        lookups: Список dict з полями channel_id, currency_a, currency_b,
+                 current_buy, current_sell, compare_value_type
+        strict: Піднімати помилку бази замість результату "усі None"
+                (щоб не запам'ятати хибні baseline)
+
+    Returns:
+        Список результатів у тому ж порядку, що й lookups
+        (dict з "buy"/"sell" або None, якщо всі попередні значення однакові)
+    """
+    results: List[Optional[dict]] = [None] * len(lookups)
+    if not lookups:
+        return results
+
+    # Які lookup (індекси) чекають baseline для кожного ключа
+    pending: Dict[TrendKey, List[int]] = {}
+    for index, lookup in enumerate(lookups):
+        key = (lookup["channel_id"], lookup["currency_a"], lookup["currency_b"])
+        pending.setdefault(key, []).append(index)
+
+    seen_counts: Dict[TrendKey, int] = {}
+    after = None  # (edited, id) останнього запису попередньої сторінки
+
+    try:
+        while pending:
+            rows = get_repository().rates_for_keys(list(pending.keys()), after=after, limit=BATCH_PAGE_SIZE)
+            page_full = len(rows) >= BATCH_PAGE_SIZE
+            if rows:
+                # id робить курсор однозначним і для записів з однаковим edited на межі сторінок
+                after = (rows[-1]["edited"], rows[-1]["id"])
+
+            for row in rows:
+                key = (row.get("channel_id"), row.get("currency_a"), row.get("currency_b"))
+                waiting = pending.get(key)
+                if waiting is None:
+                    continue
+
+                seen = seen_counts.get(key, 0)
+                seen_counts[key] = seen + 1
+
+                # Перший запис ключа - поточний, пропускаємо
+                if seen > 0:
+                    still_waiting = []
+                    for index in waiting:
+                        lookup = lookups[index]
+                        baseline = match_baseline(
+                            row, lookup.get("current_buy"), lookup.get("current_sell"),
+                            lookup.get("compare_value_type", "both")
+                        )
+                        if baseline:
+                            results[index] = baseline
+                        else:
+                            still_waiting.append(index)
+                    waiting = still_waiting
+
+                if not waiting or seen_counts[key] >= HISTORY_DEPTH:
+                    # Усі baseline знайдені або досягли ліміту історії (→ "stable")
+                    del pending[key]
+                else:
+                    pending[key] = waiting
+
+            if not page_full:
+                break
+
+        return results
+
+    except Exception as e:
+        if strict:
+            raise
+        logger.warning(f"Error in batch trend lookup for {len(pending)} keys: {e}")
+        return [None] * len(lookups)
+
+
+def calculate_trend_and_changes(current_value: Optional[float], previous_value: Optional[float]) -> dict:
+    """
+    Розраховує тренд та зміни для одного значення (buy або sell).
+    
+    Args:
+        current_value: Поточне значення
+        previous_value: Попереднє значення
+    
+    Returns:
+        dict з полями:
+        - trend: "up", "down", або "stable"
+        - change_abs: Абсолютна зміна (округлена до 2 знаків)
+        - change_pct: Відсоткова зміна (округлена до 2 знаків)
+    """
+    # Якщо немає попереднього значення або поточне значення None → стабільний
+    if previous_value is None or current_value is None:
+        return {
+            "trend": "stable",
+            "change_abs": 0.0,
+            "change_pct": 0.0
+        }
+    
+    # Розраховуємо абсолютну зміну
+    change_abs = round(current_value - previous_value, 2)
+    
+    # Розраховуємо відсоткову зміну
+    if previous_value != 0:
+        change_pct = round((change_abs / previous_value) * 100, 2)
+    else:
+        change_pct = 0.0
+    
+    # Визначаємо тренд
+    if change_abs > 0.0001:  # Невеликий поріг для уникнення floating point помилок
+        trend = "up"
+    elif change_abs < -0.0001:
+        trend = "down"
+    else:
+        trend = "stable"
+        change_abs = 0.0  # Округлюємо до 0 якщо зміна мінімальна
+        change_pct = 0.0
+    
+    return {
+        "trend": trend,
+        "change_abs": change_abs,
+        "change_pct": change_pct
+    }